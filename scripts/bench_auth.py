@@ -0,0 +1,63 @@
+"""鉴权开销基准：测量 get_current_account 单次调用耗时，并与固定预算比对。
+
+在临时目录中建库（写入示例账号）、登录签发令牌，分别测量：
+缓存命中（常态请求）、仅签名校验（令牌缓存未命中）与账号查询（账号缓存未命中）。
+缓存命中的中位数超过 AUTH_OVERHEAD_BUDGET_US 时以非零状态退出，可放进 CI。
+
+用法：PYTHONPATH=src python scripts/bench_auth.py [迭代次数，默认 100000]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+AUTH_OVERHEAD_BUDGET_US = 20.0
+
+
+def timed(fn, iterations: int) -> float:
+    """返回单次调用耗时中位数（微秒），按 10 批分别计时。"""
+    batch = max(iterations // 10, 1)
+    samples = []
+    for _ in range(10):
+        start = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        samples.append((time.perf_counter() - start) / batch * 1e6)
+    return statistics.median(samples)
+
+
+def main() -> int:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    # 数据库与签名密钥文件都相对工作目录，切到临时目录避免污染真实数据
+    os.chdir(tempfile.mkdtemp())
+
+    from maidmanager import security
+    from maidmanager.database import init_db
+
+    init_db()
+    header = f"Bearer {security.issue_token('manager')}"
+    security.get_current_account(header)
+
+    warm = timed(lambda: security.get_current_account(header), iterations)
+    token = header.split(" ", 1)[1]
+    verify = timed(lambda: security._verify_token(token), iterations)
+
+    def account_miss() -> None:
+        security.invalidate_account("manager")
+        security.load_account("manager")
+
+    lookup = timed(account_miss, max(iterations // 100, 10))
+
+    print(f"缓存命中          {warm:8.2f} µs/请求（预算 {AUTH_OVERHEAD_BUDGET_US:.0f} µs）")
+    print(f"令牌签名校验      {verify:8.2f} µs")
+    print(f"账号查询（未命中）{lookup:8.2f} µs")
+    if warm > AUTH_OVERHEAD_BUDGET_US:
+        print("超出鉴权开销预算")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
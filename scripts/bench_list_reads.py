@@ -0,0 +1,155 @@
+"""列表读接口基准：对比 ORM 实例与 Core select() 命名行两种读取路径。
+
+在临时 SQLite 库中写入 N 行订单/支出/员工，对每个列表分别执行
+「查询 + 按响应模型校验 + 序列化为 JSON」，输出单次请求的 CPU 时间与 tracemalloc 峰值内存。
+
+用法：PYTHONPATH=src python scripts/bench_list_reads.py [行数，默认 5000] [重复次数，默认 20]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from maidmanager import models, schemas
+from maidmanager.database import Base
+from maidmanager.routers.expenses import _EXPENSE_READ_COLUMNS
+from maidmanager.routers.orders import _ORDER_READ_COLUMNS
+from maidmanager.routers.staff import _STAFF_READ_COLUMNS
+
+OWNER = "manager"
+
+
+def seed(session: Session, rows: int) -> None:
+    session.execute(
+        insert(models.Staff),
+        [
+            {"name": f"staff{i}", "status": "active", "base_salary": 3000.0, "owner": OWNER}
+            for i in range(rows)
+        ],
+    )
+    session.execute(
+        insert(models.Order),
+        [
+            {
+                "staff_id": i % rows + 1,
+                "customer_name": f"客户{i}",
+                "order_date": "2026-10-01",
+                "start_datetime": "2026-10-01 10:00:00",
+                "end_datetime": "2026-10-01 11:00:00",
+                "duration_minutes": 60,
+                "booked_minutes": 60,
+                "total_amount": 200.0,
+                "package_name": "标准 60 分钟",
+                "extension_package_ids": "[]",
+                "commission_amount": 80.0,
+                "status": "completed",
+                "owner": OWNER,
+            }
+            for i in range(rows)
+        ],
+    )
+    session.execute(
+        insert(models.Expense),
+        [
+            {"title": f"支出{i}", "amount": 10.0, "expense_date": "2026-10-01", "owner": OWNER}
+            for i in range(rows)
+        ],
+    )
+    session.commit()
+
+
+def measure(fn: Callable[[], bytes], repeat: int) -> tuple[float, float]:
+    """返回 (CPU 毫秒中位数, 峰值分配 MiB)。"""
+    fn()
+    cpu: List[float] = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        cpu.append((time.process_time() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(cpu), peak / 1024 / 1024
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, rows)
+
+    staff_list = TypeAdapter(List[schemas.StaffRead])
+    order_list = TypeAdapter(List[schemas.OrderRead])
+    expense_list = TypeAdapter(List[schemas.ExpenseRead])
+
+    def render(adapter: TypeAdapter, data) -> bytes:
+        # 与 FastAPI 处理 response_model 的方式一致：按属性校验后序列化
+        return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+    def orm_staff() -> bytes:
+        with Session(engine) as session:
+            return render(staff_list, session.query(models.Staff).filter_by(owner=OWNER).all())
+
+    def core_staff() -> bytes:
+        with Session(engine) as session:
+            stmt = select(*_STAFF_READ_COLUMNS).where(models.Staff.owner == OWNER)
+            return render(staff_list, session.execute(stmt).all())
+
+    def orm_orders() -> bytes:
+        with Session(engine) as session:
+            result = session.query(models.Order, models.Staff.name.label("staff_name")).join(
+                models.Staff, models.Staff.id == models.Order.staff_id
+            ).filter(models.Order.owner == OWNER)
+            data = [
+                schemas.OrderRead(
+                    staff_name=staff_name,
+                    **{column.key: getattr(order, column.key) for column in _ORDER_READ_COLUMNS},
+                )
+                for order, staff_name in result
+            ]
+            return render(order_list, data)
+
+    def core_orders() -> bytes:
+        with Session(engine) as session:
+            stmt = (
+                select(*_ORDER_READ_COLUMNS, models.Staff.name.label("staff_name"))
+                .join(models.Staff, models.Staff.id == models.Order.staff_id)
+                .where(models.Order.owner == OWNER)
+            )
+            return render(order_list, session.execute(stmt).all())
+
+    def orm_expenses() -> bytes:
+        with Session(engine) as session:
+            return render(expense_list, session.query(models.Expense).filter_by(owner=OWNER).all())
+
+    def core_expenses() -> bytes:
+        with Session(engine) as session:
+            stmt = select(*_EXPENSE_READ_COLUMNS).where(models.Expense.owner == OWNER)
+            return render(expense_list, session.execute(stmt).all())
+
+    print(f"{rows} 行，每项重复 {repeat} 次")
+    print(f"{'接口':<10}{'路径':<6}{'CPU ms':>10}{'峰值 MiB':>12}")
+    for name, orm_fn, core_fn in (
+        ("staff", orm_staff, core_staff),
+        ("orders", orm_orders, core_orders),
+        ("expenses", orm_expenses, core_expenses),
+    ):
+        for label, fn in (("ORM", orm_fn), ("Core", core_fn)):
+            cpu, peak = measure(fn, repeat)
+            print(f"{name:<10}{label:<6}{cpu:>10.1f}{peak:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""撞单压力测试：多进程、多线程并发提交时间段互相重叠的订单，检查没有员工被重复预约。
+
+在临时目录中建库并创建员工与套餐，随后每个进程各自启动应用（与多 worker 部署相同，
+共享同一个账号分库），各线程通过 POST /api/orders 随机预约同一天内 15 分钟粒度、
+时长 60 分钟的时段，大部分请求会与其他请求冲突。结束后统计成功 / 撞单拒绝 / 其他失败，
+输出吞吐，并在分库中查找同一员工未取消订单的时间重叠；存在重叠时以非零状态退出。
+
+用法：PYTHONPATH=src python scripts/stress_overlap.py [进程数，默认 4] [每进程线程数，默认 4] [每线程请求数，默认 50]
+"""
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+DAY = "2026-10-01"
+STAFF_COUNT = 3
+OPENING_MINUTES = 10 * 60
+SLOT_MINUTES = 15
+SLOTS = 48  # 10:00 起 12 小时
+DURATION_MINUTES = 60
+
+DOUBLE_BOOKINGS = """
+    SELECT a.id, b.id, a.staff_id, a.start_datetime, a.end_datetime,
+           b.start_datetime, b.end_datetime
+    FROM orders a
+    JOIN orders b
+      ON a.owner = b.owner
+     AND a.staff_id = b.staff_id
+     AND a.id < b.id
+     AND a.start_datetime < b.end_datetime
+     AND a.end_datetime > b.start_datetime
+    WHERE a.status != 'cancelled' AND b.status != 'cancelled'
+"""
+
+
+def clock(minutes: int) -> str:
+    return f"{DAY} {minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def worker(
+    workdir: str,
+    headers: Dict[str, str],
+    staff_ids: List[int],
+    package_id: int,
+    threads: int,
+    requests: int,
+    seed: int,
+) -> Counter:
+    """单个进程：启动应用并用多线程提交订单，返回各结果的计数。"""
+    warnings.filterwarnings("ignore")
+    os.chdir(workdir)
+    from fastapi.testclient import TestClient
+
+    from maidmanager.main import app
+
+    def book(thread: int) -> Counter:
+        rng = random.Random(seed * 1000 + thread)
+        outcome: Counter = Counter()
+        for _ in range(requests):
+            start = OPENING_MINUTES + rng.randrange(SLOTS) * SLOT_MINUTES
+            response = client.post(
+                "/api/orders",
+                headers=headers,
+                json={
+                    "staff_id": rng.choice(staff_ids),
+                    "package_id": package_id,
+                    "start_datetime": clock(start),
+                    "end_datetime": clock(start + DURATION_MINUTES),
+                    "total_amount": 200,
+                },
+            )
+            if response.status_code == 201:
+                outcome["created"] += 1
+            elif response.status_code == 400:
+                outcome["rejected"] += 1
+            else:
+                outcome[f"http_{response.status_code}"] += 1
+        return outcome
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return sum(pool.map(book, range(threads)), Counter())
+
+
+def main() -> int:
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    warnings.filterwarnings("ignore")
+    # 数据库、分库与签名密钥都相对工作目录，切到临时目录避免污染真实数据
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+
+    from fastapi.testclient import TestClient
+
+    from maidmanager.database import shards
+    from maidmanager.main import app
+
+    with TestClient(app) as client:
+        token = client.post(
+            "/api/login", json={"username": "manager", "password": "manager123"}
+        ).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        staff_ids = [
+            client.post(
+                "/api/staff",
+                headers=headers,
+                json={"name": f"员工{i}", "commission_type": "percentage", "commission_value": 0.5},
+            ).json()["id"]
+            for i in range(STAFF_COUNT)
+        ]
+        package_id = client.post(
+            "/api/packages",
+            headers=headers,
+            json={"name": "60 分钟", "duration_minutes": DURATION_MINUTES, "price": 200},
+        ).json()["id"]
+    shard_path = os.path.abspath(shards.path("manager"))
+
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results = pool.starmap(
+            worker,
+            [
+                (workdir, headers, staff_ids, package_id, threads, requests, seed)
+                for seed in range(processes)
+            ],
+        )
+    elapsed = time.perf_counter() - started
+    outcome = sum(results, Counter())
+
+    with sqlite3.connect(shard_path) as conn:
+        overlaps = conn.execute(DOUBLE_BOOKINGS).fetchall()
+        booked = conn.execute(
+            "SELECT COUNT(*) FROM orders WHERE status != 'cancelled'"
+        ).fetchone()[0]
+
+    total = sum(outcome.values())
+    print(f"{processes} 进程 × {threads} 线程 × {requests} 次，共 {total} 次请求，用时 {elapsed:.2f}s")
+    print(f"吞吐 {total / elapsed:.1f} req/s，其中成功下单 {outcome['created'] / elapsed:.1f} 单/s")
+    for name, count in sorted(outcome.items()):
+        print(f"  {name:<10}{count:>8}")
+    print(f"分库中未取消订单 {booked} 条，重复预约 {len(overlaps)} 对")
+    for row in overlaps[:10]:
+        print("  ", row)
+    if overlaps:
+        return 1
+    if booked != outcome["created"]:
+        print("分库订单数与成功响应数不一致")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
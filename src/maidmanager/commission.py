@@ -0,0 +1,839 @@
+"""按生效日期版本化的提成配置，与基于版本索引的提成计算、历史月份重算。
+
+员工提成方式/数值、套餐价格/默认提成、员工套餐固定提成的每次修改都写入
+commission_versions（自 effective_from 起生效），原表只保存最新配置供页面展示。
+订单提成按订单日期取当时有效的版本：版本按 (员工, 套餐, 日期) 排序后整理成
+numpy 数组，单笔开单与整月重算走同一个向量化查找，保证口径一致。
+
+分档提成（tiered）按员工当月已完成订单的排位计提：第 1..up_to 单按第一档比例，
+之后按下一档，依此类推。月度累计保存在 staff_tier_totals，随订单完成/取消增量维护。
+"""
+
+import json
+import math
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from .database import VersionedCache
+
+# 新建员工/套餐时的配置对此前的日期同样有效（补录的历史订单也能取到版本）
+BEGINNING = "0001-01-01"
+
+COMMISSION_TYPES = ("percentage", "fixed", "tiered")
+_TYPE_CODES = {name: code for code, name in enumerate(COMMISSION_TYPES)}
+
+# 复合键：(员工, 套餐) 在有序键表中的序号 * _DAY_SPAN + YYYYMMDD
+_DAY_SPAN = 100_000_000
+_PAIR_SHIFT = 31
+
+
+def day_number(value: str) -> int:
+    """YYYY-MM-DD -> YYYYMMDD 整数，与 SQL 中 replace(date, '-', '') 一致。"""
+    return int(value[:10].replace("-", ""))
+
+
+def effective_date(raw: Optional[str]) -> Optional[str]:
+    """校验接口传入的生效日期；未传时返回 None（见 _record）。"""
+    if raw is None:
+        return None
+    try:
+        datetime.strptime(raw, "%Y-%m-%d")
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="effective_from 必须是 YYYY-MM-DD 格式",
+        ) from exc
+    return raw
+
+
+def parse_tiers(raw: Optional[str]) -> List[Tuple[float, float]]:
+    """分档 JSON -> [(本档截至单数, 比例)]，最后一档截至为 inf。"""
+    return [
+        (math.inf if tier.get("up_to") is None else float(tier["up_to"]), float(tier["rate"]))
+        for tier in json.loads(raw or "[]")
+    ]
+
+
+def check_commission_type(commission_type: str) -> None:
+    if commission_type not in COMMISSION_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="commission_type 仅支持 percentage、fixed 或 tiered",
+        )
+
+
+def tiers_json(tiers: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """校验分档并转为 JSON：截至单数为正整数且递增，仅最后一档不封顶。"""
+    if not tiers:
+        return None
+    bounds = [tier.get("up_to") for tier in tiers]
+    if (
+        bounds[-1] is not None
+        or any(bound is None or bound <= 0 for bound in bounds[:-1])
+        or any(a >= b for a, b in zip(bounds[:-2], bounds[1:-1]))
+        or any(tier["rate"] < 0 for tier in tiers)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="分档需按截至单数递增、最后一档不封顶（up_to 为空），比例不能为负数",
+        )
+    return json.dumps(
+        [{"up_to": tier.get("up_to"), "rate": tier["rate"]} for tier in tiers]
+    )
+
+
+def _pair_keys(staff_ids: np.ndarray, package_ids: np.ndarray) -> np.ndarray:
+    return (staff_ids.astype(np.int64) << _PAIR_SHIFT) | package_ids.astype(np.int64)
+
+
+@dataclass(frozen=True)
+class CommissionHistory:
+    """提成配置版本索引：按 (员工, 套餐) 分段、段内按生效日期升序。"""
+
+    pairs: np.ndarray  # 有序去重的 (员工, 套餐) 键
+    index: np.ndarray  # 每个版本的复合键，升序
+    kind: np.ndarray  # 提成方式编码（COMMISSION_TYPES 下标，未知为 -1）
+    value: np.ndarray  # commission_value
+    price: np.ndarray
+    default_commission: np.ndarray
+    tier_bounds: np.ndarray  # (版本数, 档数) 各档截至单数，不足的档以 inf 补齐
+    tier_rates: np.ndarray  # (版本数, 档数) 各档比例
+    tier_schedules: Tuple[Optional[str], ...]  # 各版本的分档 JSON
+
+    def _lookup(
+        self, staff_ids: np.ndarray, package_ids: np.ndarray, days: np.ndarray
+    ) -> np.ndarray:
+        """每个 (员工, 套餐, 日期) 当时有效的版本下标；没有版本时为 -1。"""
+        if not len(self.pairs):
+            return np.full(len(days), -1, dtype=np.int64)
+        wanted = _pair_keys(staff_ids, package_ids)
+        slot = np.minimum(np.searchsorted(self.pairs, wanted), len(self.pairs) - 1)
+        found = self.pairs[slot] == wanted
+        pos = np.searchsorted(self.index, slot * _DAY_SPAN + days, side="right") - 1
+        valid = found & (pos >= 0) & (self.index[np.maximum(pos, 0)] // _DAY_SPAN == slot)
+        return np.where(valid, pos, -1)
+
+    def commissions(
+        self,
+        staff_ids: Sequence[int],
+        package_ids: Sequence[int],
+        days: Sequence[int],
+    ) -> np.ndarray:
+        """按日期取当时有效的配置，批量计算单个套餐的提成。
+
+        percentage：套餐价格 × 员工提成比例；fixed：员工套餐固定提成，未配置时取套餐默认提成；
+        tiered：套餐价格 × 第一档比例（完成后由月度累计按排位改写）。
+        员工或套餐在该日期没有任何版本时提成为 0。
+        """
+        staff_ids = np.asarray(staff_ids, dtype=np.int64)
+        package_ids = np.asarray(package_ids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        if not len(days):
+            return np.zeros(0)
+        zeros = np.zeros_like(staff_ids)
+        staff_pos = self._lookup(staff_ids, zeros, days)
+        pkg_pos = self._lookup(zeros, package_ids, days)
+        pair_pos = self._lookup(staff_ids, package_ids, days)
+
+        has_staff = staff_pos >= 0
+        has_pkg = pkg_pos >= 0
+        kind = np.where(has_staff, self.kind[staff_pos], -1)
+        rate = np.where(has_staff, self.value[staff_pos], 0.0)
+        price = np.where(has_pkg, self.price[pkg_pos], 0.0)
+        default = np.where(has_pkg, self.default_commission[pkg_pos], 0.0)
+        fixed = np.where(pair_pos >= 0, self.value[pair_pos], default)
+
+        first_tier = np.where(has_staff, self.tier_rates[staff_pos, 0], 0.0)
+
+        result = np.select(
+            [
+                kind == _TYPE_CODES["percentage"],
+                kind == _TYPE_CODES["fixed"],
+                kind == _TYPE_CODES["tiered"],
+            ],
+            [price * rate, fixed, price * first_tier],
+            default=0.0,
+        )
+        return np.where(has_pkg & (package_ids > 0), result, 0.0)
+
+    def commission(self, staff_id: int, package_id: int, order_date: str) -> float:
+        return float(self.commissions([staff_id], [package_id], [day_number(order_date)])[0])
+
+    def prices(self, package_ids: Sequence[int], days: Sequence[int]) -> np.ndarray:
+        """套餐在各日期当时的价格（分档/比例提成的基数）。"""
+        package_ids = np.asarray(package_ids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        pos = self._lookup(np.zeros_like(package_ids), package_ids, days)
+        return np.where(pos >= 0, self.price[pos], 0.0) if len(days) else np.zeros(0)
+
+    def tiered(self, staff_ids: Sequence[int], days: Sequence[int]) -> np.ndarray:
+        """员工在各日期是否按分档提成。"""
+        staff_ids = np.asarray(staff_ids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        if not len(days):
+            return np.zeros(0, dtype=bool)
+        pos = self._lookup(staff_ids, np.zeros_like(staff_ids), days)
+        return (pos >= 0) & (self.kind[pos] == _TYPE_CODES["tiered"])
+
+    def tier_at(
+        self, staff_ids: Sequence[int], days: Sequence[int], ranks: Sequence[int]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """当月第 rank 单（从 1 起）在订单日期的分档下所在的档位与比例。"""
+        staff_ids = np.asarray(staff_ids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        ranks = np.asarray(ranks, dtype=float)
+        if not len(days):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        pos = self._lookup(staff_ids, np.zeros_like(staff_ids), days)
+        tier = (ranks[:, None] > self.tier_bounds[pos]).sum(axis=1)
+        rate = self.tier_rates[pos, np.minimum(tier, self.tier_rates.shape[1] - 1)]
+        return np.where(pos >= 0, tier, 0), np.where(pos >= 0, rate, 0.0)
+
+    def schedule(self, staff_id: int, order_date: str) -> str:
+        pos = int(self._lookup(
+            np.array([staff_id]), np.array([0]), np.array([day_number(order_date)])
+        )[0])
+        return (self.tier_schedules[pos] if pos >= 0 else None) or "[]"
+
+
+class VersionRow(NamedTuple):
+    """一条提成配置版本；day 为生效日期的 YYYYMMDD 整数。"""
+
+    staff_id: int
+    package_id: int
+    day: int
+    commission_type: Optional[str]
+    commission_value: Optional[float]
+    price: Optional[float]
+    default_commission: Optional[float]
+    commission_tiers: Optional[str]
+
+
+def load_versions(db: Session, owner: str) -> List[VersionRow]:
+    rows = db.execute(
+        text(
+            "SELECT staff_id, package_id, "
+            "CAST(replace(effective_from, '-', '') AS INTEGER) AS day, "
+            "commission_type, commission_value, price, default_commission, commission_tiers "
+            "FROM commission_versions WHERE owner = :owner "
+            "ORDER BY staff_id, package_id, effective_from"
+        ),
+        {"owner": owner},
+    )
+    return [VersionRow(*row) for row in rows]
+
+
+def load_commission_history(db: Session, owner: str) -> CommissionHistory:
+    return build_commission_history(load_versions(db, owner))
+
+
+def build_commission_history(rows: Sequence[VersionRow]) -> CommissionHistory:
+    """由按 (员工, 套餐, 生效日期) 排序的版本构建索引。"""
+    keys = _pair_keys(
+        np.fromiter((row.staff_id for row in rows), dtype=np.int64, count=len(rows)),
+        np.fromiter((row.package_id for row in rows), dtype=np.int64, count=len(rows)),
+    )
+    pairs, slots = np.unique(keys, return_inverse=True)
+    days = np.fromiter((row.day for row in rows), dtype=np.int64, count=len(rows))
+
+    def floats(name: str) -> np.ndarray:
+        return np.array(
+            [getattr(row, name) or 0.0 for row in rows], dtype=float
+        )
+
+    tiers = [parse_tiers(row.commission_tiers) for row in rows]
+    width = max([len(schedule) for schedule in tiers] + [1])
+    tier_bounds = np.full((len(rows), width), math.inf)
+    tier_rates = np.zeros((len(rows), width))
+    for i, schedule in enumerate(tiers):
+        for j, (bound, rate) in enumerate(schedule):
+            tier_bounds[i, j] = bound
+            tier_rates[i, j] = rate
+
+    return CommissionHistory(
+        pairs=pairs,
+        index=slots.astype(np.int64) * _DAY_SPAN + days,
+        kind=np.array(
+            [_TYPE_CODES.get(row.commission_type, -1) for row in rows], dtype=np.int64
+        ),
+        value=floats("commission_value"),
+        price=floats("price"),
+        default_commission=floats("default_commission"),
+        tier_bounds=tier_bounds,
+        tier_rates=tier_rates,
+        tier_schedules=tuple(row.commission_tiers for row in rows),
+    )
+
+
+# 整月重算等不经过开单缓存的调用方使用；多 worker 下以 commission_versions 的数据版本校验
+commission_history: VersionedCache[CommissionHistory] = VersionedCache(
+    ("commission_versions",), load_commission_history
+)
+
+_UPSERT_SQL = text(
+    "INSERT INTO commission_versions "
+    "(owner, staff_id, package_id, effective_from, commission_type, "
+    "commission_value, price, default_commission, commission_tiers, created_at) "
+    "VALUES (:owner, :staff_id, :package_id, COALESCE(:effective_from, CASE WHEN EXISTS ("
+    "SELECT 1 FROM commission_versions WHERE owner = :owner "
+    "AND staff_id = :staff_id AND package_id = :package_id"
+    ") THEN :today ELSE :beginning END), :commission_type, "
+    ":commission_value, :price, :default_commission, :commission_tiers, :created_at) "
+    "ON CONFLICT (owner, staff_id, package_id, effective_from) DO UPDATE SET "
+    "commission_type = excluded.commission_type, "
+    "commission_value = excluded.commission_value, "
+    "price = excluded.price, "
+    "default_commission = excluded.default_commission, "
+    "commission_tiers = excluded.commission_tiers, "
+    "created_at = excluded.created_at"
+)
+
+
+def _record(
+    db: Session, owner: str, effective_from: Optional[str], rows: List[Dict]
+) -> None:
+    """写入配置版本；未指定生效日期时自今天起生效，该 (员工, 套餐) 首次配置则自始生效。"""
+    if not rows:
+        return
+    created_at = datetime.utcnow()
+    defaults = {
+        "staff_id": 0,
+        "package_id": 0,
+        "commission_type": None,
+        "commission_value": None,
+        "price": None,
+        "default_commission": None,
+        "commission_tiers": None,
+    }
+    db.execute(
+        _UPSERT_SQL,
+        [
+            {
+                **defaults,
+                **row,
+                "owner": owner,
+                "effective_from": effective_from,
+                "today": date.today().strftime("%Y-%m-%d"),
+                "beginning": BEGINNING,
+                "created_at": created_at,
+            }
+            for row in rows
+        ],
+    )
+
+
+def record_staff_rule(
+    db: Session,
+    owner: str,
+    staff_id: int,
+    commission_type: str,
+    commission_value: float,
+    commission_tiers: Optional[str],
+    effective_from: Optional[str],
+) -> None:
+    """记录员工提成方式/数值/分档的新版本（不提交；同一生效日重复修改时覆盖）。"""
+    _record(
+        db,
+        owner,
+        effective_from,
+        [
+            {
+                "staff_id": staff_id,
+                "commission_type": commission_type,
+                "commission_value": commission_value or 0.0,
+                "commission_tiers": commission_tiers,
+            }
+        ],
+    )
+
+
+def record_package_rule(
+    db: Session,
+    owner: str,
+    package_id: int,
+    price: float,
+    default_commission: float,
+    effective_from: Optional[str],
+) -> None:
+    """记录套餐价格/默认提成的新版本（不提交）。"""
+    _record(
+        db,
+        owner,
+        effective_from,
+        [
+            {
+                "package_id": package_id,
+                "price": price or 0.0,
+                "default_commission": default_commission or 0.0,
+            }
+        ],
+    )
+
+
+def record_fixed_rules(
+    db: Session,
+    owner: str,
+    staff_id: int,
+    amounts: Dict[int, float],
+    effective_from: Optional[str],
+) -> None:
+    """记录员工套餐固定提成的新版本，一条 executemany 写入（不提交）。"""
+    _record(
+        db,
+        owner,
+        effective_from,
+        [
+            {"staff_id": staff_id, "package_id": package_id, "commission_value": amount}
+            for package_id, amount in amounts.items()
+        ],
+    )
+
+
+# ---------------------------------------------------------------------------
+# 分档提成：员工当月已完成订单按 (开始时间, id) 排位，第 rank 单按所在档位比例计提
+# ---------------------------------------------------------------------------
+
+# 计入分档累计的订单快照：(订单 id, 员工 id, 订单日期, 开始时间, 提成基数, 提成)
+TierSnapshot = Tuple[int, int, str, str, float, float]
+_TierKey = Tuple[int, str]  # (员工 id, YYYY-MM)
+
+
+def tier_snapshots(history: CommissionHistory, orders: Iterable[Any]) -> List[TierSnapshot]:
+    """已完成且订单日期适用分档提成的订单快照（订单对象或命名行均可）。"""
+    orders = [order for order in orders if order.status == "completed" and order.staff_id]
+    tiered = history.tiered(
+        [order.staff_id for order in orders],
+        [day_number(order.order_date) for order in orders],
+    )
+    return [
+        (
+            order.id,
+            order.staff_id,
+            order.order_date,
+            order.start_datetime,
+            float(order.commission_basis or 0.0),
+            float(order.commission_amount or 0.0),
+        )
+        for order, flag in zip(orders, tiered)
+        if flag
+    ]
+
+
+@dataclass
+class _TierTotals:
+    stats: List[List[float]] = field(default_factory=list)  # 每档 [单数, 基数, 提成]
+    schedule: str = "[]"
+    last_start: str = ""
+    last_order_id: int = 0
+
+    @property
+    def order_count(self) -> int:
+        return int(round(sum(stat[0] for stat in self.stats)))
+
+    def add(self, tier: int, basis: float, amount: float, sign: int = 1) -> None:
+        while len(self.stats) <= tier:
+            self.stats.append([0, 0.0, 0.0])
+        stat = self.stats[tier]
+        stat[0] += sign
+        stat[1] += sign * basis
+        stat[2] += sign * amount
+
+
+@dataclass
+class TierUpdate:
+    commissions: Dict[int, float]  # 计入累计的订单 id -> 提成（有变化的已写库）
+    dates: Set[str]  # 提成有变化的订单日期
+
+
+_TOTALS_UPSERT_SQL = text(
+    "INSERT INTO staff_tier_totals "
+    "(owner, staff_id, month, order_count, basis_amount, commission_amount, "
+    "tier_stats, tier_schedule, last_start, last_order_id) "
+    "VALUES (:owner, :staff_id, :month, :order_count, :basis_amount, :commission_amount, "
+    ":tier_stats, :tier_schedule, :last_start, :last_order_id) "
+    "ON CONFLICT(owner, staff_id, month) DO UPDATE SET "
+    "order_count = excluded.order_count, "
+    "basis_amount = excluded.basis_amount, "
+    "commission_amount = excluded.commission_amount, "
+    "tier_stats = excluded.tier_stats, "
+    "tier_schedule = excluded.tier_schedule, "
+    "last_start = excluded.last_start, "
+    "last_order_id = excluded.last_order_id"
+)
+
+_TOTALS_SELECT_SQL = text(
+    "SELECT staff_id, month, tier_stats, tier_schedule, last_start, last_order_id "
+    "FROM staff_tier_totals "
+    "WHERE owner = :owner AND staff_id IN :staff_ids AND month IN :months"
+).bindparams(bindparam("staff_ids", expanding=True), bindparam("months", expanding=True))
+
+_TIERED_ORDERS_SQL = text(
+    "SELECT id, staff_id, order_date, start_datetime, commission_basis, commission_amount "
+    "FROM orders WHERE owner = :owner AND status = 'completed' "
+    "AND staff_id IN :staff_ids AND substr(order_date, 1, 7) IN :months "
+    "ORDER BY staff_id, substr(order_date, 1, 7), start_datetime, id"
+).bindparams(bindparam("staff_ids", expanding=True), bindparam("months", expanding=True))
+
+
+def _save_totals(db: Session, owner: str, totals: Dict[_TierKey, _TierTotals]) -> None:
+    if not totals:
+        return
+    db.execute(
+        _TOTALS_UPSERT_SQL,
+        [
+            {
+                "owner": owner,
+                "staff_id": staff_id,
+                "month": month,
+                "order_count": total.order_count,
+                "basis_amount": sum(stat[1] for stat in total.stats),
+                "commission_amount": sum(stat[2] for stat in total.stats),
+                "tier_stats": json.dumps(total.stats),
+                "tier_schedule": total.schedule,
+                "last_start": total.last_start,
+                "last_order_id": total.last_order_id,
+            }
+            for (staff_id, month), total in totals.items()
+        ],
+    )
+
+
+def _rank_tiers(
+    history: CommissionHistory, rows: Sequence[Sequence[Any]]
+) -> Tuple[Dict[_TierKey, _TierTotals], np.ndarray]:
+    """按排位计算分档提成。
+
+    rows 为 (订单 id, 员工 id, 订单日期, 开始时间, 提成基数, ...)，均为分档订单，
+    且已按 (员工, 月份, 开始时间, id) 排序；返回各 (员工, 月份) 的累计与逐单提成。
+    """
+    if not rows:
+        return {}, np.zeros(0)
+    keys = [(row[1], row[2][:7]) for row in rows]
+    first = np.array([i == 0 or keys[i] != keys[i - 1] for i in range(len(rows))])
+    group = np.cumsum(first) - 1
+    ranks = np.arange(len(rows)) - np.flatnonzero(first)[group] + 1
+    tiers, rates = history.tier_at(
+        _column(rows, 1, np.int64),
+        np.fromiter((day_number(row[2]) for row in rows), dtype=np.int64, count=len(rows)),
+        ranks,
+    )
+    basis = _column(rows, 4, float)
+    amounts = basis * rates
+
+    totals: Dict[_TierKey, _TierTotals] = {}
+    for i, row in enumerate(rows):
+        total = totals.setdefault(keys[i], _TierTotals())
+        total.add(int(tiers[i]), float(basis[i]), float(amounts[i]))
+        total.last_start, total.last_order_id = row[3], row[0]
+    for i in np.flatnonzero(np.append(first[1:], True)):
+        totals[keys[i]].schedule = history.schedule(rows[i][1], rows[i][2])
+    return totals, amounts
+
+
+def _append_in_order(
+    history: CommissionHistory,
+    total: _TierTotals,
+    removed: List[TierSnapshot],
+    added: List[TierSnapshot],
+) -> Optional[Dict[int, float]]:
+    """只移除排在最后的订单、新订单都排在已计入订单之后时 O(1) 更新累计；否则返回 None。"""
+    mark = (total.last_start, total.last_order_id)
+    added = sorted(added, key=lambda snap: (snap[3], snap[0]))
+    if len(removed) > 1 or (removed and (removed[0][3], removed[0][0]) != mark):
+        return None
+    if added and (added[0][3], added[0][0]) < mark:
+        return None
+
+    count = total.order_count
+    for snap in removed:
+        tiers, _ = history.tier_at([snap[1]], [day_number(snap[2])], [count])
+        total.add(int(tiers[0]), snap[4], snap[5], sign=-1)
+        count -= 1
+
+    result: Dict[int, float] = {}
+    for snap in added:
+        count += 1
+        tiers, rates = history.tier_at([snap[1]], [day_number(snap[2])], [count])
+        amount = snap[4] * float(rates[0])
+        total.add(int(tiers[0]), snap[4], amount)
+        total.last_start, total.last_order_id = snap[3], snap[0]
+        total.schedule = history.schedule(snap[1], snap[2])
+        result[snap[0]] = amount
+    return result
+
+
+def apply_tier_changes(
+    db: Session,
+    owner: str,
+    history: CommissionHistory,
+    removed: Sequence[TierSnapshot],
+    added: Sequence[TierSnapshot],
+) -> TierUpdate:
+    """订单移出/计入分档累计后，增量维护月度累计并改写受影响订单的提成（不提交）。
+
+    调用前需 flush 订单变更。新订单按时间顺序完成时只读写一行累计；
+    补录更早的订单或取消中间的订单会改变其后订单的排位，此时重排该员工当月订单。
+    """
+    changed: Dict[int, Tuple[str, float, float]] = {}  # 订单 id -> (日期, 当前提成, 新提成)
+
+    # 排位相关字段未变化（如只改备注）：恢复原提成，不动累计
+    previous = {snap[0]: snap for snap in removed}
+    kept = {
+        snap[0]
+        for snap in added
+        if snap[0] in previous and previous[snap[0]][:5] == snap[:5]
+    }
+    for snap in added:
+        if snap[0] in kept:
+            changed[snap[0]] = (snap[2], snap[5], previous[snap[0]][5])
+    removed = [snap for snap in removed if snap[0] not in kept]
+    added = [snap for snap in added if snap[0] not in kept]
+
+    groups: Dict[_TierKey, Tuple[List[TierSnapshot], List[TierSnapshot]]] = {}
+    for snap in removed:
+        groups.setdefault((snap[1], snap[2][:7]), ([], []))[0].append(snap)
+    for snap in added:
+        groups.setdefault((snap[1], snap[2][:7]), ([], []))[1].append(snap)
+    params = {
+        "owner": owner,
+        "staff_ids": sorted({key[0] for key in groups}),
+        "months": sorted({key[1] for key in groups}),
+    }
+    totals = {
+        (row.staff_id, row.month): _TierTotals(
+            json.loads(row.tier_stats), row.tier_schedule, row.last_start, row.last_order_id
+        )
+        for row in (db.execute(_TOTALS_SELECT_SQL, params) if groups else ())
+    }
+
+    reranked: Set[_TierKey] = set()
+    for key, (gone, new) in groups.items():
+        total = totals.get(key)
+        appended = _append_in_order(history, total, gone, new) if total else None
+        if appended is None:
+            reranked.add(key)
+            continue
+        for snap in new:
+            changed[snap[0]] = (snap[2], snap[5], appended[snap[0]])
+
+    if reranked:
+        rows = [
+            row
+            for row in db.execute(_TIERED_ORDERS_SQL, params).all()
+            if (row.staff_id, row.order_date[:7]) in reranked
+        ]
+        tiered = history.tiered(
+            [row.staff_id for row in rows], [day_number(row.order_date) for row in rows]
+        )
+        rows = [row for row, flag in zip(rows, tiered) if flag]
+        ranked, amounts = _rank_tiers(history, rows)
+        for key in reranked:
+            totals[key] = ranked.get(key, _TierTotals())
+        for row, amount in zip(rows, amounts):
+            changed[row.id] = (row.order_date, float(row.commission_amount or 0.0), float(amount))
+
+    updates = {
+        order_id: amount
+        for order_id, (_, before, amount) in changed.items()
+        if abs(amount - before) > 1e-9
+    }
+    if updates:
+        db.execute(
+            text("UPDATE orders SET commission_amount = :c WHERE id = :id"),
+            [{"id": order_id, "c": amount} for order_id, amount in updates.items()],
+        )
+    _save_totals(db, owner, {key: totals[key] for key in groups})
+    return TierUpdate(
+        {order_id: amount for order_id, (_, _, amount) in changed.items()},
+        {changed[order_id][0] for order_id in updates},
+    )
+
+
+def _column(rows: Sequence, index: int, dtype) -> np.ndarray:
+    return np.fromiter((row[index] or 0 for row in rows), dtype=dtype, count=len(rows))
+
+
+@dataclass
+class MonthOrders:
+    """某月订单与续钟的列式快照，订单按 id 升序。"""
+
+    ids: np.ndarray
+    staff_ids: np.ndarray
+    package_ids: np.ndarray
+    days: np.ndarray
+    dates: List[str]
+    starts: List[str]
+    completed: np.ndarray
+    commission: np.ndarray  # 当前提成快照
+    basis: np.ndarray  # 当前提成基数
+    ext_ids: np.ndarray
+    ext_slot: np.ndarray  # 续钟所属订单在本快照中的下标
+    ext_packages: np.ndarray
+    ext_commission: np.ndarray
+
+
+def load_month_orders(
+    db: Session, owner: str, month: str, completed_only: bool = False
+) -> MonthOrders:
+    """订单与续钟各一条查询读出整月数据。"""
+    params = {"owner": owner, "pattern": f"{month}-%"}
+    status_filter = " AND status = 'completed'" if completed_only else ""
+    orders = db.execute(
+        text(
+            "SELECT id, staff_id, COALESCE(package_id, 0), "
+            "CAST(replace(order_date, '-', '') AS INTEGER), commission_amount, "
+            "commission_basis, order_date, start_datetime, status "
+            "FROM orders WHERE owner = :owner AND order_date LIKE :pattern"
+            f"{status_filter} ORDER BY id"
+        ),
+        params,
+    ).all()
+    extensions = db.execute(
+        text(
+            "SELECT e.id, e.order_id, e.package_id, e.commission_snapshot "
+            "FROM order_extensions e JOIN orders o ON o.id = e.order_id "
+            "WHERE o.owner = :owner AND o.order_date LIKE :pattern"
+            + status_filter.replace("status", "o.status")
+        ),
+        params,
+    ).all()
+    ids = _column(orders, 0, np.int64)
+    return MonthOrders(
+        ids=ids,
+        staff_ids=_column(orders, 1, np.int64),
+        package_ids=_column(orders, 2, np.int64),
+        days=_column(orders, 3, np.int64),
+        commission=_column(orders, 4, float),
+        basis=_column(orders, 5, float),
+        dates=[row[6] for row in orders],
+        starts=[row[7] for row in orders],
+        completed=np.fromiter(
+            (row[8] == "completed" for row in orders), dtype=bool, count=len(orders)
+        ),
+        ext_ids=_column(extensions, 0, np.int64),
+        ext_slot=np.searchsorted(ids, _column(extensions, 1, np.int64)),
+        ext_packages=_column(extensions, 2, np.int64),
+        ext_commission=_column(extensions, 3, float),
+    )
+
+
+@dataclass
+class MonthCommissions:
+    commission: np.ndarray
+    basis: np.ndarray
+    ext_commission: np.ndarray
+    totals: Dict[_TierKey, _TierTotals]
+
+
+def compute_month(history: CommissionHistory, orders: MonthOrders) -> MonthCommissions:
+    """按给定的版本索引整列计算整月提成，不读写数据库。"""
+    count = len(orders.ids)
+    slot = orders.ext_slot
+    ext_after = history.commissions(
+        orders.staff_ids[slot], orders.ext_packages, orders.days[slot]
+    )
+    # 与改单接口一致：没有基础套餐的订单不计提成，续钟提成累加在基础套餐之上
+    has_package = orders.package_ids > 0
+    after = history.commissions(
+        orders.staff_ids, orders.package_ids, orders.days
+    ) + np.bincount(slot, weights=ext_after, minlength=count)
+    after = np.where(has_package, after, 0.0)
+    basis = history.prices(orders.package_ids, orders.days) + np.bincount(
+        slot, weights=history.prices(orders.ext_packages, orders.days[slot]), minlength=count
+    )
+    basis = np.where(has_package, basis, 0.0)
+
+    # 已完成的分档订单按 (员工, 开始时间, id) 排位计提
+    tiered = np.flatnonzero(
+        orders.completed & history.tiered(orders.staff_ids, orders.days)
+    )
+    starts = np.array([orders.starts[i] for i in tiered], dtype=str)
+    tiered = tiered[np.lexsort((orders.ids[tiered], starts, orders.staff_ids[tiered]))]
+    totals, amounts = _rank_tiers(
+        history,
+        [
+            (
+                int(orders.ids[i]),
+                int(orders.staff_ids[i]),
+                orders.dates[i],
+                orders.starts[i],
+                basis[i],
+            )
+            for i in tiered
+        ],
+    )
+    after[tiered] = amounts
+    return MonthCommissions(
+        commission=after, basis=basis, ext_commission=ext_after, totals=totals
+    )
+
+
+@dataclass
+class RecomputeResult:
+    order_count: int
+    changed_orders: int
+    changed_extensions: int
+    commission_before: float
+    commission_after: float
+    changed_dates: Set[str]
+
+
+def recompute_month(db: Session, owner: str, month: str) -> RecomputeResult:
+    """按各订单日期当时有效的版本重算整月订单与续钟的提成快照（不提交）。
+
+    订单与续钟各读一次、整列计算，只回写有变化的行（各一条 executemany），
+    并重建当月的分档累计；调用方负责令 changed_dates 的日结汇总失效。
+    """
+    orders = load_month_orders(db, owner, month)
+    result = compute_month(commission_history.get(db, owner), orders)
+    db.execute(
+        text("DELETE FROM staff_tier_totals WHERE owner = :owner AND month = :month"),
+        {"owner": owner, "month": month},
+    )
+    _save_totals(db, owner, result.totals)
+
+    commission_changed = np.abs(result.commission - orders.commission) > 1e-9
+    changed = np.flatnonzero(commission_changed)
+    rewrite = np.flatnonzero(
+        commission_changed | (np.abs(result.basis - orders.basis) > 1e-9)
+    )
+    ext_changed = np.flatnonzero(
+        np.abs(result.ext_commission - orders.ext_commission) > 1e-9
+    )
+    if len(ext_changed):
+        db.execute(
+            text("UPDATE order_extensions SET commission_snapshot = :c WHERE id = :id"),
+            [
+                {"id": int(orders.ext_ids[i]), "c": float(result.ext_commission[i])}
+                for i in ext_changed
+            ],
+        )
+    if len(rewrite):
+        db.execute(
+            text(
+                "UPDATE orders SET commission_amount = :c, commission_basis = :b "
+                "WHERE id = :id"
+            ),
+            [
+                {
+                    "id": int(orders.ids[i]),
+                    "c": float(result.commission[i]),
+                    "b": float(result.basis[i]),
+                }
+                for i in rewrite
+            ],
+        )
+    return RecomputeResult(
+        order_count=len(orders.ids),
+        changed_orders=len(changed),
+        changed_extensions=len(ext_changed),
+        commission_before=float(orders.commission.sum()),
+        commission_after=float(result.commission.sum()),
+        changed_dates={orders.dates[i] for i in changed},
+    )
@@ -0,0 +1,100 @@
+"""报表接口的请求合并（single-flight）与并发准入控制。"""
+
+import functools
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import HTTPException, status
+
+# 同时执行的报表计算上限；超出时直接返回 503，避免挤占预约等写接口
+REPORT_CONCURRENCY = 2
+RETRY_AFTER_SECONDS = 1
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """相同 key 的并发调用只执行一次，其余调用等待并共享结果（含异常）。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+
+class AdmissionGate:
+    """有界并发：拿不到名额时立即拒绝，而不是排队占用线程池。"""
+
+    def __init__(self, limit: int, retry_after: int) -> None:
+        self._slots = threading.BoundedSemaphore(limit)
+        self._retry_after = retry_after
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="报表计算繁忙，请稍后重试",
+                headers={"Retry-After": str(self._retry_after)},
+            )
+        try:
+            return fn()
+        finally:
+            self._slots.release()
+
+
+report_flight = SingleFlight()
+report_gate = AdmissionGate(REPORT_CONCURRENCY, RETRY_AFTER_SECONDS)
+
+
+def coalesced_report(endpoint: str) -> Callable:
+    """报表路由装饰器：按 (owner, endpoint, 参数) 合并并发请求，并经过准入控制。
+
+    仅用于同步路由函数，参数须以关键字形式传入（FastAPI 的调用方式）；
+    db 与 current_account 不参与 key 计算。
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(**kwargs: Any) -> Any:
+            params = tuple(
+                sorted(
+                    (name, value)
+                    for name, value in kwargs.items()
+                    if name not in ("db", "current_account")
+                )
+            )
+            key = (kwargs["current_account"]["username"], endpoint, params)
+            return report_flight.do(key, lambda: report_gate.run(lambda: fn(**kwargs)))
+
+        return wrapper
+
+    return decorator
@@ -1,10 +1,39 @@
+import contextvars
+import hashlib
 import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Generic, Iterable, Iterator, Optional, Tuple, TypeVar
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from fastapi import Depends
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
 
+from .query_budget import uncounted
+from .security import (
+    DEFAULT_ACCOUNTS,
+    DEFAULT_INVESTOR_OWNERS,
+    LRUCache,
+    get_current_account,
+    hash_password,
+)
+
 DATABASE_URL = "sqlite:///./maid_system.db"
 
+# 主库：账号表；分库前的业务数据也留在这里，首次打开账号分库时导入
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
 )
@@ -13,8 +42,166 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# 每个账号（owner）一个 SQLite 库文件，写锁与索引互不影响
+SHARD_DIR = "shards"
+MAX_OPEN_SHARDS = int(os.environ.get("MAIDMANAGER_MAX_OPEN_SHARDS", "32"))
+FAN_OUT_WORKERS = 8
+
+# 当前 SQLite 是否支持 FTS5；不支持时订单搜索退化为 LIKE 匹配
+fts_enabled = False
+
+# 撞单触发器的报错信息，路由层据此将 IntegrityError 转换为 400
+ORDER_OVERLAP_ERROR = "order_overlap"
+# 订单时间段与其他接待的有效预留冲突
+ORDER_HELD_ERROR = "order_held"
+
+# 写入 change_log 的业务表（增量同步接口按表名返回变更）
+CHANGE_LOG_TABLES = (
+    "staff",
+    "service_packages",
+    "staff_package_commissions",
+    "commission_versions",
+    "work_shifts",
+    "orders",
+    "expenses",
+    "recurring_expenses",
+    "customers",
+)
+CHANGE_LOG_RETENTION_DAYS = 30
+
+# 只在主库使用的表，不随账号分库导入
+MAIN_DB_TABLES = ("users", "investor_owners")
+# shard_meta 中记录遗留数据已导入的键
+LEGACY_IMPORT_KEY = "legacy_import"
+
+T = TypeVar("T")
+
+
+class ShardRouter:
+    """按账号把会话路由到 ``shards/<owner>.db``。
+
+    分库在首次使用时建表迁移，并从主库导入该账号的遗留数据（按 shard_meta
+    标记只导入一次）；已打开的 engine 保存在有界 LRU 中，超出上限时释放最久未用的连接池。
+    """
+
+    def __init__(self, directory: str, max_open: int) -> None:
+        self.directory = directory
+        self.max_open = max_open
+        self._engines: "OrderedDict[str, Engine]" = OrderedDict()
+        # 本进程内已迁移过的账号；engine 被淘汰后重新打开无需再迁移
+        self._migrated: set[str] = set()
+        self._lock = threading.Lock()
+        self._owner_locks: Dict[str, threading.Lock] = {}
+        self._session = sessionmaker(autocommit=False, autoflush=False)
+
+    def path(self, owner: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", owner)
+        if name != owner or not name:
+            # 含特殊字符的账号名加摘要后缀，避免不同账号映射到同一文件
+            name = f"{name}-{hashlib.sha1(owner.encode()).hexdigest()[:10]}"
+        return os.path.join(self.directory, f"{name}.db")
+
+    def engine(self, owner: str) -> Engine:
+        with self._lock:
+            bind = self._engines.get(owner)
+            if bind is not None:
+                self._engines.move_to_end(owner)
+                return bind
+            owner_lock = self._owner_locks.setdefault(owner, threading.Lock())
+        with owner_lock:
+            with self._lock:
+                bind = self._engines.get(owner)
+            if bind is not None:
+                return bind
+            bind = self._open(owner)
+            with self._lock:
+                self._engines[owner] = bind
+                evicted = []
+                while len(self._engines) > self.max_open:
+                    evicted.append(self._engines.popitem(last=False)[1])
+        for old in evicted:
+            # 仍被会话占用的连接会在归还时关闭
+            old.dispose()
+        return bind
+
+    def session(self, owner: str) -> Session:
+        return self._session(bind=self.engine(owner))
+
+    def dispose_all(self) -> None:
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            self._migrated.clear()
+        for bind in engines:
+            bind.dispose()
+
+    def _open(self, owner: str) -> Engine:
+        path = self.path(owner)
+        os.makedirs(self.directory, exist_ok=True)
+        bind = create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}
+        )
+        if owner not in self._migrated:
+            # 建库迁移属于一次性开销，不计入触发它的请求的查询预算；
+            # 多个 worker 同时首次打开同一分库时由文件锁串行化
+            with uncounted(), _file_lock(f"{path}.lock"):
+                from . import models  # noqa: F401
+
+                with bind.connect() as conn:
+                    tables = {
+                        row[0]
+                        for row in conn.exec_driver_sql(
+                            "SELECT name FROM sqlite_master WHERE type = 'table'"
+                        )
+                    }
+                Base.metadata.create_all(bind=bind)
+                # 早于 shard_meta 建立的分库在建库时已完成导入，只补记标记
+                _import_legacy_rows(
+                    bind,
+                    owner,
+                    copy_rows="orders" not in tables or "shard_meta" in tables,
+                )
+                migrate(bind)
+            self._migrated.add(owner)
+        return bind
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """跨进程互斥锁（锁文件本身不删除）。"""
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+shards = ShardRouter(SHARD_DIR, MAX_OPEN_SHARDS)
 
-def get_db() -> Session:
+_fan_out_pool: Optional[ThreadPoolExecutor] = None
+_fan_out_lock = threading.Lock()
+
+
+def get_db(account: Dict[str, str] = Depends(get_current_account)) -> Session:
+    """当前账号分库上的会话。"""
+    db = shards.session(account["username"])
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_main_db() -> Session:
+    """主库会话（账号表）。"""
     db = SessionLocal()
     try:
         yield db
@@ -22,17 +209,113 @@ def get_db() -> Session:
         db.close()
 
 
+def fan_out(owners: Iterable[str], fn: Callable[[Session, str], T]) -> Dict[str, T]:
+    """在线程池中并行对多个账号分库执行 ``fn(db, owner)``，按账号返回结果供调用方合并。"""
+    global _fan_out_pool
+
+    owners = list(dict.fromkeys(owners))
+
+    def run(owner: str) -> T:
+        with shards.session(owner) as db:
+            return fn(db, owner)
+
+    if len(owners) <= 1:
+        return {owner: run(owner) for owner in owners}
+    if _fan_out_pool is None:
+        with _fan_out_lock:
+            if _fan_out_pool is None:
+                _fan_out_pool = ThreadPoolExecutor(
+                    max_workers=FAN_OUT_WORKERS, thread_name_prefix="shard-fan-out"
+                )
+    # 复制上下文，使各分库上的语句仍计入当前请求的查询计数
+    futures = {
+        owner: _fan_out_pool.submit(contextvars.copy_context().run, run, owner)
+        for owner in owners
+    }
+    return {owner: future.result() for owner, future in futures.items()}
+
+
+def data_version(db: Session, owner: str, entities: Iterable[str]) -> Tuple[int, ...]:
+    """指定业务表在账号分库中的数据版本：change_log 中该表的最大 id。
+
+    change_log 由触发器在写入所在的事务中追加，版本随写入一起提交，
+    任一进程（worker）提交后，其他进程下一次读取即可看到新版本。
+    一条语句、每张表一次索引查找（idx_change_log_owner_entity_id）。
+    """
+    entities = tuple(entities)
+    columns = ", ".join(
+        "(SELECT COALESCE(max(id), 0) FROM change_log "
+        f"WHERE owner = :owner AND entity = :e{i})"
+        for i in range(len(entities))
+    )
+    params: Dict[str, str] = {f"e{i}": entity for i, entity in enumerate(entities)}
+    params["owner"] = owner
+    return tuple(db.execute(text(f"SELECT {columns}"), params).one())
+
+
+class VersionedCache(Generic[T]):
+    """多 worker 下保持一致的进程内缓存：按账号缓存 loader 的结果，读取时校验数据版本。
+
+    每次读取先查 data_version（一条语句），版本未变直接返回缓存，否则重新加载。
+    应在本事务写入这些表之前读取，避免缓存到未提交（可能回滚）的数据。
+    """
+
+    def __init__(
+        self,
+        entities: Tuple[str, ...],
+        loader: Callable[[Session, str], T],
+        maxsize: int = 256,
+    ) -> None:
+        self.entities = entities
+        self._loader = loader
+        self._entries: LRUCache[str, Tuple[Tuple[int, ...], T]] = LRUCache(maxsize)
+
+    def get(self, db: Session, owner: str) -> T:
+        version = data_version(db, owner, self.entities)
+        cached = self._entries.get(owner)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = self._loader(db, owner)
+        self._entries.put(owner, (version, value))
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
 def init_db() -> None:
-    """初始化数据库表结构。"""
+    """初始化主库：账号表，以及分库前遗留的业务数据（首次打开分库时按账号导入）。"""
     from . import models  # noqa: F401
 
-    Base.metadata.create_all(bind=engine)
-    _ensure_owner_columns()
-    _ensure_booked_minutes()
-    _dedupe_work_shifts()
-    _ensure_indexes()
-    _refresh_commission_snapshot()
-    _refresh_commission_snapshot()
+    migrate(engine)
+    _seed_users(engine)
+    _seed_investor_owners(engine)
+
+
+def migrate(bind: Engine) -> None:
+    """建表并执行全部结构迁移；主库与各账号分库共用。"""
+    from . import models  # noqa: F401
+
+    Base.metadata.create_all(bind=bind)
+    _ensure_owner_columns(bind)
+    _ensure_booked_minutes(bind)
+    _ensure_shift_minutes(bind)
+    _ensure_customer_column(bind)
+    _ensure_expense_recurring_column(bind)
+    _ensure_commission_tier_columns(bind)
+    _ensure_idempotency_claim_column(bind)
+    _dedupe_work_shifts(bind)
+    _ensure_indexes(bind)
+    _ensure_order_overlap_guard(bind)
+    _ensure_order_hold_guard(bind)
+    _ensure_order_search_index(bind)
+    _refresh_commission_snapshot(bind)
+    _migrate_order_extensions(bind)
+    _migrate_customers(bind)
+    _seed_commission_versions(bind)
+    _ensure_change_log_triggers(bind)
+    _purge_idempotency_keys(bind)
+    _purge_change_log(bind)
 
 
 def _column_exists(conn, table_name: str, column_name: str) -> bool:
@@ -44,7 +327,7 @@ def _column_exists(conn, table_name: str, column_name: str) -> bool:
     return False
 
 
-def _ensure_owner_columns() -> None:
+def _ensure_owner_columns(bind: Engine) -> None:
     """为老库补充 owner 字段，用于账号隔离。"""
     tables = [
         "staff",
@@ -54,7 +337,7 @@ def _ensure_owner_columns() -> None:
         "service_packages",
         "staff_package_commissions",
     ]
-    with engine.begin() as conn:
+    with bind.begin() as conn:
         for table in tables:
             if not _column_exists(conn, table, "owner"):
                 conn.execute(
@@ -65,9 +348,9 @@ def _ensure_owner_columns() -> None:
                 )
 
 
-def _ensure_booked_minutes() -> None:
+def _ensure_booked_minutes(bind: Engine) -> None:
     """为订单增加 booked_minutes/extension_package_ids 字段，并回填。"""
-    with engine.begin() as conn:
+    with bind.begin() as conn:
         if not _column_exists(conn, "orders", "booked_minutes"):
             conn.execute(
                 text(
@@ -100,107 +383,643 @@ def _ensure_booked_minutes() -> None:
         )
 
 
-def _refresh_commission_snapshot() -> None:
-    """旧数据提成快照重算：基础套餐 + 续钟套餐累加。"""
-    from . import models  # noqa: WPS433
+def _ensure_shift_minutes(bind: Engine) -> None:
+    """为排班增加 start_min/end_min/duration_min 整数字段，并按时间字符串回填。"""
+    with bind.begin() as conn:
+        for column in ("start_min", "end_min", "duration_min"):
+            if not _column_exists(conn, "work_shifts", column):
+                conn.execute(
+                    text(
+                        f"ALTER TABLE work_shifts "
+                        f"ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"
+                    )
+                )
+        # 回填：HH:MM:ss -> 当日分钟数，仅处理尚未计算过的记录
+        conn.execute(
+            text(
+                """
+                UPDATE work_shifts
+                SET start_min = CAST(substr(start_time, 1, 2) AS INTEGER) * 60
+                        + CAST(substr(start_time, 4, 2) AS INTEGER),
+                    end_min = CAST(substr(end_time, 1, 2) AS INTEGER) * 60
+                        + CAST(substr(end_time, 4, 2) AS INTEGER)
+                WHERE duration_min IS NULL OR duration_min = 0
+                """
+            )
+        )
+        conn.execute(
+            text(
+                "UPDATE work_shifts SET duration_min = end_min - start_min "
+                "WHERE duration_min IS NULL OR duration_min = 0"
+            )
+        )
+
+
+def _ensure_customer_column(bind: Engine) -> None:
+    """为订单增加 customer_id 字段（关联 customers 表）。"""
+    with bind.begin() as conn:
+        if not _column_exists(conn, "orders", "customer_id"):
+            conn.execute(
+                text("ALTER TABLE orders ADD COLUMN customer_id INTEGER")
+            )
 
-    session = SessionLocal()
-    try:
-        orders = (
-            session.query(models.Order)
-            .filter(models.Order.status != "cancelled")
-            .all()
+
+def _ensure_expense_recurring_column(bind: Engine) -> None:
+    """为支出增加 recurring_id 字段（关联生成它的周期性支出）。"""
+    with bind.begin() as conn:
+        if not _column_exists(conn, "expenses", "recurring_id"):
+            conn.execute(
+                text("ALTER TABLE expenses ADD COLUMN recurring_id INTEGER")
+            )
+
+
+def _ensure_idempotency_claim_column(bind: Engine) -> None:
+    """为幂等键增加 claim_token 字段（处理中占位的租约令牌）。"""
+    with bind.begin() as conn:
+        if not _column_exists(conn, "idempotency_keys", "claim_token"):
+            conn.execute(
+                text("ALTER TABLE idempotency_keys ADD COLUMN claim_token VARCHAR")
+            )
+
+
+def _ensure_commission_tier_columns(bind: Engine) -> None:
+    """分档提成：员工与提成版本增加 commission_tiers，订单增加 commission_basis 并回填。"""
+    with bind.begin() as conn:
+        for table in ("staff", "commission_versions"):
+            if not _column_exists(conn, table, "commission_tiers"):
+                conn.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN commission_tiers TEXT")
+                )
+        if not _column_exists(conn, "orders", "commission_basis"):
+            conn.execute(
+                text(
+                    "ALTER TABLE orders "
+                    "ADD COLUMN commission_basis FLOAT NOT NULL DEFAULT 0"
+                )
+            )
+            conn.execute(
+                text(
+                    """
+                    UPDATE orders SET commission_basis =
+                        COALESCE((SELECT price FROM service_packages sp
+                                  WHERE sp.id = orders.package_id), 0)
+                        + COALESCE((SELECT sum(sp.price) FROM order_extensions e
+                                    JOIN service_packages sp ON sp.id = e.package_id
+                                    WHERE e.order_id = orders.id), 0)
+                    WHERE package_id IS NOT NULL
+                    """
+                )
+            )
+
+
+def _seed_commission_versions(bind: Engine) -> None:
+    """为尚无版本记录的员工、套餐与员工套餐固定提成，以当前配置补一条自始生效的版本。"""
+    missing = (
+        "NOT EXISTS (SELECT 1 FROM commission_versions v WHERE v.owner = {t}.owner "
+        "AND v.staff_id = {staff} AND v.package_id = {package})"
+    )
+    columns = (
+        "(owner, staff_id, package_id, effective_from, commission_type, "
+        "commission_value, price, default_commission, created_at)"
+    )
+    with bind.begin() as conn:
+        conn.execute(
+            text(
+                f"INSERT INTO commission_versions {columns} "
+                "SELECT owner, id, 0, '0001-01-01', COALESCE(commission_type, 'percentage'), "
+                "COALESCE(commission_value, 0), NULL, NULL, datetime('now') FROM staff "
+                "WHERE " + missing.format(t="staff", staff="staff.id", package="0")
+            )
+        )
+        conn.execute(
+            text(
+                f"INSERT INTO commission_versions {columns} "
+                "SELECT owner, 0, id, '0001-01-01', NULL, NULL, price, "
+                "COALESCE(default_commission, 0), datetime('now') FROM service_packages "
+                "WHERE "
+                + missing.format(t="service_packages", staff="0", package="service_packages.id")
+            )
+        )
+        conn.execute(
+            text(
+                f"INSERT INTO commission_versions {columns} "
+                "SELECT owner, staff_id, package_id, '0001-01-01', NULL, "
+                "COALESCE(commission_amount, 0), NULL, NULL, datetime('now') "
+                "FROM staff_package_commissions WHERE "
+                + missing.format(
+                    t="staff_package_commissions",
+                    staff="staff_package_commissions.staff_id",
+                    package="staff_package_commissions.package_id",
+                )
+            )
         )
 
-        def calc_commission(pkg: models.ServicePackage, staff: models.Staff, owner: str) -> float:
-            if pkg is None or staff is None:
+
+def _migrate_customers(bind: Engine) -> None:
+    """按客户名（去除首尾空白）为未关联的订单建档并关联，随后重建客户统计。
+
+    日常写入时统计由订单接口增量维护，这里只在有新关联时整体重算一次。
+    """
+    named = "customer_id IS NULL AND trim(COALESCE(customer_name, '')) != ''"
+    with bind.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO customers "
+                "(owner, name, visit_count, lifetime_spend, created_at) "
+                "SELECT owner, trim(customer_name), 0, 0, min(created_at) "
+                f"FROM orders WHERE {named} "
+                "GROUP BY owner, trim(customer_name)"
+            )
+        )
+        linked = conn.execute(
+            text(
+                "UPDATE orders SET customer_id = ("
+                "SELECT c.id FROM customers c "
+                "WHERE c.owner = orders.owner AND c.name = trim(orders.customer_name)"
+                f") WHERE {named}"
+            )
+        ).rowcount
+        if not linked:
+            return
+
+        conn.execute(text("DELETE FROM customer_affinities"))
+        for kind, column in (("staff", "staff_id"), ("package", "package_id")):
+            conn.execute(
+                text(
+                    "INSERT INTO customer_affinities "
+                    "(customer_id, kind, ref_id, visit_count, owner) "
+                    f"SELECT customer_id, '{kind}', {column}, count(*), owner "
+                    "FROM orders WHERE customer_id IS NOT NULL "
+                    f"AND status = 'completed' AND {column} IS NOT NULL "
+                    f"GROUP BY customer_id, {column}"
+                )
+            )
+        conn.execute(
+            text(
+                """
+                UPDATE customers SET
+                    visit_count = COALESCE(v.visits, 0),
+                    lifetime_spend = COALESCE(v.spend, 0),
+                    last_visit_date = v.last_visit
+                FROM (
+                    SELECT c.id AS cid, o.visits, o.spend, o.last_visit
+                    FROM customers c
+                    LEFT JOIN (
+                        SELECT customer_id, count(*) AS visits,
+                               sum(total_amount) AS spend, max(order_date) AS last_visit
+                        FROM orders
+                        WHERE customer_id IS NOT NULL AND status = 'completed'
+                        GROUP BY customer_id
+                    ) o ON o.customer_id = c.id
+                ) v
+                WHERE customers.id = v.cid
+                """
+            )
+        )
+        conn.execute(
+            text(
+                """
+                UPDATE customers SET
+                    favorite_staff_id = (
+                        SELECT ref_id FROM customer_affinities a
+                        WHERE a.customer_id = customers.id AND a.kind = 'staff'
+                          AND a.visit_count > 0
+                        ORDER BY a.visit_count DESC, a.ref_id LIMIT 1
+                    ),
+                    favorite_package_id = (
+                        SELECT ref_id FROM customer_affinities a
+                        WHERE a.customer_id = customers.id AND a.kind = 'package'
+                          AND a.visit_count > 0
+                        ORDER BY a.visit_count DESC, a.ref_id LIMIT 1
+                    )
+                """
+            )
+        )
+
+
+def _refresh_commission_snapshot(bind: Engine) -> None:
+    """旧数据提成快照重算为基础套餐+续钟套餐提成累加。"""
+    with bind.begin() as conn:
+        # 填充缺失的续钟列表字段
+        conn.execute(
+            text(
+                "UPDATE orders SET extension_package_ids = '[]' "
+                "WHERE extension_package_ids IS NULL"
+            )
+        )
+
+
+def _migrate_order_extensions(bind: Engine) -> None:
+    """将 orders.extension_package_ids 中的 JSON 续钟列表迁移到 order_extensions 表。
+
+    仅处理尚无明细行的订单；提成快照按当前员工配置计算，与历史重算口径一致。
+    """
+    with bind.begin() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT o.id, o.owner, o.staff_id, o.extension_package_ids
+                FROM orders o
+                WHERE o.extension_package_ids IS NOT NULL
+                  AND o.extension_package_ids NOT IN ('', '[]')
+                  AND NOT EXISTS (
+                      SELECT 1 FROM order_extensions e WHERE e.order_id = o.id
+                  )
+                """
+            )
+        ).fetchall()
+        if not rows:
+            return
+
+        packages = {
+            (row.owner, row.id): row
+            for row in conn.execute(
+                text(
+                    "SELECT id, owner, price, duration_minutes, default_commission "
+                    "FROM service_packages"
+                )
+            )
+        }
+        staff_map = {
+            (row.owner, row.id): row
+            for row in conn.execute(
+                text("SELECT id, owner, commission_type, commission_value FROM staff")
+            )
+        }
+        fixed_map = {
+            (row.owner, row.staff_id, row.package_id): row.commission_amount
+            for row in conn.execute(
+                text(
+                    "SELECT owner, staff_id, package_id, commission_amount "
+                    "FROM staff_package_commissions"
+                )
+            )
+        }
+
+        def calc_commission(pkg, staff, owner: str) -> float:
+            if staff is None:
                 return 0.0
             if staff.commission_type == "percentage":
-                base_amount = pkg.price or 0.0
-                return base_amount * (staff.commission_value or 0.0)
+                return (pkg.price or 0.0) * (staff.commission_value or 0.0)
             if staff.commission_type == "fixed":
-                mapping = (
-                    session.query(models.StaffPackageCommission)
-                    .filter(
-                        models.StaffPackageCommission.staff_id == staff.id,
-                        models.StaffPackageCommission.package_id == pkg.id,
-                        models.StaffPackageCommission.owner == owner,
-                    )
-                    .first()
-                )
-                if mapping:
-                    return mapping.commission_amount or 0.0
+                amount = fixed_map.get((owner, staff.id, pkg.id))
+                if amount is not None:
+                    return amount or 0.0
                 return pkg.default_commission or 0.0
             return 0.0
 
-        for order in orders:
-            staff = (
-                session.query(models.Staff)
-                .filter(
-                    models.Staff.id == order.staff_id,
-                    models.Staff.owner == order.owner,
+        inserts: list[dict] = []
+        for row in rows:
+            try:
+                parsed = json.loads(row.extension_package_ids)
+            except Exception:
+                continue
+            if not isinstance(parsed, list):
+                continue
+            ext_ids = [int(v) for v in parsed if isinstance(v, (int, str)) and str(v).isdigit()]
+            staff = staff_map.get((row.owner, row.staff_id))
+            seq = 0
+            for ext_id in ext_ids:
+                pkg = packages.get((row.owner, ext_id))
+                if pkg is None:
+                    continue
+                inserts.append(
+                    {
+                        "order_id": row.id,
+                        "package_id": ext_id,
+                        "seq": seq,
+                        "commission_snapshot": float(calc_commission(pkg, staff, row.owner)),
+                        "minutes_snapshot": pkg.duration_minutes or 0,
+                        "owner": row.owner,
+                    }
                 )
-                .first()
+                seq += 1
+        if inserts:
+            conn.execute(
+                text(
+                    "INSERT INTO order_extensions "
+                    "(order_id, package_id, seq, commission_snapshot, minutes_snapshot, owner) "
+                    "VALUES (:order_id, :package_id, :seq, :commission_snapshot, "
+                    ":minutes_snapshot, :owner)"
+                ),
+                inserts,
             )
-            if not staff:
-                continue
-            base_pkg = (
-                session.query(models.ServicePackage)
-                .filter(
-                    models.ServicePackage.id == order.package_id,
-                    models.ServicePackage.owner == order.owner,
-                )
-                .first()
-                if order.package_id
-                else None
-            )
-            commission_total = calc_commission(base_pkg, staff, order.owner)
-
-            ext_ids: list[int] = []
-            if order.extension_package_ids:
-                try:
-                    parsed = json.loads(order.extension_package_ids)
-                    if isinstance(parsed, list):
-                        ext_ids = [int(v) for v in parsed if isinstance(v, (int, str)) and str(v).isdigit()]
-                except Exception:
-                    ext_ids = []
-            if ext_ids:
-                ext_pkgs = (
-                    session.query(models.ServicePackage)
-                    .filter(
-                        models.ServicePackage.id.in_(ext_ids),
-                        models.ServicePackage.owner == order.owner,
+
+
+def _ensure_order_overlap_guard(bind: Engine) -> None:
+    """在存储层保证同一员工的未取消订单时间段不重叠。
+
+    触发器在写事务内执行检查，与插入/更新原子完成，无需应用层全局锁；
+    检查只扫描 (owner, staff_id) 下的订单，依赖 idx_orders_owner_staff_start。
+    """
+    overlap_check = f"""
+        SELECT RAISE(ABORT, '{ORDER_OVERLAP_ERROR}')
+        WHERE EXISTS (
+            SELECT 1 FROM orders o
+            WHERE o.owner = NEW.owner
+              AND o.staff_id = NEW.staff_id
+              AND o.id != COALESCE(NEW.id, -1)
+              AND o.status != 'cancelled'
+              AND o.start_datetime < NEW.end_datetime
+              AND o.end_datetime > NEW.start_datetime
+        );
+    """
+    with bind.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_no_overlap_insert "
+                "BEFORE INSERT ON orders "
+                "WHEN NEW.status IS NULL OR NEW.status != 'cancelled' "
+                f"BEGIN {overlap_check} END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_no_overlap_update "
+                "BEFORE UPDATE OF staff_id, start_datetime, end_datetime, status ON orders "
+                "WHEN NEW.status IS NULL OR NEW.status != 'cancelled' "
+                f"BEGIN {overlap_check} END"
+            )
+        )
+
+
+def _ensure_order_hold_guard(bind: Engine) -> None:
+    """有效预留（未到期）与订单、预留之间互不重叠，由触发器在写事务内保证。
+
+    新预留不能覆盖未取消订单或其他有效预留；订单不能落在有效预留内
+    （由预留转订单时先在同一事务内删除预留）。
+    """
+    active_hold = """
+        SELECT 1 FROM order_holds h
+        WHERE h.owner = NEW.owner
+          AND h.staff_id = NEW.staff_id
+          AND h.expires_at > strftime('%Y-%m-%d %H:%M:%S', 'now')
+          AND h.start_datetime < NEW.end_datetime
+          AND h.end_datetime > NEW.start_datetime
+    """
+    with bind.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_order_holds_no_overlap "
+                "BEFORE INSERT ON order_holds BEGIN "
+                f"SELECT RAISE(ABORT, '{ORDER_OVERLAP_ERROR}') "
+                "WHERE EXISTS ("
+                "SELECT 1 FROM orders o "
+                "WHERE o.owner = NEW.owner AND o.staff_id = NEW.staff_id "
+                "AND o.status != 'cancelled' "
+                "AND o.start_datetime < NEW.end_datetime "
+                "AND o.end_datetime > NEW.start_datetime"
+                f") OR EXISTS ({active_hold}); "
+                "END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_no_hold_insert "
+                "BEFORE INSERT ON orders "
+                "WHEN NEW.status IS NULL OR NEW.status != 'cancelled' BEGIN "
+                f"SELECT RAISE(ABORT, '{ORDER_HELD_ERROR}') "
+                f"WHERE EXISTS ({active_hold}); "
+                "END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_no_hold_update "
+                "BEFORE UPDATE OF staff_id, start_datetime, end_datetime, status ON orders "
+                "WHEN NEW.status IS NULL OR NEW.status != 'cancelled' BEGIN "
+                f"SELECT RAISE(ABORT, '{ORDER_HELD_ERROR}') "
+                f"WHERE EXISTS ({active_hold}); "
+                "END"
+            )
+        )
+
+
+def escape_like(term: str) -> str:
+    """转义 LIKE 通配符，配合 ``ESCAPE '\\'`` 使用。"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _ensure_order_search_index(bind: Engine) -> None:
+    """建立订单全文索引 orders_fts（客户名/备注/套餐名），由触发器与 orders 保持同步。
+
+    中文没有空格分词，使用 trigram 分词器做子串匹配；旧版 unicode61 索引会被重建。
+    """
+    global fts_enabled
+
+    with bind.begin() as conn:
+        existing = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'orders_fts'")
+        ).scalar()
+        existed = existing is not None and "trigram" in existing
+        if existing is not None and not existed:
+            conn.execute(text("DROP TABLE orders_fts"))
+        if not existed:
+            try:
+                conn.execute(
+                    text(
+                        "CREATE VIRTUAL TABLE orders_fts USING fts5("
+                        "customer_name, note, package_name, "
+                        "content='orders', content_rowid='id', "
+                        "tokenize='trigram')"
                     )
-                    .all()
                 )
-                ext_map = {p.id: p for p in ext_pkgs}
-                for ext_id in ext_ids:
-                    pkg = ext_map.get(ext_id)
-                    if pkg:
-                        commission_total += calc_commission(pkg, staff, order.owner)
+            except OperationalError:
+                # SQLite 未编译 FTS5
+                fts_enabled = False
+                return
+        fts_enabled = True
 
-            order.commission_amount = float(commission_total or 0.0)
+        fts_insert = (
+            "INSERT INTO orders_fts (rowid, customer_name, note, package_name) "
+            "VALUES (NEW.id, NEW.customer_name, NEW.note, NEW.package_name);"
+        )
+        fts_delete = (
+            "INSERT INTO orders_fts (orders_fts, rowid, customer_name, note, package_name) "
+            "VALUES ('delete', OLD.id, OLD.customer_name, OLD.note, OLD.package_name);"
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_fts_insert "
+                f"AFTER INSERT ON orders BEGIN {fts_insert} END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_fts_delete "
+                f"AFTER DELETE ON orders BEGIN {fts_delete} END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS trg_orders_fts_update "
+                "AFTER UPDATE OF customer_name, note, package_name ON orders "
+                f"BEGIN {fts_delete} {fts_insert} END"
+            )
+        )
+        if not existed:
+            # 首次建立（或更换分词器）时从 orders 回填
+            conn.execute(text("INSERT INTO orders_fts (orders_fts) VALUES ('rebuild')"))
 
-        session.commit()
-    finally:
-        session.close()
 
+def _ensure_change_log_triggers(bind: Engine) -> None:
+    """为需要增量同步的表建立触发器，任何写入路径（含批量语句）都会记录到 change_log。"""
+    with bind.begin() as conn:
+        for table in CHANGE_LOG_TABLES:
+            for event, row, op in (
+                ("INSERT", "NEW", "upsert"),
+                ("UPDATE", "NEW", "upsert"),
+                ("DELETE", "OLD", "delete"),
+            ):
+                conn.execute(
+                    text(
+                        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_change_{event.lower()} "
+                        f"AFTER {event} ON {table} BEGIN "
+                        "INSERT INTO change_log (entity, entity_id, op, changed_at, owner) "
+                        f"VALUES ('{table}', {row}.id, '{op}', "
+                        f"strftime('%Y-%m-%d %H:%M:%f', 'now'), {row}.owner); "
+                        "END"
+                    )
+                )
 
-def _refresh_commission_snapshot() -> None:
-    """旧数据提成快照重算为基础套餐+续钟套餐提成累加。"""
-    with engine.begin() as conn:
-        # 填充缺失的续钟列表字段
+
+def _seed_users(bind: Engine) -> None:
+    """users 表为空时写入示例账号（密码加盐哈希），此后账号以 users 表为准。"""
+    with bind.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM users LIMIT 1")).first():
+            return
         conn.execute(
             text(
-                "UPDATE orders SET extension_package_ids = '[]' "
-                "WHERE extension_package_ids IS NULL"
+                "INSERT INTO users (username, password_hash, role) "
+                "VALUES (:username, :password_hash, :role)"
+            ),
+            [
+                {
+                    "username": username,
+                    "password_hash": hash_password(account["password"]),
+                    "role": account["role"],
+                }
+                for username, account in DEFAULT_ACCOUNTS.items()
+            ],
+        )
+
+
+def _seed_investor_owners(bind: Engine) -> None:
+    """investor_owners 为空时写入示例投资人的店铺对应关系。"""
+    with bind.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM investor_owners LIMIT 1")).first():
+            return
+        conn.execute(
+            text(
+                "INSERT INTO investor_owners (investor, owner) "
+                "VALUES (:investor, :owner)"
+            ),
+            [
+                {"investor": investor, "owner": owner}
+                for investor, owners in DEFAULT_INVESTOR_OWNERS.items()
+                for owner in owners
+            ],
+        )
+
+
+def _import_legacy_rows(bind: Engine, owner: str, copy_rows: bool = True) -> None:
+    """从主库复制该账号的业务数据（保留原 id，只复制两边共有的列）。
+
+    复制与 shard_meta 中的导入标记在同一个 ``BEGIN IMMEDIATE`` 事务内提交，
+    已有标记时直接返回，因此重复调用或中途失败后重试都不会重复导入。
+    """
+    legacy_path = engine.url.database
+    if not legacy_path or not os.path.exists(legacy_path):
+        copy_rows = False
+    tables = [
+        table
+        for table in Base.metadata.sorted_tables
+        if "owner" in table.c
+        and table.name != "change_log"
+        and table.name not in MAIN_DB_TABLES
+    ]
+    with bind.connect() as conn:
+        if copy_rows:
+            # ATTACH 不能在事务内执行
+            conn.exec_driver_sql("ATTACH DATABASE ? AS legacy", (legacy_path,))
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            imported = conn.execute(
+                text("SELECT 1 FROM main.shard_meta WHERE key = :key"),
+                {"key": LEGACY_IMPORT_KEY},
+            ).first()
+            if imported is not None:
+                return
+            if copy_rows:
+                legacy_tables = {
+                    row[0]
+                    for row in conn.exec_driver_sql(
+                        "SELECT name FROM legacy.sqlite_master WHERE type = 'table'"
+                    )
+                }
+                for table in tables:
+                    if table.name not in legacy_tables:
+                        continue
+                    legacy_columns = {
+                        row[1]
+                        for row in conn.exec_driver_sql(
+                            f"PRAGMA legacy.table_info({table.name})"
+                        )
+                    }
+                    columns = ", ".join(
+                        c.name for c in table.c if c.name in legacy_columns
+                    )
+                    conn.execute(
+                        text(
+                            f"INSERT INTO main.{table.name} ({columns}) "
+                            f"SELECT {columns} FROM legacy.{table.name} "
+                            "WHERE owner = :owner"
+                        ),
+                        {"owner": owner},
+                    )
+            conn.execute(
+                text(
+                    "INSERT INTO main.shard_meta (key, value, updated_at) "
+                    "VALUES (:key, :value, :now)"
+                ),
+                {
+                    "key": LEGACY_IMPORT_KEY,
+                    "value": legacy_path if copy_rows else "",
+                    "now": datetime.utcnow(),
+                },
             )
+            conn.commit()
+        finally:
+            conn.rollback()  # 出错时先结束事务，否则无法 DETACH
+            if copy_rows:
+                conn.exec_driver_sql("DETACH DATABASE legacy")
+
+
+def _purge_change_log(bind: Engine) -> None:
+    """清理超过保留期的变更日志；游标早于保留期的客户端需全量重新同步。"""
+    cutoff = datetime.utcnow() - timedelta(days=CHANGE_LOG_RETENTION_DAYS)
+    with bind.begin() as conn:
+        conn.execute(
+            text("DELETE FROM change_log WHERE changed_at < :cutoff"),
+            {"cutoff": cutoff},
+        )
+
+
+def _purge_idempotency_keys(bind: Engine) -> None:
+    """清理超过保留期的幂等键记录。"""
+    from .idempotency import IDEMPOTENCY_TTL
+
+    cutoff = datetime.utcnow() - IDEMPOTENCY_TTL
+    with bind.begin() as conn:
+        conn.execute(
+            text("DELETE FROM idempotency_keys WHERE created_at < :cutoff"),
+            {"cutoff": cutoff},
         )
 
 
-def _dedupe_work_shifts() -> None:
+def _dedupe_work_shifts(bind: Engine) -> None:
     """剔除同一天同一员工的重复排班（保留最早一条）。"""
-    with engine.begin() as conn:
+    with bind.begin() as conn:
         rows = conn.execute(
             text(
                 "SELECT id, staff_id, work_date, owner "
@@ -227,9 +1046,9 @@ def _delete_ids(conn, table: str, ids: list[int]) -> None:
     conn.execute(text(f"DELETE FROM {table} WHERE id IN ({placeholders})"), params)
 
 
-def _ensure_indexes() -> None:
-    """创建必要的唯一索引。"""
-    with engine.begin() as conn:
+def _ensure_indexes(bind: Engine) -> None:
+    """创建必要的索引。"""
+    with bind.begin() as conn:
         conn.execute(
             text(
                 "CREATE UNIQUE INDEX IF NOT EXISTS "
@@ -237,3 +1056,137 @@ def _ensure_indexes() -> None:
                 "ON work_shifts (owner, work_date, staff_id)"
             )
         )
+        # 报表按 owner + 月份聚合排班分钟数，覆盖索引避免回表
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_work_shifts_owner_day_minutes "
+                "ON work_shifts (owner, work_date, staff_id, start_min, end_min, duration_min)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_idempotency_keys_owner_key "
+                "ON idempotency_keys (owner, idempotency_key)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_orders_owner_staff_start "
+                "ON orders (owner, staff_id, start_datetime)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_order_holds_owner_staff_start "
+                "ON order_holds (owner, staff_id, start_datetime)"
+            )
+        )
+        # 清理到期预留按到期时间范围删除
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_order_holds_owner_expires "
+                "ON order_holds (owner, expires_at)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_order_extensions_order_seq "
+                "ON order_extensions (order_id, seq)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_order_extensions_owner_package "
+                "ON order_extensions (owner, package_id)"
+            )
+        )
+        # 周期性支出按 (定义, 月份) 只生成一次
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_recurring_expense_runs_month "
+                "ON recurring_expense_runs (recurring_id, month)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_staff_tier_totals_month "
+                "ON staff_tier_totals (owner, staff_id, month)"
+            )
+        )
+        # 提成版本按 (员工, 套餐, 生效日) 唯一，同日重复修改覆盖
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_commission_versions_key "
+                "ON commission_versions (owner, staff_id, package_id, effective_from)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_customers_owner_name "
+                "ON customers (owner, name)"
+            )
+        )
+        # 客户列表按最近到店倒序分页
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_customers_owner_last_visit "
+                "ON customers (owner, last_visit_date, id)"
+            )
+        )
+        # 增量统计依赖 ON CONFLICT 定位关联行
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_customer_affinities_ref "
+                "ON customer_affinities (customer_id, kind, ref_id)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_daily_rollups_owner_date "
+                "ON daily_rollups (owner, business_date)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS "
+                "idx_investor_owners_pair "
+                "ON investor_owners (investor, owner)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_change_log_owner_id "
+                "ON change_log (owner, id)"
+            )
+        )
+        # 缓存一致性按表取最大 id 作为数据版本
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_change_log_owner_entity_id "
+                "ON change_log (owner, entity, id)"
+            )
+        )
+        # 撤销到店时按客户重算最近到店日期
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                "idx_orders_customer_status_date "
+                "ON orders (customer_id, status, order_date)"
+            )
+        )
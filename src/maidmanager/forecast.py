@@ -0,0 +1,261 @@
+"""按周内小时（168 格）的需求预测与历史聚合缓存。
+
+历史需求以「每天 × 24 小时」的已完成订单占用员工时长（人·小时）表示，
+按账号缓存在进程内，并记下已处理到的 change_log 游标。每次读取只取游标之后
+改动过的订单（任一 worker 写入都会记入 change_log），找出其中落在已聚合日期内的
+新旧订单日期，仅重算这些日期；再补算上次缓存之后新结束的日期。
+当天的新预约、改备注等未结束日期的写入不会触发重算。
+"""
+
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import CHANGE_LOG_RETENTION_DAYS, data_version
+from .occupancy import paint_intervals
+
+HOURS_PER_WEEK = 7 * 24
+# 参与预测的历史周数与逐周衰减系数（越近的周权重越高）
+FORECAST_HISTORY_WEEKS = 12
+SEASONAL_DECAY = 0.8
+# 周内相邻小时的滚动平均窗口（小时数，居中）
+SMOOTHING_HOURS = 3
+# 目标利用率：建议人数 = ceil(预测占用 / 目标利用率)
+TARGET_UTILIZATION = 0.8
+# 超过该时长未同步的缓存整体重建：游标之后的 change_log 可能已被清理
+_MAX_SYNC_GAP = timedelta(days=CHANGE_LOG_RETENTION_DAYS / 2)
+
+# 游标之后改动过的订单及其当前订单日期（已删除的订单日期为空）
+_CHANGED_ORDERS_SQL = text(
+    """
+    SELECT c.id, c.entity_id, o.order_date
+    FROM change_log c
+    LEFT JOIN orders o ON o.id = c.entity_id
+    WHERE c.owner = :owner AND c.entity = 'orders' AND c.id > :cursor
+    """
+)
+
+
+@dataclass
+class _History:
+    start: date  # hours 第 0 行对应的日期
+    closed_through: date  # 已聚合的最后一个结束日
+    hours: np.ndarray  # (天数, 24) 已完成订单占用的人·小时
+    cursor: int  # 已处理到的 change_log id
+    synced_at: datetime
+    order_ids: np.ndarray  # 已聚合的已完成订单 id（升序）
+    order_days: np.ndarray  # 对应订单日期相对 start 的天数
+
+    def day(self, value: str) -> int:
+        return (datetime.strptime(value, "%Y-%m-%d").date() - self.start).days
+
+
+class DemandHistoryCache:
+    """按账号缓存逐日逐小时的历史需求；只重算改动涉及的已结束日期并增量补算新结束的日期。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_owner: Dict[str, _History] = {}
+
+    def get(self, db: Session, owner: str, today: date) -> Optional[_History]:
+        closed_through = today - timedelta(days=1)
+        with self._lock:
+            history = self._by_owner.get(owner)
+            if (
+                history is None
+                or history.closed_through > closed_through
+                or datetime.utcnow() - history.synced_at > _MAX_SYNC_GAP
+            ):
+                history = self._load(db, owner, closed_through)
+            else:
+                history = self._sync(db, owner, history, closed_through)
+            if history is not None:
+                self._by_owner[owner] = history
+            else:
+                self._by_owner.pop(owner, None)
+            return history
+
+    def clear(self, owner: Optional[str] = None) -> None:
+        with self._lock:
+            if owner is None:
+                self._by_owner.clear()
+            else:
+                self._by_owner.pop(owner, None)
+
+    def _load(self, db: Session, owner: str, closed_through: date) -> Optional[_History]:
+        """整体聚合；先取游标再读订单，读取期间的写入会在下次同步时重算。"""
+        (cursor,) = data_version(db, owner, ("orders",))
+        origin = (
+            db.query(func.min(models.Order.order_date))
+            .filter(
+                models.Order.owner == owner,
+                models.Order.status == "completed",
+            )
+            .scalar()
+        )
+        if origin is None:
+            return None
+        start = datetime.strptime(origin, "%Y-%m-%d").date()
+        if start > closed_through:
+            return None
+        days = (closed_through - start).days + 1
+        history = _History(
+            start,
+            closed_through,
+            np.zeros((days, 24)),
+            cursor,
+            datetime.utcnow(),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+        )
+        _repaint(db, owner, history, range(days))
+        return history
+
+    def _sync(
+        self, db: Session, owner: str, history: _History, closed_through: date
+    ) -> Optional[_History]:
+        changes = db.execute(
+            _CHANGED_ORDERS_SQL, {"owner": owner, "cursor": history.cursor}
+        ).all()
+        affected: Set[int] = set()
+        if changes:
+            ids = np.array(sorted({row.entity_id for row in changes}), dtype=np.int64)
+            # 改动前的订单日期：缓存中记录的已聚合订单
+            pos = np.searchsorted(history.order_ids, ids)
+            pos = np.minimum(pos, max(len(history.order_ids) - 1, 0))
+            if len(history.order_ids):
+                hit = history.order_ids[pos] == ids
+                affected.update(int(day) for day in history.order_days[pos[hit]])
+            affected.update(
+                history.day(row.order_date) for row in changes if row.order_date
+            )
+            affected = {day for day in affected if day < len(history.hours)}
+            if any(day < 0 for day in affected):
+                # 改动涉及缓存起点之前的日期（如补录更早的订单），整体重建
+                return self._load(db, owner, closed_through)
+
+        old_days = len(history.hours)
+        days = (closed_through - history.start).days + 1
+        if not affected and days == old_days:
+            history.cursor = max([history.cursor, *(row.id for row in changes)])
+            history.synced_at = datetime.utcnow()
+            return history
+
+        updated = _History(
+            history.start,
+            closed_through,
+            np.vstack([history.hours, np.zeros((days - old_days, 24))]),
+            max([history.cursor, *(row.id for row in changes)]),
+            datetime.utcnow(),
+            history.order_ids,
+            history.order_days,
+        )
+        _repaint(db, owner, updated, sorted(affected) + list(range(old_days, days)))
+        return updated
+
+
+def _repaint(db: Session, owner: str, history: _History, days: Iterable[int]) -> None:
+    """按当前订单重算 history 中指定日期（相对 start 的天数）的逐小时占用。
+
+    前一天开始、跨过零点的订单会占用当天，因此连同前一天的订单一并读取。
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    source = sorted({d for day in days for d in (day - 1, day) if d >= 0})
+    dates = [(history.start + timedelta(days=d)).isoformat() for d in source]
+    base = (history.start + timedelta(days=source[0])).isoformat()
+    condition = (
+        models.Order.order_date.between(dates[0], dates[-1])
+        if len(dates) == source[-1] - source[0] + 1
+        else models.Order.order_date.in_(dates)
+    )
+    rows = (
+        db.query(
+            models.Order.id,
+            models.Order.order_date,
+            func.round(
+                (func.julianday(models.Order.start_datetime) - func.julianday(base))
+                * 1440
+            ),
+            func.round(
+                (func.julianday(models.Order.end_datetime) - func.julianday(base))
+                * 1440
+            ),
+        )
+        .filter(
+            models.Order.owner == owner,
+            models.Order.status == "completed",
+            condition,
+        )
+        .all()
+    )
+    span = source[-1] - source[0] + 1
+    minutes = paint_intervals(
+        [0] * len(rows),
+        [int(row[2]) for row in rows],
+        [int(row[3]) for row in rows],
+        1,
+        span * 1440,
+    )
+    # 同一分钟内的重叠订单数即占用人数，按小时求和后换算为人·小时
+    painted = minutes.reshape(span, 24, 60).sum(axis=2) / 60.0
+    target = np.asarray(days, dtype=np.int64)
+    history.hours[target] = painted[target - source[0]]
+
+    # 订单 id -> 日期索引：替换重新读取过的日期
+    index = dict(zip(dates, source))
+    keep = ~np.isin(history.order_days, source)
+    ids = np.concatenate(
+        [history.order_ids[keep], np.array([row[0] for row in rows], dtype=np.int64)]
+    )
+    order_days = np.concatenate(
+        [
+            history.order_days[keep],
+            np.array([index[row[1]] for row in rows], dtype=np.int64),
+        ]
+    )
+    order = np.argsort(ids, kind="stable")
+    history.order_ids = ids[order]
+    history.order_days = order_days[order]
+
+
+demand_history = DemandHistoryCache()
+
+
+def forecast_week(
+    history: Optional[_History], week_start: date
+) -> Tuple[np.ndarray, int]:
+    """预测 week_start 所在周 168 个小时的占用人数（人·小时/小时），并返回使用的历史周数。
+
+    取目标周之前最多 FORECAST_HISTORY_WEEKS 个完整周，按 SEASONAL_DECAY 逐周加权平均，
+    再在周内做循环滚动平均，把需求摊到相邻小时以覆盖预约时间的前后浮动；
+    取加权均值与滚动均值的较大者，避免高峰被平滑削低。
+    """
+    if history is None:
+        return np.zeros(HOURS_PER_WEEK), 0
+    # 对齐到周一：history.start 之前补零
+    lead = history.start.weekday()
+    hours = np.vstack([np.zeros((lead, 24)), history.hours])
+    aligned_start = history.start - timedelta(days=lead)
+    usable_days = min(hours.shape[0], (week_start - aligned_start).days)
+    full_weeks = min(usable_days // 7, FORECAST_HISTORY_WEEKS)
+    if full_weeks <= 0:
+        return np.zeros(HOURS_PER_WEEK), 0
+    end = usable_days - usable_days % 7
+    weekly = hours[end - full_weeks * 7 : end].reshape(full_weeks, HOURS_PER_WEEK)
+
+    weights = SEASONAL_DECAY ** np.arange(full_weeks - 1, -1, -1)
+    profile = np.average(weekly, axis=0, weights=weights)
+
+    half = SMOOTHING_HOURS // 2
+    padded = np.concatenate([profile[-half:], profile, profile[:half]]) if half else profile
+    kernel = np.ones(SMOOTHING_HOURS) / SMOOTHING_HOURS
+    smoothed = np.convolve(padded, kernel, mode="valid")
+    return np.maximum(profile, smoothed), full_weeks
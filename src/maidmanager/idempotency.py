@@ -0,0 +1,202 @@
+"""创建类接口的幂等键（Idempotency-Key）支持。
+
+平板网络不稳定时会重试 POST；携带相同 Idempotency-Key 的重试直接返回首次的响应，
+不再重复校验与写库。同进程内的并发重复请求等待首个请求完成后共享结果；
+跨进程时以 idempotency_keys 表的唯一索引占位（status_code 为空表示处理中），
+重复请求轮询等待占位完成。占位带租约：超过 IDEMPOTENCY_LEASE 仍未完成
+（首个请求所在进程已退出等）时由后来的请求接管。业务写入与保存的响应在同一事务提交，
+不会出现已写库却没有记录响应的情况。
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .concurrency import SingleFlight
+
+IDEMPOTENCY_TTL = timedelta(hours=24)
+# 处理中占位的租约；首个请求通常在毫秒级完成，超时视为已失败
+IDEMPOTENCY_LEASE = timedelta(seconds=30)
+POLL_INTERVAL_SECONDS = 0.05
+
+_flight = SingleFlight()
+
+
+def _request_hash(payload: Any) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="相同 Idempotency-Key 的请求正在处理中",
+    )
+
+
+def _claim(
+    db: Session, owner: str, endpoint: str, key: str, request_hash: str
+) -> Tuple[Optional[int], str, Optional[Tuple[int, Any]]]:
+    """取得占位，或等到其他请求完成。
+
+    返回 (占位 id, 租约令牌, None)；已有完成的响应时返回 (None, "", (状态码, 响应体))。
+    """
+    deadline = time.monotonic() + 2 * IDEMPOTENCY_LEASE.total_seconds()
+    while True:
+        row = (
+            db.query(models.IdempotencyKey)
+            .filter(
+                models.IdempotencyKey.owner == owner,
+                models.IdempotencyKey.idempotency_key == key,
+            )
+            .first()
+        )
+        now = datetime.utcnow()
+        if row and row.created_at < now - IDEMPOTENCY_TTL:
+            db.delete(row)
+            db.commit()
+            row = None
+
+        token = uuid.uuid4().hex
+        if row is None:
+            placeholder = models.IdempotencyKey(
+                owner=owner,
+                idempotency_key=key,
+                endpoint=endpoint,
+                request_hash=request_hash,
+                claim_token=token,
+                created_at=now,
+            )
+            db.add(placeholder)
+            try:
+                db.commit()
+            except IntegrityError:
+                # 其他进程已抢先占位，转入等待
+                db.rollback()
+                continue
+            placeholder_id = placeholder.id
+            return placeholder_id, token, None
+
+        if row.endpoint != endpoint or row.request_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key 已用于其他请求",
+            )
+        if row.status_code is not None:
+            return None, "", (row.status_code, json.loads(row.response_body))
+
+        if row.created_at < now - IDEMPOTENCY_LEASE:
+            # 租约过期：以令牌做比较交换接管，避免多个等待者同时接管
+            taken = (
+                db.query(models.IdempotencyKey)
+                .filter(
+                    models.IdempotencyKey.id == row.id,
+                    models.IdempotencyKey.status_code.is_(None),
+                    models.IdempotencyKey.claim_token == row.claim_token,
+                )
+                .update(
+                    {
+                        models.IdempotencyKey.claim_token: token,
+                        models.IdempotencyKey.created_at: now,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if taken:
+                return row.id, token, None
+            continue
+
+        if time.monotonic() > deadline:
+            raise _in_progress()
+        # 结束读事务并让会话中的对象过期，下一轮读到其他进程的最新提交
+        db.rollback()
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _execute(
+    db: Session,
+    owner: str,
+    endpoint: str,
+    key: str,
+    request_hash: str,
+    fn: Callable[[], Any],
+    status_code: int,
+) -> Tuple[int, Any, bool]:
+    placeholder_id, token, done = _claim(db, owner, endpoint, key, request_hash)
+    if done is not None:
+        return done[0], done[1], True
+
+    mine = (
+        models.IdempotencyKey.id == placeholder_id,
+        models.IdempotencyKey.claim_token == token,
+    )
+    try:
+        body = jsonable_encoder(fn())
+        # 响应与 fn 的写入同一事务提交；租约已被接管时放弃本次写入
+        stored = (
+            db.query(models.IdempotencyKey)
+            .filter(*mine, models.IdempotencyKey.status_code.is_(None))
+            .update(
+                {
+                    models.IdempotencyKey.status_code: status_code,
+                    models.IdempotencyKey.response_body: json.dumps(
+                        body, ensure_ascii=False
+                    ),
+                },
+                synchronize_session=False,
+            )
+        )
+        if not stored:
+            raise _in_progress()
+        db.commit()
+    except BaseException:
+        # 失败的请求不缓存，释放占位以便客户端修正后重试
+        db.rollback()
+        db.query(models.IdempotencyKey).filter(*mine).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        raise
+    return status_code, body, False
+
+
+def run_idempotent(
+    db: Session,
+    owner: str,
+    endpoint: str,
+    key: Optional[str],
+    payload: Any,
+    fn: Callable[[], Any],
+    status_code: int,
+) -> Any:
+    """按 Idempotency-Key 执行 fn；未携带 key 时直接执行。
+
+    fn 只写入不提交，由这里在同一事务中连同保存的响应一起提交；
+    fn 需返回可被 jsonable_encoder 序列化的响应模型；重放的响应带 Idempotent-Replayed 头。
+    """
+    if not key:
+        body = fn()
+        db.commit()
+        return body
+
+    request_hash = _request_hash(payload)
+    shared = {"leader": False}
+
+    def lead() -> Tuple[int, Any, bool]:
+        shared["leader"] = True
+        return _execute(db, owner, endpoint, key, request_hash, fn, status_code)
+
+    code, body, replayed = _flight.do((owner, key, endpoint, request_hash), lead)
+    headers = {"Idempotent-Replayed": "true"} if replayed or not shared["leader"] else None
+    return JSONResponse(status_code=code, content=body, headers=headers)
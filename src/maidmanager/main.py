@@ -1,10 +1,15 @@
 from fastapi import FastAPI
 
+from . import query_budget
 from .database import init_db
 from .routers import (
     auth,
+    changes,
+    customers,
+    day_bundle,
     expenses,
     finance,
+    holds,
     orders,
     packages,
     roster,
@@ -19,6 +24,9 @@ app = FastAPI(
 )
 
 
+query_budget.install(app)
+
+
 @app.on_event("startup")
 def on_startup() -> None:
     # 启动时自动创建 SQLite 表结构
@@ -30,6 +38,10 @@ app.include_router(staff.router)
 app.include_router(staff_commissions.router)
 app.include_router(roster.router)
 app.include_router(orders.router)
+app.include_router(holds.router)
+app.include_router(customers.router)
+app.include_router(day_bundle.router)
 app.include_router(finance.router)
 app.include_router(expenses.router)
 app.include_router(packages.router)
+app.include_router(changes.router)
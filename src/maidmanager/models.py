@@ -7,10 +7,7 @@ from .database import Base
 
 
 class User(Base):
-    """系统用户（店长 / 投资人）。
-
-    当前 MVP 暂不做真实鉴权，仅保留表结构以便后续扩展。
-    """
+    """系统用户（店长 / 投资人），password_hash 为 PBKDF2 加盐哈希。"""
 
     __tablename__ = "users"
 
@@ -20,6 +17,16 @@ class User(Base):
     role = Column(String, default="manager")  # manager / investor
 
 
+class InvestorOwner(Base):
+    """投资人与其出资店铺（店长账号）的对应关系，保存在主库。"""
+
+    __tablename__ = "investor_owners"
+
+    id = Column(Integer, primary_key=True, index=True)
+    investor = Column(String, nullable=False, index=True)
+    owner = Column(String, nullable=False)
+
+
 class Staff(Base):
     """员工档案与薪资配置。"""
 
@@ -35,8 +42,9 @@ class Staff(Base):
     base_salary = Column(Float, default=0.0)
     commission_type = Column(
         String, default="percentage"
-    )  # percentage / fixed
+    )  # percentage / fixed / tiered
     commission_value = Column(Float, default=0.0)
+    commission_tiers = Column(Text, nullable=True)  # JSON：分档提成 [{"up_to": 50, "rate": 0.3}, {"up_to": null, "rate": 0.4}]
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -54,6 +62,9 @@ class WorkShift(Base):
     work_date = Column(String, nullable=False)  # YYYY-MM-DD
     start_time = Column(String, nullable=False)  # HH:MM:ss
     end_time = Column(String, nullable=False)  # HH:MM:ss
+    start_min = Column(Integer, nullable=False, default=0)  # 开始时间（当日分钟数）
+    end_min = Column(Integer, nullable=False, default=0)  # 结束时间（当日分钟数）
+    duration_min = Column(Integer, nullable=False, default=0)  # 排班时长（分钟）
     created_at = Column(DateTime, default=datetime.utcnow)
     owner = Column(String, nullable=False, index=True, default="manager")
 
@@ -68,13 +79,14 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True)
     staff_id = Column(Integer, ForeignKey("staff.id"), nullable=False)
     customer_name = Column(String, nullable=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)
 
     order_date = Column(String, nullable=False)  # YYYY-MM-DD
     start_datetime = Column(String, nullable=False)  # YYYY-MM-DD HH:MM:ss
     end_datetime = Column(String, nullable=False)  # YYYY-MM-DD HH:MM:ss
     duration_minutes = Column(Integer, nullable=True)
     booked_minutes = Column(Integer, nullable=True, default=0)
-    extension_package_ids = Column(String, nullable=True)  # JSON 数组，续钟套餐ID列表
+    extension_package_ids = Column(String, nullable=True)  # JSON 数组，续钟套餐ID列表（order_extensions 的只读镜像）
 
     total_amount = Column(Float, nullable=False)
     payment_method = Column(String, nullable=True)  # wechat / alipay / cash
@@ -84,6 +96,7 @@ class Order(Base):
     extra_amount = Column(Float, default=0.0)
 
     commission_amount = Column(Float, default=0.0)
+    commission_basis = Column(Float, default=0.0)  # 快照：基础与续钟套餐按订单日期的价格合计（比例/分档提成的基数）
 
     status = Column(String, default="pending")  # pending / in_progress / finished / completed / cancelled
     note = Column(Text, nullable=True)
@@ -92,6 +105,72 @@ class Order(Base):
 
     staff = relationship("Staff", back_populates="orders")
     package = relationship("ServicePackage", uselist=False)
+    extensions = relationship(
+        "OrderExtension",
+        back_populates="order",
+        order_by="OrderExtension.seq",
+        cascade="all, delete-orphan",
+    )
+
+
+class OrderHold(Base):
+    """接待预留：到期前锁定员工的时间段，其他订单与预留不能占用，开单时可直接转为订单。"""
+
+    __tablename__ = "order_holds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    staff_id = Column(Integer, ForeignKey("staff.id"), nullable=False)
+    start_datetime = Column(String, nullable=False)  # YYYY-MM-DD HH:MM:ss
+    end_datetime = Column(String, nullable=False)
+    expires_at = Column(String, nullable=False)  # UTC，YYYY-MM-DD HH:MM:ss
+    note = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class OrderExtension(Base):
+    """订单续钟明细：每次续钟一行，保存下单时的提成与时长快照。"""
+
+    __tablename__ = "order_extensions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    package_id = Column(Integer, ForeignKey("service_packages.id"), nullable=False)
+    seq = Column(Integer, nullable=False, default=0)  # 续钟顺序，从 0 开始
+    commission_snapshot = Column(Float, nullable=False, default=0.0)
+    minutes_snapshot = Column(Integer, nullable=False, default=0)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+    order = relationship("Order", back_populates="extensions")
+
+
+class Customer(Base):
+    """客户档案：到店统计随订单写入增量维护，读取无需扫描订单。"""
+
+    __tablename__ = "customers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)  # 去除首尾空白后的客户名，同一账号内唯一
+    visit_count = Column(Integer, nullable=False, default=0)  # 已完成订单数
+    lifetime_spend = Column(Float, nullable=False, default=0.0)  # 已完成订单实收合计
+    last_visit_date = Column(String, nullable=True)  # YYYY-MM-DD
+    favorite_staff_id = Column(Integer, ForeignKey("staff.id"), nullable=True)
+    favorite_package_id = Column(Integer, ForeignKey("service_packages.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class CustomerAffinity(Base):
+    """客户对员工/套餐的到店次数，用于推导偏好。"""
+
+    __tablename__ = "customer_affinities"
+
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    kind = Column(String, nullable=False)  # staff / package
+    ref_id = Column(Integer, nullable=False)
+    visit_count = Column(Integer, nullable=False, default=0)
+    owner = Column(String, nullable=False, index=True, default="manager")
 
 
 class Expense(Base):
@@ -105,6 +184,54 @@ class Expense(Base):
     expense_date = Column(String, nullable=False)  # YYYY-MM-DD
     category = Column(String, nullable=True)  # rent / utilities / supplies
     note = Column(Text, nullable=True)
+    recurring_id = Column(Integer, ForeignKey("recurring_expenses.id"), nullable=True)  # 由周期性支出生成
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class RecurringExpense(Base):
+    """周期性支出定义（房租、水电等）；各月实例在首次查询该月时生成。"""
+
+    __tablename__ = "recurring_expenses"
+
+    id = Column(Integer, primary_key=True, index=True)
+    title = Column(String, nullable=False)
+    amount = Column(Float, nullable=False)
+    category = Column(String, nullable=True)
+    note = Column(Text, nullable=True)
+    cadence = Column(String, nullable=False, default="monthly")  # monthly / quarterly / yearly
+    day_of_month = Column(Integer, nullable=False, default=1)  # 生成的支出日期（1-28）
+    start_month = Column(String, nullable=False)  # YYYY-MM
+    end_month = Column(String, nullable=True)  # YYYY-MM，含；为空表示长期
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class RecurringExpenseRun(Base):
+    """周期性支出已生成的月份；删除生成的支出后不会再次生成。"""
+
+    __tablename__ = "recurring_expense_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recurring_id = Column(Integer, ForeignKey("recurring_expenses.id"), nullable=False)
+    month = Column(String, nullable=False)  # YYYY-MM
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class DailyRollup(Base):
+    """日结汇总：每个账号每个营业日一行，月度财务直接累加。"""
+
+    __tablename__ = "daily_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    business_date = Column(String, nullable=False)  # YYYY-MM-DD
+    order_count = Column(Integer, nullable=False, default=0)  # 已完成订单数
+    booked_minutes = Column(Integer, nullable=False, default=0)
+    total_revenue = Column(Float, nullable=False, default=0.0)
+    total_commission = Column(Float, nullable=False, default=0.0)
+    revenue_by_payment = Column(Text, nullable=False, default="{}")  # JSON：支付方式 -> 实收
+    commission_by_staff = Column(Text, nullable=False, default="{}")  # JSON：员工ID -> 提成
+    stale = Column(Integer, nullable=False, default=0)  # 1 表示日结后订单有改动，需重新日结
+    closed_at = Column(DateTime, default=datetime.utcnow)
     owner = Column(String, nullable=False, index=True, default="manager")
 
 
@@ -132,3 +259,84 @@ class StaffPackageCommission(Base):
     package_id = Column(Integer, ForeignKey("service_packages.id"), nullable=False)
     commission_amount = Column(Float, nullable=False, default=0.0)
     owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class CommissionVersion(Base):
+    """提成配置版本：自 effective_from 起生效，订单按日期取当时有效的版本计算提成。
+
+    staff_id / package_id 为 0 表示不限定：(员工, 0) 为员工提成方式与数值，
+    (0, 套餐) 为套餐价格与默认提成，(员工, 套餐) 为员工的套餐固定提成。
+    """
+
+    __tablename__ = "commission_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    staff_id = Column(Integer, nullable=False, default=0)
+    package_id = Column(Integer, nullable=False, default=0)
+    effective_from = Column(String, nullable=False)  # YYYY-MM-DD
+    commission_type = Column(String, nullable=True)  # (员工, 0)：percentage / fixed
+    commission_value = Column(Float, nullable=True)  # (员工, 0)：提成数值；(员工, 套餐)：固定提成
+    commission_tiers = Column(Text, nullable=True)  # (员工, 0)：分档提成 JSON
+    price = Column(Float, nullable=True)  # (0, 套餐)
+    default_commission = Column(Float, nullable=True)  # (0, 套餐)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class StaffTierTotal(Base):
+    """分档提成员工的月度累计：订单完成/取消时增量维护，工资条直接读取。"""
+
+    __tablename__ = "staff_tier_totals"
+
+    id = Column(Integer, primary_key=True, index=True)
+    staff_id = Column(Integer, ForeignKey("staff.id"), nullable=False)
+    month = Column(String, nullable=False)  # YYYY-MM
+    order_count = Column(Integer, nullable=False, default=0)
+    basis_amount = Column(Float, nullable=False, default=0.0)
+    commission_amount = Column(Float, nullable=False, default=0.0)
+    tier_stats = Column(Text, nullable=False, default="[]")  # JSON：每档 [单数, 基数, 提成]
+    tier_schedule = Column(Text, nullable=False, default="[]")  # JSON：最近一单日期有效的分档
+    last_start = Column(String, nullable=False, default="")  # 已计入订单的最大 (开始时间, id)
+    last_order_id = Column(Integer, nullable=False, default=0)
+    owner = Column(String, nullable=False, index=True, default="manager")
+
+
+class ChangeLog(Base):
+    """增量同步的变更日志，由各业务表的触发器写入；id 即同步游标。"""
+
+    __tablename__ = "change_log"
+    # AUTOINCREMENT 保证清理旧记录后游标也不会回退复用
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # 业务表名
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # upsert / delete
+    changed_at = Column(DateTime, default=datetime.utcnow)
+    owner = Column(String, nullable=False, default="manager")
+
+
+class IdempotencyKey(Base):
+    """创建类请求的幂等键与首次响应（status_code 为空表示处理中，租约从 created_at 起算）。"""
+
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner = Column(String, nullable=False, default="manager")
+    idempotency_key = Column(String, nullable=False)
+    endpoint = Column(String, nullable=False)
+    request_hash = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    claim_token = Column(String, nullable=True)  # 当前处理者的租约令牌
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # 最近一次占位时间
+
+
+class ShardMeta(Base):
+    """分库元数据（如遗留数据导入标记），与导入的数据在同一事务中写入。"""
+
+    __tablename__ = "shard_meta"
+
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,29 @@
+"""排班/订单区间的分钟级占用矩阵（NumPy 向量化绘制）。
+
+行对应员工（或其他分组），列对应自某起点开始的分钟偏移；
+区间按差分数组一次性写入再累加，避免逐行逐分钟的 Python 循环。
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+
+def paint_intervals(
+    rows: Sequence[int],
+    starts: Sequence[int],
+    ends: Sequence[int],
+    n_rows: int,
+    n_cols: int,
+) -> np.ndarray:
+    """返回 (n_rows, n_cols) 的覆盖次数矩阵，区间为左闭右开并裁剪到 [0, n_cols)。"""
+    row_idx = np.asarray(rows, dtype=np.int64)
+    start_idx = np.clip(np.asarray(starts, dtype=np.int64), 0, n_cols)
+    end_idx = np.clip(np.asarray(ends, dtype=np.int64), 0, n_cols)
+    keep = end_idx > start_idx
+    row_idx, start_idx, end_idx = row_idx[keep], start_idx[keep], end_idx[keep]
+
+    diff = np.zeros((n_rows, n_cols + 1), dtype=np.int32)
+    np.add.at(diff, (row_idx, start_idx), 1)
+    np.add.at(diff, (row_idx, end_idx), -1)
+    return np.cumsum(diff[:, :n_cols], axis=1)
@@ -0,0 +1,90 @@
+"""按请求统计 SQL 语句数，并与各路由声明的查询预算比对。
+
+路由通过 ``@query_budget(n)`` 声明单次请求允许执行的语句数上限，
+该上限应与数据量无关；出现逐行查询（N+1）时语句数会随数据增长而超限。
+每个响应都会带上 ``X-Query-Count`` 与 ``X-Query-Budget`` 头；运行时超限只记录告警
+（此时请求的写入可能已提交，不能再把响应改成失败），由 tests/test_query_budgets.py
+在两种数据规模下逐个路由断言不超限。
+"""
+
+import contextvars
+import logging
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from fastapi import FastAPI, Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+
+# 使用可变对象承载计数：同步路由在线程池中执行时拿到的是上下文副本，
+# 只有对同一对象自增才能回传到中间件
+_current: contextvars.ContextVar[Optional[QueryCounter]] = contextvars.ContextVar(
+    "maidmanager_query_counter", default=None
+)
+
+
+def query_budget(limit: int) -> Callable:
+    """声明路由单次请求的 SQL 语句上限。"""
+
+    def decorator(fn: Callable) -> Callable:
+        fn.__query_budget__ = limit
+        return fn
+
+    return decorator
+
+
+def start_counting() -> QueryCounter:
+    counter = QueryCounter()
+    _current.set(counter)
+    return counter
+
+
+@contextmanager
+def uncounted() -> Iterator[None]:
+    """暂停当前请求的语句计数，用于鉴权等带缓存、与数据量无关的旁路查询。"""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    counter = _current.get()
+    if counter is not None:
+        counter.count += 1
+
+
+def install(app: FastAPI) -> None:
+    """挂载语句计数监听与预算检查中间件。
+
+    监听挂在 Engine 类上，主库与按需打开的各账号分库都会计数。
+    """
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+
+    @app.middleware("http")
+    async def check_query_budget(request: Request, call_next):
+        counter = start_counting()
+        response = await call_next(request)
+        endpoint = request.scope.get("endpoint")
+        limit = getattr(endpoint, "__query_budget__", None)
+        response.headers["X-Query-Count"] = str(counter.count)
+        if limit is not None:
+            response.headers["X-Query-Budget"] = str(limit)
+        if limit is not None and counter.count > limit:
+            logger.warning(
+                "query budget exceeded: %s %s ran %d statements (budget %d)",
+                request.method,
+                request.url.path,
+                counter.count,
+                limit,
+            )
+        return response
@@ -0,0 +1,109 @@
+"""周期性支出（房租、水电等固定成本）按月惰性生成。
+
+定义保存在 recurring_expenses；某个月份第一次被支出列表或财务报表查询时，
+用一条 INSERT ... SELECT 生成该月应有的支出，并在 recurring_expense_runs 记下
+（定义, 月份），之后不会重复生成，手动删除的实例也不会被再次生成。
+补录历史月份走同一条语句，月份范围由递归 CTE 展开。
+"""
+
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# 周期 -> 间隔月数
+CADENCE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+
+
+def month_index(month: str) -> int:
+    """YYYY-MM -> 自公元 0 年起的月序号。"""
+    year, mon = month.split("-")
+    return int(year) * 12 + int(mon) - 1
+
+
+def current_month() -> str:
+    return date.today().strftime("%Y-%m")
+
+
+def _month_index_sql(column: str) -> str:
+    return (
+        f"(CAST(substr({column}, 1, 4) AS INTEGER) * 12 "
+        f"+ CAST(substr({column}, 6, 2) AS INTEGER) - 1)"
+    )
+
+
+_INTERVAL_SQL = (
+    "CASE r.cadence "
+    + " ".join(f"WHEN '{name}' THEN {months}" for name, months in CADENCE_MONTHS.items())
+    + " ELSE 1 END"
+)
+_START = _month_index_sql("r.start_month")
+_END = _month_index_sql("r.end_month")
+
+# 指定月份范围内、尚未生成过的 (定义, 月份)
+_DUE_CTE = f"""
+    WITH RECURSIVE months(idx) AS (
+        SELECT :from_idx
+        UNION ALL
+        SELECT idx + 1 FROM months WHERE idx < :to_idx
+    ),
+    due AS (
+        SELECT r.id AS recurring_id, r.title, r.amount, r.category, r.note,
+               r.day_of_month, r.owner,
+               printf('%04d-%02d', m.idx / 12, m.idx % 12 + 1) AS month
+        FROM recurring_expenses r
+        JOIN months m
+        WHERE r.owner = :owner
+          AND m.idx >= {_START}
+          AND (r.end_month IS NULL OR m.idx <= {_END})
+          AND (m.idx - {_START}) % ({_INTERVAL_SQL}) = 0
+          AND NOT EXISTS (
+              SELECT 1 FROM recurring_expense_runs x
+              WHERE x.recurring_id = r.id
+                AND x.month = printf('%04d-%02d', m.idx / 12, m.idx % 12 + 1)
+          )
+    )
+"""
+
+
+def materialize_recurring(
+    db: Session, owner: str, from_month: str, to_month: str
+) -> int:
+    """生成 [from_month, to_month] 内尚未生成的周期性支出，返回新增条数（不提交）。
+
+    无需生成时只执行一条语句；写入路径由 SQLite 串行化，多个 worker 并发调用也不会重复生成。
+    """
+    params = {
+        "owner": owner,
+        "from_idx": month_index(from_month),
+        "to_idx": month_index(to_month),
+    }
+    # WITH 写在 INSERT 之后，sqlite3 驱动才会返回 rowcount
+    created = db.execute(
+        text(
+            "INSERT INTO expenses "
+            "(title, amount, expense_date, category, note, owner, recurring_id) "
+            f"{_DUE_CTE} "
+            "SELECT title, amount, month || '-' || printf('%02d', day_of_month), "
+            "category, note, owner, recurring_id FROM due"
+        ),
+        params,
+    ).rowcount
+    if created:
+        db.execute(
+            text(
+                "INSERT OR IGNORE INTO recurring_expense_runs (recurring_id, month, owner) "
+                f"{_DUE_CTE} "
+                "SELECT recurring_id, month, owner FROM due"
+            ),
+            params,
+        )
+    return created
+
+
+def materialize_month(db: Session, owner: str, month: str) -> None:
+    """查询某月前惰性生成该月的周期性支出并提交；未来月份不生成。"""
+    if month > current_month():
+        return
+    if materialize_recurring(db, owner, month, month):
+        db.commit()
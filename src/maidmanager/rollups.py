@@ -0,0 +1,164 @@
+"""营业日日结：批量完成待结算订单并写入 daily_rollups 汇总。
+
+月度财务对已日结且未失效的日期直接累加汇总行，其余日期仍按订单明细计算；
+日结后再修改当日订单会把汇总标记为 stale，重新日结即可刷新。
+"""
+
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .commission import apply_tier_changes, commission_history, tier_snapshots
+from .routers.customers import apply_visits_bulk
+
+# 未填写支付方式的订单在汇总中的键
+PAYMENT_UNKNOWN = "unknown"
+
+
+@dataclass
+class DayClose:
+    business_date: str
+    closed_orders: int  # 本次由 finished 转为 completed 的订单数
+    open_orders: int  # 当日仍未结束（待开始/进行中）的订单数
+    order_count: int
+    booked_minutes: int
+    total_revenue: float
+    total_commission: float
+    revenue_by_payment: Dict[str, float]
+    commission_by_staff: Dict[int, float]
+
+
+def close_business_day(db: Session, owner: str, business_date: str) -> DayClose:
+    """日结：一条 UPDATE 完成当日全部待结算订单，重算并写入当日汇总（同一事务）。
+
+    新完成的分档提成订单在汇总前计入员工月度累计并改写提成。
+    """
+    history = commission_history.get(db, owner)
+    closed = db.execute(
+        text(
+            "UPDATE orders SET status = 'completed' "
+            "WHERE owner = :owner AND order_date = :day AND status = 'finished' "
+            "RETURNING id, customer_id, staff_id, package_id, total_amount, order_date, "
+            "start_datetime, status, commission_basis, commission_amount"
+        ),
+        {"owner": owner, "day": business_date},
+    ).fetchall()
+    apply_visits_bulk(
+        db,
+        owner,
+        [
+            (
+                row.customer_id,
+                row.staff_id,
+                row.package_id,
+                float(row.total_amount or 0.0),
+                row.order_date,
+            )
+            for row in closed
+            if row.customer_id
+        ],
+    )
+    tiers = apply_tier_changes(db, owner, history, [], tier_snapshots(history, closed))
+    # 补完更早时间的订单可能改变当月其他日期订单的排位
+    mark_rollups_stale(db, owner, tiers.dates - {business_date})
+
+    rows = db.execute(
+        text(
+            "SELECT staff_id, payment_method, count(*) AS cnt, "
+            "COALESCE(sum(booked_minutes), 0) AS minutes, "
+            "COALESCE(sum(total_amount), 0) AS revenue, "
+            "COALESCE(sum(commission_amount), 0) AS commission "
+            "FROM orders "
+            "WHERE owner = :owner AND order_date = :day AND status = 'completed' "
+            "GROUP BY staff_id, payment_method"
+        ),
+        {"owner": owner, "day": business_date},
+    ).fetchall()
+    revenue_by_payment: Dict[str, float] = {}
+    commission_by_staff: Dict[int, float] = {}
+    for row in rows:
+        method = row.payment_method or PAYMENT_UNKNOWN
+        revenue_by_payment[method] = revenue_by_payment.get(method, 0.0) + float(
+            row.revenue
+        )
+        commission_by_staff[row.staff_id] = commission_by_staff.get(
+            row.staff_id, 0.0
+        ) + float(row.commission)
+    open_orders = db.execute(
+        text(
+            "SELECT count(*) FROM orders "
+            "WHERE owner = :owner AND order_date = :day "
+            "AND status IN ('pending', 'in_progress')"
+        ),
+        {"owner": owner, "day": business_date},
+    ).scalar()
+    result = DayClose(
+        business_date=business_date,
+        closed_orders=len(closed),
+        open_orders=int(open_orders or 0),
+        order_count=sum(row.cnt for row in rows),
+        booked_minutes=int(sum(row.minutes for row in rows)),
+        total_revenue=sum(revenue_by_payment.values()),
+        total_commission=sum(commission_by_staff.values()),
+        revenue_by_payment=revenue_by_payment,
+        commission_by_staff=commission_by_staff,
+    )
+
+    db.execute(
+        text(
+            "INSERT INTO daily_rollups (owner, business_date, order_count, booked_minutes, "
+            "total_revenue, total_commission, revenue_by_payment, commission_by_staff, "
+            "stale, closed_at) "
+            "VALUES (:owner, :day, :order_count, :booked_minutes, :total_revenue, "
+            ":total_commission, :revenue_by_payment, :commission_by_staff, 0, :closed_at) "
+            "ON CONFLICT (owner, business_date) DO UPDATE SET "
+            "order_count = excluded.order_count, "
+            "booked_minutes = excluded.booked_minutes, "
+            "total_revenue = excluded.total_revenue, "
+            "total_commission = excluded.total_commission, "
+            "revenue_by_payment = excluded.revenue_by_payment, "
+            "commission_by_staff = excluded.commission_by_staff, "
+            "stale = 0, closed_at = excluded.closed_at"
+        ),
+        {
+            "owner": owner,
+            "day": business_date,
+            "order_count": result.order_count,
+            "booked_minutes": result.booked_minutes,
+            "total_revenue": result.total_revenue,
+            "total_commission": result.total_commission,
+            "revenue_by_payment": json.dumps(revenue_by_payment, ensure_ascii=False),
+            "commission_by_staff": json.dumps(commission_by_staff),
+            "closed_at": datetime.utcnow(),
+        },
+    )
+    db.commit()
+    return result
+
+
+def mark_rollups_stale(db: Session, owner: str, dates: Iterable[str]) -> None:
+    """订单改动涉及已日结的日期时，令对应汇总失效（不提交，随订单事务一起提交）。"""
+    dates = sorted(set(dates))
+    if not dates:
+        return
+    placeholders = ", ".join(f":d{i}" for i in range(len(dates)))
+    params = {f"d{i}": value for i, value in enumerate(dates)}
+    params["owner"] = owner
+    db.execute(
+        text(
+            "UPDATE daily_rollups SET stale = 1 "
+            f"WHERE owner = :owner AND stale = 0 AND business_date IN ({placeholders})"
+        ),
+        params,
+    )
+
+
+def merge_amounts(target: Dict[str, float], raw: str) -> None:
+    """把汇总行中的 JSON 金额字典累加到 target。"""
+    for key, value in json.loads(raw or "{}").items():
+        target[key] = target.get(key, 0.0) + float(value)
+
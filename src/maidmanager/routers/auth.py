@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
 from .. import schemas
-from ..security import ACCOUNTS
+from ..database import get_main_db
+from ..query_budget import query_budget
+from ..security import issue_token, verify_password
 
 router = APIRouter(prefix="/api", tags=["登录"])
 
@@ -9,22 +13,24 @@ router = APIRouter(prefix="/api", tags=["登录"])
 @router.post(
     "/login",
     response_model=schemas.LoginResponse,
-    summary="简易登录（固定账号密码）",
+    summary="登录（签发带过期时间的令牌）",
 )
-def login(payload: schemas.LoginRequest) -> schemas.LoginResponse:
-    """固定账号密码的简易登录。
-
-    当前不返回真实 JWT，仅返回一个假 token，供前端区分角色使用。
-    """
-    account = ACCOUNTS.get(payload.username)
-    if not account or account["password"] != payload.password:
+@query_budget(1)
+def login(
+    payload: schemas.LoginRequest, db: Session = Depends(get_main_db)
+) -> schemas.LoginResponse:
+    """校验 users 表中的账号密码，返回 HMAC 签名令牌，前端放入 Authorization 头。"""
+    user = db.execute(
+        text("SELECT username, password_hash, role FROM users WHERE username = :username"),
+        {"username": payload.username},
+    ).first()
+    if not user or not verify_password(payload.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="用户名或密码错误"
         )
 
-    token = f"fake-token-{payload.username}"
     return schemas.LoginResponse(
-        username=payload.username,
-        role=account["role"],
-        token=token,
+        username=user.username,
+        role=user.role or "manager",
+        token=issue_token(user.username),
     )
@@ -0,0 +1,94 @@
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import CHANGE_LOG_TABLES, Base, get_db
+from ..query_budget import query_budget
+from ..security import get_current_account
+
+router = APIRouter(prefix="/api", tags=["同步"])
+
+# 同步数据中不下发的列
+_HIDDEN_COLUMNS = {"owner"}
+
+
+@router.get(
+    "/changes",
+    response_model=schemas.ChangeFeedResponse,
+    summary="增量变更（自游标以来每条记录的最新状态）",
+)
+@query_budget(2 + len(CHANGE_LOG_TABLES))
+def list_changes(
+    since: int = Query(0, ge=0, description="上次同步返回的游标；0 表示尚未同步"),
+    limit: int = Query(500, ge=1, le=2000, description="单次最多返回的记录数"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.ChangeFeedResponse:
+    """返回游标之后发生变更的记录，同一记录只下发最新版本（已删除的记录 data 为 null）。
+
+    首次同步（since=0）或游标早于日志保留期时返回 resync_required=true 与当前游标：
+    客户端应先记下该游标，再全量拉取列表，之后用游标增量同步。
+    has_more 为 true 时用返回的游标继续请求。
+    """
+    owner = current_account["username"]
+    log = models.ChangeLog
+    oldest, latest = db.query(func.min(log.id), func.max(log.id)).one()
+    latest = latest or 0
+    if since == 0 or (oldest is not None and since < oldest - 1) or since > latest:
+        return schemas.ChangeFeedResponse(
+            cursor=latest, has_more=False, resync_required=True, changes=[]
+        )
+
+    # 每条记录只取游标之后的最后一次变更
+    newest = (
+        db.query(func.max(log.id).label("id"))
+        .filter(log.owner == owner, log.id > since)
+        .group_by(log.entity, log.entity_id)
+        .subquery()
+    )
+    rows = (
+        db.query(log.id, log.entity, log.entity_id, log.op)
+        .join(newest, newest.c.id == log.id)
+        .order_by(log.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # 按表批量读取当前数据，每张表一条查询
+    wanted: Dict[str, List[int]] = {}
+    for row in rows:
+        if row.op == "upsert":
+            wanted.setdefault(row.entity, []).append(row.entity_id)
+    current: Dict[tuple, Dict[str, Any]] = {}
+    for entity, ids in wanted.items():
+        table = Base.metadata.tables[entity]
+        for record in db.execute(
+            select(table).where(table.c.id.in_(ids), table.c.owner == owner)
+        ).mappings():
+            current[(entity, record["id"])] = {
+                key: value for key, value in record.items() if key not in _HIDDEN_COLUMNS
+            }
+
+    changes = []
+    for row in rows:
+        data = current.get((row.entity, row.entity_id))
+        changes.append(
+            schemas.ChangeItem(
+                cursor=row.id,
+                entity=row.entity,
+                id=row.entity_id,
+                op="upsert" if data is not None else "delete",
+                data=data,
+            )
+        )
+    return schemas.ChangeFeedResponse(
+        cursor=rows[-1].id if rows else since,
+        has_more=has_more,
+        resync_required=False,
+        changes=changes,
+    )
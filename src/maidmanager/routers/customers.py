@@ -0,0 +1,283 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import escape_like, get_db
+from ..query_budget import query_budget
+from ..security import get_current_account
+
+router = APIRouter(prefix="/api/customers", tags=["客户"])
+
+# 订单对客户统计的贡献：(customer_id, staff_id, package_id, total_amount, order_date)
+VisitSnapshot = Tuple[int, int, Optional[int], float, str]
+
+
+def link_customer(db: Session, owner: str, name: Optional[str]) -> Optional[int]:
+    """按客户名（去除首尾空白）取得或创建客户，返回客户 ID；空名返回 None。"""
+    name = (name or "").strip()
+    if not name:
+        return None
+    find = select(models.Customer.id).where(
+        models.Customer.owner == owner, models.Customer.name == name
+    )
+    customer_id = db.execute(find).scalar()
+    if customer_id is None:
+        # 并发开单可能同时创建同名客户：冲突时不报错，改为读取对方写入的行
+        customer_id = db.execute(
+            text(
+                "INSERT INTO customers "
+                "(name, visit_count, lifetime_spend, created_at, owner) "
+                "VALUES (:name, 0, 0.0, :now, :owner) "
+                "ON CONFLICT (owner, name) DO NOTHING "
+                "RETURNING id"
+            ),
+            {"name": name, "now": datetime.utcnow(), "owner": owner},
+        ).scalar()
+        if customer_id is None:
+            customer_id = db.execute(find).scalar()
+    return customer_id
+
+
+def visit_snapshot(order: models.Order) -> Optional[VisitSnapshot]:
+    """已完成且关联客户的订单才计入到店统计。"""
+    if order.status != "completed" or not order.customer_id:
+        return None
+    return (
+        order.customer_id,
+        order.staff_id,
+        order.package_id,
+        float(order.total_amount or 0.0),
+        order.order_date,
+    )
+
+
+def apply_visit_delta(
+    db: Session,
+    owner: str,
+    old: Optional[VisitSnapshot],
+    new: Optional[VisitSnapshot],
+) -> None:
+    """在订单写事务内增量维护客户统计：先扣除旧贡献，再计入新贡献。
+
+    调用前需 flush 订单变更，以便扣除最近到店日期时可按剩余订单重算。
+    """
+    if old == new:
+        return
+    if old is not None:
+        _apply_snapshot(db, owner, old, -1)
+    if new is not None:
+        _apply_snapshot(db, owner, new, 1)
+
+
+def apply_visits_bulk(db: Session, owner: str, snaps: List[VisitSnapshot]) -> None:
+    """批量计入一组新完成订单的到店贡献（如日结批量完成），语句数与订单数无关。"""
+    if not snaps:
+        return
+    visits: Dict[int, list] = {}
+    affinities: Dict[Tuple[int, str, int], int] = {}
+    for customer_id, staff_id, package_id, amount, order_date in snaps:
+        agg = visits.setdefault(customer_id, [0, 0.0, ""])
+        agg[0] += 1
+        agg[1] += amount
+        agg[2] = max(agg[2], order_date)
+        affinities[(customer_id, "staff", staff_id)] = (
+            affinities.get((customer_id, "staff", staff_id), 0) + 1
+        )
+        if package_id is not None:
+            affinities[(customer_id, "package", package_id)] = (
+                affinities.get((customer_id, "package", package_id), 0) + 1
+            )
+    db.execute(
+        text(
+            "UPDATE customers SET "
+            "visit_count = visit_count + :visits, "
+            "lifetime_spend = lifetime_spend + :amount, "
+            "last_visit_date = max(COALESCE(last_visit_date, ''), :order_date) "
+            "WHERE id = :customer_id"
+        ),
+        [
+            {"visits": v[0], "amount": v[1], "order_date": v[2], "customer_id": cid}
+            for cid, v in visits.items()
+        ],
+    )
+    db.execute(
+        text(
+            "INSERT INTO customer_affinities (customer_id, kind, ref_id, visit_count, owner) "
+            "VALUES (:customer_id, :kind, :ref_id, :visits, :owner) "
+            "ON CONFLICT (customer_id, kind, ref_id) "
+            "DO UPDATE SET visit_count = visit_count + excluded.visit_count"
+        ),
+        [
+            {
+                "customer_id": cid,
+                "kind": kind,
+                "ref_id": ref_id,
+                "visits": count,
+                "owner": owner,
+            }
+            for (cid, kind, ref_id), count in affinities.items()
+        ],
+    )
+    _refresh_favorites(db, list(visits))
+
+
+def _apply_snapshot(db: Session, owner: str, snap: VisitSnapshot, sign: int) -> None:
+    customer_id, staff_id, package_id, amount, order_date = snap
+    if sign > 0:
+        last_visit_sql = "max(COALESCE(last_visit_date, ''), :order_date)"
+    else:
+        last_visit_sql = (
+            "CASE WHEN last_visit_date = :order_date THEN ("
+            "SELECT max(order_date) FROM orders "
+            "WHERE customer_id = :customer_id AND status = 'completed'"
+            ") ELSE last_visit_date END"
+        )
+    db.execute(
+        text(
+            "UPDATE customers SET "
+            "visit_count = visit_count + :sign, "
+            "lifetime_spend = lifetime_spend + :amount, "
+            f"last_visit_date = {last_visit_sql} "
+            "WHERE id = :customer_id"
+        ),
+        {
+            "sign": sign,
+            "amount": sign * amount,
+            "order_date": order_date,
+            "customer_id": customer_id,
+        },
+    )
+    affinities = [("staff", staff_id)]
+    if package_id is not None:
+        affinities.append(("package", package_id))
+    db.execute(
+        text(
+            "INSERT INTO customer_affinities (customer_id, kind, ref_id, visit_count, owner) "
+            "VALUES (:customer_id, :kind, :ref_id, :sign, :owner) "
+            "ON CONFLICT (customer_id, kind, ref_id) "
+            "DO UPDATE SET visit_count = visit_count + excluded.visit_count"
+        ),
+        [
+            {
+                "customer_id": customer_id,
+                "kind": kind,
+                "ref_id": ref_id,
+                "sign": sign,
+                "owner": owner,
+            }
+            for kind, ref_id in affinities
+        ],
+    )
+    _refresh_favorites(db, [customer_id])
+
+
+def _refresh_favorites(db: Session, customer_ids: List[int]) -> None:
+    # 偏好员工/套餐：只在该客户自己的少量关联行中取最大值
+    db.execute(
+        text(
+            "UPDATE customers SET "
+            "favorite_staff_id = ("
+            "SELECT ref_id FROM customer_affinities "
+            "WHERE customer_id = :customer_id AND kind = 'staff' AND visit_count > 0 "
+            "ORDER BY visit_count DESC, ref_id LIMIT 1), "
+            "favorite_package_id = ("
+            "SELECT ref_id FROM customer_affinities "
+            "WHERE customer_id = :customer_id AND kind = 'package' AND visit_count > 0 "
+            "ORDER BY visit_count DESC, ref_id LIMIT 1) "
+            "WHERE id = :customer_id"
+        ),
+        [{"customer_id": customer_id} for customer_id in customer_ids],
+    )
+
+
+def _customer_query(db: Session, owner: str):
+    favorite_staff = models.Staff
+    return (
+        db.query(
+            models.Customer,
+            favorite_staff.name.label("favorite_staff_name"),
+            models.ServicePackage.name.label("favorite_package_name"),
+        )
+        .outerjoin(favorite_staff, favorite_staff.id == models.Customer.favorite_staff_id)
+        .outerjoin(
+            models.ServicePackage,
+            models.ServicePackage.id == models.Customer.favorite_package_id,
+        )
+        .filter(models.Customer.owner == owner)
+    )
+
+
+def _to_customer_read(
+    customer: models.Customer,
+    favorite_staff_name: Optional[str],
+    favorite_package_name: Optional[str],
+) -> schemas.CustomerRead:
+    return schemas.CustomerRead(
+        id=customer.id,
+        name=customer.name,
+        visit_count=customer.visit_count or 0,
+        lifetime_spend=float(customer.lifetime_spend or 0.0),
+        last_visit_date=customer.last_visit_date,
+        favorite_staff_id=customer.favorite_staff_id,
+        favorite_staff_name=favorite_staff_name,
+        favorite_package_id=customer.favorite_package_id,
+        favorite_package_name=favorite_package_name,
+    )
+
+
+@router.get(
+    "",
+    response_model=List[schemas.CustomerRead],
+    summary="客户列表（含到店统计）",
+)
+@query_budget(1)
+def list_customers(
+    q: Optional[str] = Query(None, description="按客户名前缀过滤（可选）"),
+    limit: int = Query(50, ge=1, le=200, description="每页条数"),
+    offset: int = Query(0, ge=0, description="偏移量"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[schemas.CustomerRead]:
+    """按最近到店日期倒序返回客户及其统计。"""
+    query = _customer_query(db, current_account["username"])
+    if q:
+        query = query.filter(
+            models.Customer.name.like(f"{escape_like(q.strip())}%", escape="\\")
+        )
+    rows = (
+        query.order_by(
+            models.Customer.last_visit_date.desc(), models.Customer.id.desc()
+        )
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return [_to_customer_read(*row) for row in rows]
+
+
+@router.get(
+    "/{customer_id}",
+    response_model=schemas.CustomerRead,
+    summary="客户详情（到店次数/消费/偏好）",
+)
+@query_budget(1)
+def get_customer(
+    customer_id: int,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.CustomerRead:
+    """读取增量维护的客户统计，不扫描订单。"""
+    row = (
+        _customer_query(db, current_account["username"])
+        .filter(models.Customer.id == customer_id)
+        .first()
+    )
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="客户不存在"
+        )
+    return _to_customer_read(*row)
@@ -0,0 +1,158 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import get_db
+from ..query_budget import query_budget
+from ..security import get_current_account
+from .orders import _build_day_view, _to_order_read, get_order_marks
+from .packages import list_packages
+from .roster import get_roster_marks
+
+router = APIRouter(prefix="/api", tags=["日视图"])
+
+BUNDLE_SECTIONS = (
+    "day_view",
+    "active_orders",
+    "roster",
+    "packages",
+    "staff",
+    "order_marks",
+    "roster_marks",
+)
+
+
+def _parse_sections(fields: Optional[str]) -> set[str]:
+    if not fields:
+        return set(BUNDLE_SECTIONS)
+    sections = {item.strip() for item in fields.split(",") if item.strip()}
+    unknown = sections - set(BUNDLE_SECTIONS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"未知的区块：{', '.join(sorted(unknown))}",
+        )
+    return sections
+
+
+@router.get(
+    "/day_bundle",
+    response_model=schemas.DayBundleResponse,
+    summary="前台日视图聚合数据（排班/订单/套餐/员工/日历标记）",
+)
+@query_budget(6)
+def get_day_bundle(
+    date: str = Query(..., description="日期 YYYY-MM-DD"),
+    fields: Optional[str] = Query(
+        None,
+        description=(
+            "逗号分隔的返回区块，默认全部："
+            "day_view, active_orders, roster, packages, staff, order_marks, roster_marks"
+        ),
+    ),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.DayBundleResponse:
+    """一次请求返回前台打开某日所需的全部数据。
+
+    员工、当日排班、当日订单各查询一次，由各区块共享；
+    客户端已缓存的区块可通过 fields 跳过。
+    """
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date 必须为 YYYY-MM-DD 格式",
+        ) from exc
+    sections = _parse_sections(fields)
+    owner = current_account["username"]
+    bundle: dict = {"date": date}
+
+    staff_rows: list[models.Staff] = []
+    if sections & {"day_view", "active_orders", "roster", "staff"}:
+        staff_rows = (
+            db.query(models.Staff)
+            .filter(models.Staff.owner == owner)
+            .order_by(models.Staff.id)
+            .all()
+        )
+    staff_map = {row.id: row for row in staff_rows}
+
+    shift_rows: list[models.WorkShift] = []
+    if sections & {"day_view", "roster"}:
+        shift_rows = (
+            db.query(models.WorkShift)
+            .filter(
+                models.WorkShift.work_date == date,
+                models.WorkShift.owner == owner,
+            )
+            .order_by(models.WorkShift.start_time)
+            .all()
+        )
+
+    order_rows: list[models.Order] = []
+    if sections & {"day_view", "active_orders"}:
+        order_rows = (
+            db.query(models.Order)
+            .filter(
+                models.Order.order_date == date,
+                models.Order.status != "cancelled",
+                models.Order.owner == owner,
+            )
+            .order_by(models.Order.start_datetime)
+            .all()
+        )
+
+    if "day_view" in sections:
+        active_staff = [row for row in staff_rows if row.status == "active"]
+        bundle["day_view"] = _build_day_view(active_staff, shift_rows, order_rows)
+
+    if "active_orders" in sections:
+        bundle["active_orders"] = [
+            _to_order_read(row, staff_map[row.staff_id].name)
+            for row in order_rows
+            if row.staff_id in staff_map
+        ]
+
+    if "roster" in sections:
+        bundle["roster"] = [
+            schemas.WorkShiftRead(
+                id=row.id,
+                staff_id=row.staff_id,
+                work_date=row.work_date,
+                start_time=row.start_time,
+                end_time=row.end_time,
+                staff=(
+                    schemas.StaffSummary(
+                        id=staff_map[row.staff_id].id,
+                        name=staff_map[row.staff_id].name,
+                        nickname=staff_map[row.staff_id].nickname,
+                    )
+                    if row.staff_id in staff_map
+                    else None
+                ),
+            )
+            for row in shift_rows
+        ]
+
+    if "staff" in sections:
+        bundle["staff"] = list(reversed(staff_rows))
+
+    if "packages" in sections:
+        bundle["packages"] = list_packages(db=db, current_account=current_account)
+
+    month = date[:7]
+    if "order_marks" in sections:
+        bundle["order_marks"] = get_order_marks(
+            month=month, db=db, current_account=current_account
+        )
+    if "roster_marks" in sections:
+        bundle["roster_marks"] = get_roster_marks(
+            month=month, db=db, current_account=current_account
+        )
+
+    return bundle
@@ -1,14 +1,33 @@
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import select, text
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
 from ..database import get_db
+from ..idempotency import run_idempotent
+from ..query_budget import query_budget
+from ..recurring import current_month, materialize_month, materialize_recurring, month_index
 from ..security import get_current_account
 
 router = APIRouter(prefix="/api/expenses", tags=["支出"])
 
+# 列表只读取 ExpenseRead 需要的列，直接返回命名行，不构造 ORM 实例
+_EXPENSE_READ_COLUMNS = (
+    models.Expense.id,
+    models.Expense.title,
+    models.Expense.amount,
+    models.Expense.expense_date,
+    models.Expense.category,
+    models.Expense.note,
+    models.Expense.recurring_id,
+)
+
+# 单次补录的最大月数（递归 CTE 展开的月份数）
+RECURRING_BACKFILL_MAX_MONTHS = 120
+
 
 @router.post(
     "",
@@ -16,12 +35,30 @@ router = APIRouter(prefix="/api/expenses", tags=["支出"])
     status_code=status.HTTP_201_CREATED,
     summary="新增支出记录",
 )
+@query_budget(6)
 def create_expense(
     expense_in: schemas.ExpenseCreate,
+    idempotency_key: Optional[str] = Header(
+        None, description="幂等键：重试时携带相同值将直接返回首次结果"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.ExpenseRead:
     """新增一条支出记录（如房租、水电等）。"""
+    return run_idempotent(
+        db,
+        current_account["username"],
+        "create_expense",
+        idempotency_key,
+        expense_in,
+        lambda: _create_expense(expense_in, db, current_account),
+        status.HTTP_201_CREATED,
+    )
+
+
+def _create_expense(
+    expense_in: schemas.ExpenseCreate, db: Session, current_account: dict
+) -> schemas.ExpenseRead:
     if expense_in.amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="amount 必须大于 0"
@@ -36,9 +73,15 @@ def create_expense(
         owner=current_account["username"],
     )
     db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    db.flush()  # 由 run_idempotent 提交
+    return schemas.ExpenseRead(
+        id=db_expense.id,
+        title=db_expense.title,
+        amount=db_expense.amount,
+        expense_date=db_expense.expense_date,
+        category=db_expense.category,
+        note=db_expense.note,
+    )
 
 
 @router.get(
@@ -46,6 +89,7 @@ def create_expense(
     response_model=List[schemas.ExpenseRead],
     summary="支出列表",
 )
+@query_budget(3)
 def list_expenses(
     month: Optional[str] = Query(
         None, description="按月份过滤，格式 YYYY-MM（可选）"
@@ -53,29 +97,201 @@ def list_expenses(
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> List[schemas.ExpenseRead]:
-    """查询支出列表，可按月份过滤。"""
-    query = db.query(models.Expense).filter(
-        models.Expense.owner == current_account["username"]
-    )
+    """查询支出列表，可按月份过滤；按月查询时先生成该月的周期性支出。"""
+    owner = current_account["username"]
+    stmt = select(*_EXPENSE_READ_COLUMNS).where(models.Expense.owner == owner)
     if month:
-        if len(month) != 7 or "-" not in month:
+        try:
+            datetime.strptime(month, "%Y-%m")
+        except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="month 必须是 YYYY-MM 格式",
             )
+        materialize_month(db, owner, month)
         like_pattern = f"{month}-%"
-        query = query.filter(models.Expense.expense_date.like(like_pattern))
+        stmt = stmt.where(models.Expense.expense_date.like(like_pattern))
 
-    return query.order_by(
-        models.Expense.expense_date.desc(), models.Expense.id.desc()
+    return db.execute(
+        stmt.order_by(models.Expense.expense_date.desc(), models.Expense.id.desc())
     ).all()
 
 
+@router.post(
+    "/recurring",
+    response_model=schemas.RecurringExpenseRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="新增周期性支出",
+)
+@query_budget(2)
+def create_recurring_expense(
+    recurring_in: schemas.RecurringExpenseCreate,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> models.RecurringExpense:
+    """定义按月/季/年重复的支出；各月实例在首次查询该月时生成，历史月份可批量补录。"""
+    _check_recurring(recurring_in.amount, recurring_in.start_month, recurring_in.end_month)
+    db_recurring = models.RecurringExpense(
+        **recurring_in.dict(), owner=current_account["username"]
+    )
+    db.add(db_recurring)
+    db.commit()
+    db.refresh(db_recurring)
+    return db_recurring
+
+
+@router.get(
+    "/recurring",
+    response_model=List[schemas.RecurringExpenseRead],
+    summary="周期性支出列表",
+)
+@query_budget(1)
+def list_recurring_expenses(
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[models.RecurringExpense]:
+    return (
+        db.query(models.RecurringExpense)
+        .filter(models.RecurringExpense.owner == current_account["username"])
+        .order_by(models.RecurringExpense.id)
+        .all()
+    )
+
+
+@router.post(
+    "/recurring/backfill",
+    response_model=schemas.RecurringBackfillResponse,
+    summary="补录历史月份的周期性支出",
+)
+@query_budget(2)
+def backfill_recurring_expenses(
+    backfill_in: schemas.RecurringBackfillRequest,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.RecurringBackfillResponse:
+    """一次生成月份范围内全部尚未生成的周期性支出（单条 INSERT ... SELECT）。"""
+    from_month, to_month = backfill_in.from_month, backfill_in.to_month
+    if from_month > to_month:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="from_month 不能晚于 to_month",
+        )
+    if to_month > current_month():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="不能补录未来月份",
+        )
+    if month_index(to_month) - month_index(from_month) >= RECURRING_BACKFILL_MAX_MONTHS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多补录 {RECURRING_BACKFILL_MAX_MONTHS} 个月",
+        )
+    created = materialize_recurring(
+        db, current_account["username"], from_month, to_month
+    )
+    db.commit()
+    return schemas.RecurringBackfillResponse(
+        from_month=from_month, to_month=to_month, created=created
+    )
+
+
+@router.put(
+    "/recurring/{recurring_id}",
+    response_model=schemas.RecurringExpenseRead,
+    summary="更新周期性支出",
+)
+@query_budget(3)
+def update_recurring_expense(
+    recurring_id: int,
+    recurring_in: schemas.RecurringExpenseUpdate,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> models.RecurringExpense:
+    """修改定义只影响之后生成的月份，已生成的支出保持不变。"""
+    db_recurring = (
+        db.query(models.RecurringExpense)
+        .filter(
+            models.RecurringExpense.id == recurring_id,
+            models.RecurringExpense.owner == current_account["username"],
+        )
+        .first()
+    )
+    if not db_recurring:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="周期性支出不存在"
+        )
+
+    update_data = recurring_in.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        if field != "end_month" and value is None:
+            continue
+        setattr(db_recurring, field, value)
+    _check_recurring(
+        db_recurring.amount, db_recurring.start_month, db_recurring.end_month
+    )
+
+    db.commit()
+    db.refresh(db_recurring)
+    return db_recurring
+
+
+@router.delete(
+    "/recurring/{recurring_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="删除周期性支出",
+)
+@query_budget(3)
+def delete_recurring_expense(
+    recurring_id: int,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> None:
+    """删除定义后不再生成新的月份；已生成的支出保留为普通支出。"""
+    params = {"id": recurring_id, "owner": current_account["username"]}
+    db.execute(
+        text(
+            "UPDATE expenses SET recurring_id = NULL "
+            "WHERE recurring_id = :id AND owner = :owner"
+        ),
+        params,
+    )
+    db.execute(
+        text(
+            "DELETE FROM recurring_expense_runs "
+            "WHERE recurring_id = :id AND owner = :owner"
+        ),
+        params,
+    )
+    deleted = db.execute(
+        text("DELETE FROM recurring_expenses WHERE id = :id AND owner = :owner"),
+        params,
+    ).rowcount
+    if not deleted:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="周期性支出不存在"
+        )
+    db.commit()
+
+
+def _check_recurring(amount: float, start_month: str, end_month: Optional[str]) -> None:
+    if amount <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="amount 必须大于 0"
+        )
+    if end_month is not None and end_month < start_month:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_month 不能早于 start_month",
+        )
+
+
 @router.put(
     "/{expense_id}",
     response_model=schemas.ExpenseRead,
     summary="更新支出记录",
 )
+@query_budget(3)
 def update_expense(
     expense_id: int,
     expense_in: schemas.ExpenseUpdate,
@@ -117,6 +333,7 @@ def update_expense(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="删除支出记录",
 )
+@query_budget(2)
 def delete_expense(
     expense_id: int,
     db: Session = Depends(get_db),
@@ -1,12 +1,29 @@
-from typing import List
+import json
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Tuple
 
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
-from ..database import get_db
-from ..security import get_current_account
+from ..commission import check_commission_type, recompute_month, tiers_json
+from ..concurrency import coalesced_report
+from ..database import fan_out, get_db, get_main_db
+from ..forecast import TARGET_UTILIZATION, demand_history, forecast_week
+from ..occupancy import paint_intervals
+from ..rollups import (
+    PAYMENT_UNKNOWN,
+    close_business_day,
+    mark_rollups_stale,
+    merge_amounts,
+)
+from ..query_budget import query_budget
+from ..recurring import materialize_month
+from ..security import LRUCache, get_current_account
+from ..simulation import simulate_month
 
 router = APIRouter(prefix="/api/finance", tags=["财务"])
 
@@ -26,17 +43,54 @@ def _validate_month(month: str) -> str:
     return month
 
 
+def _format_minute(value: int) -> str:
+    """当日分钟数格式化为 HH:MM:ss。"""
+    return f"{value // 60:02d}:{value % 60:02d}:00"
+
+
 @router.get(
     "/salary_slip",
     response_model=schemas.SalarySlipResponse,
     summary="工资条列表",
 )
+@coalesced_report("salary_slip")
+@query_budget(4)
 def get_salary_slip(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.SalarySlipResponse:
     """按月生成所有员工的工资条汇总。"""
+    return _build_salary_slip(month, db, current_account)
+
+
+def _tier_breakdown(row: models.StaffTierTotal) -> List[schemas.SalaryTierStat]:
+    """分档累计行 -> 各档明细；档位取该月最近一单日期有效的分档。"""
+    schedule = json.loads(row.tier_schedule or "[]")
+    stats = json.loads(row.tier_stats or "[]")
+    result: List[schemas.SalaryTierStat] = []
+    from_order = 1
+    for i in range(max(len(schedule), len(stats))):
+        tier = schedule[i] if i < len(schedule) else {"up_to": None, "rate": 0.0}
+        count, basis, commission = stats[i] if i < len(stats) else (0, 0.0, 0.0)
+        result.append(
+            schemas.SalaryTierStat(
+                tier=i + 1,
+                from_order=from_order,
+                up_to=tier["up_to"],
+                rate=tier["rate"],
+                order_count=int(round(count)),
+                basis_amount=round(basis, 2),
+                commission=round(commission, 2),
+            )
+        )
+        from_order = (tier["up_to"] or 0) + 1
+    return result
+
+
+def _build_salary_slip(
+    month: str, db: Session, current_account: dict
+) -> schemas.SalarySlipResponse:
     month = _validate_month(month)
     like_pattern = f"{month}-%"
 
@@ -50,40 +104,83 @@ def get_salary_slip(
         .all()
     )
 
-    items: List[schemas.SalaryItem] = []
-    for staff in staff_list:
-        commission_total = (
-            db.query(func.coalesce(func.sum(models.Order.commission_amount), 0.0))
-            .filter(
-                models.Order.staff_id == staff.id,
-                models.Order.status == "completed",
-                models.Order.order_date.like(like_pattern),
-                models.Order.owner == current_account["username"],
-            )
-            .scalar()
+    # 续钟明细按员工 + 续钟套餐归集（提成已包含在订单 commission_amount 中，此处仅做拆分展示）
+    ext_rows = (
+        db.query(
+            models.Order.staff_id,
+            models.OrderExtension.package_id,
+            models.ServicePackage.name.label("package_name"),
+            func.count(models.OrderExtension.id).label("cnt"),
+            func.coalesce(func.sum(models.OrderExtension.minutes_snapshot), 0).label("minutes"),
+            func.coalesce(func.sum(models.OrderExtension.commission_snapshot), 0.0).label(
+                "commission"
+            ),
+        )
+        .join(models.Order, models.Order.id == models.OrderExtension.order_id)
+        .outerjoin(
+            models.ServicePackage,
+            models.ServicePackage.id == models.OrderExtension.package_id,
         )
+        .filter(
+            models.OrderExtension.owner == current_account["username"],
+            models.Order.status == "completed",
+            models.Order.order_date.like(like_pattern),
+        )
+        .group_by(
+            models.Order.staff_id,
+            models.OrderExtension.package_id,
+            models.ServicePackage.name,
+        )
+        .all()
+    )
+    ext_map: dict[int, list] = {}
+    for row in ext_rows:
+        ext_map.setdefault(row.staff_id, []).append(row)
 
-        pkg_rows = (
-            db.query(
-                models.Order.package_id,
-                models.Order.package_name,
-                func.count(models.Order.id).label("cnt"),
-                func.coalesce(func.sum(models.Order.total_amount), 0.0).label("amount"),
-                func.coalesce(func.sum(models.Order.commission_amount), 0.0).label(
-                    "commission"
-                ),
-            )
-            .filter(
-                models.Order.staff_id == staff.id,
-                models.Order.status == "completed",
-                models.Order.order_date.like(like_pattern),
-                models.Order.owner == current_account["username"],
-            )
-            .group_by(models.Order.package_id, models.Order.package_name)
-            .all()
+    # 已完成订单按员工 + 套餐一次性归集
+    pkg_rows = (
+        db.query(
+            models.Order.staff_id,
+            models.Order.package_id,
+            models.Order.package_name,
+            func.count(models.Order.id).label("cnt"),
+            func.coalesce(func.sum(models.Order.total_amount), 0.0).label("amount"),
+            func.coalesce(func.sum(models.Order.commission_amount), 0.0).label(
+                "commission"
+            ),
         )
+        .filter(
+            models.Order.status == "completed",
+            models.Order.order_date.like(like_pattern),
+            models.Order.owner == current_account["username"],
+        )
+        .group_by(
+            models.Order.staff_id,
+            models.Order.package_id,
+            models.Order.package_name,
+        )
+        .all()
+    )
+    pkg_map: dict[int, list] = {}
+    for row in pkg_rows:
+        pkg_map.setdefault(row.staff_id, []).append(row)
+
+    # 分档提成员工的当月累计（订单完成时已增量维护）
+    tier_map = {
+        row.staff_id: row
+        for row in db.query(models.StaffTierTotal).filter(
+            models.StaffTierTotal.owner == current_account["username"],
+            models.StaffTierTotal.month == month,
+        )
+    }
+
+    items: List[schemas.SalaryItem] = []
+    for staff in staff_list:
+        staff_pkg_rows = pkg_map.get(staff.id, [])
+        commission_total = sum(float(row.commission or 0.0) for row in staff_pkg_rows)
+
         package_stats: list[schemas.SalaryPackageStat] = []
-        for row in pkg_rows:
+        for row in staff_pkg_rows:
             package_stats.append(
                 schemas.SalaryPackageStat(
                     package_id=row.package_id,
@@ -93,6 +190,22 @@ def get_salary_slip(
                     total_commission=float(row.commission or 0.0),
                 )
             )
+        stats_by_package = {stat.package_id: stat for stat in package_stats}
+        for row in ext_map.get(staff.id, []):
+            stat = stats_by_package.get(row.package_id)
+            if stat is None:
+                stat = schemas.SalaryPackageStat(
+                    package_id=row.package_id,
+                    package_name=row.package_name or "未指定套餐",
+                    order_count=0,
+                    total_amount=0.0,
+                    total_commission=0.0,
+                )
+                stats_by_package[row.package_id] = stat
+                package_stats.append(stat)
+            stat.extension_count = row.cnt
+            stat.extension_minutes = int(row.minutes or 0)
+            stat.extension_commission = float(row.commission or 0.0)
 
         base_salary = staff.base_salary or 0.0
         total_salary = base_salary + float(commission_total or 0.0)
@@ -104,6 +217,7 @@ def get_salary_slip(
                 commission_total=float(commission_total or 0.0),
                 total_salary=total_salary,
                 packages=package_stats,
+                tiers=_tier_breakdown(tier_map[staff.id]) if staff.id in tier_map else [],
             )
         )
 
@@ -115,6 +229,8 @@ def get_salary_slip(
     response_model=schemas.FinanceDashboardResponse,
     summary="财务总览",
 )
+@coalesced_report("dashboard")
+@query_budget(9)
 def get_finance_dashboard(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
@@ -124,38 +240,74 @@ def get_finance_dashboard(
     month = _validate_month(month)
     like_pattern = f"{month}-%"
 
-    # 总营收
-    total_revenue = (
-        db.query(func.coalesce(func.sum(models.Order.total_amount), 0.0))
+    owner = current_account["username"]
+
+    # 已日结且有效的日期直接累加汇总行
+    rollups = (
+        db.query(
+            models.DailyRollup.total_revenue,
+            models.DailyRollup.total_commission,
+            models.DailyRollup.revenue_by_payment,
+        )
         .filter(
-            models.Order.status == "completed",
-            models.Order.order_date.like(like_pattern),
-            models.Order.owner == current_account["username"],
+            models.DailyRollup.owner == owner,
+            models.DailyRollup.stale == 0,
+            models.DailyRollup.business_date.like(like_pattern),
         )
-        .scalar()
+        .all()
     )
+    revenue_by_payment: dict[str, float] = {}
+    total_revenue = 0.0
+    total_commission = 0.0
+    for row in rollups:
+        total_revenue += float(row.total_revenue or 0.0)
+        total_commission += float(row.total_commission or 0.0)
+        merge_amounts(revenue_by_payment, row.revenue_by_payment)
 
-    # 总提成
-    total_commission = (
-        db.query(func.coalesce(func.sum(models.Order.commission_amount), 0.0))
+    # 其余日期（未日结或日结后有改动）按订单明细计算
+    closed_dates = (
+        db.query(models.DailyRollup.business_date)
+        .filter(
+            models.DailyRollup.owner == owner,
+            models.DailyRollup.stale == 0,
+            models.DailyRollup.business_date.like(like_pattern),
+        )
+        .scalar_subquery()
+    )
+    open_rows = (
+        db.query(
+            models.Order.payment_method,
+            func.coalesce(func.sum(models.Order.total_amount), 0.0).label("revenue"),
+            func.coalesce(func.sum(models.Order.commission_amount), 0.0).label(
+                "commission"
+            ),
+        )
         .filter(
             models.Order.status == "completed",
             models.Order.order_date.like(like_pattern),
-            models.Order.owner == current_account["username"],
+            models.Order.owner == owner,
+            models.Order.order_date.not_in(closed_dates),
         )
-        .scalar()
+        .group_by(models.Order.payment_method)
+        .all()
     )
+    for row in open_rows:
+        method = row.payment_method or PAYMENT_UNKNOWN
+        revenue_by_payment[method] = revenue_by_payment.get(method, 0.0) + float(
+            row.revenue or 0.0
+        )
+        total_revenue += float(row.revenue or 0.0)
+        total_commission += float(row.commission or 0.0)
 
     # 工资条（用于计算总底薪与应发工资）
-    salary_slip = get_salary_slip(
-        month=month, db=db, current_account=current_account
-    )
+    salary_slip = _build_salary_slip(month, db, current_account)
     total_base_salary = float(
         sum(item.base_salary for item in salary_slip.items)
     )
     total_salary = float(sum(item.total_salary for item in salary_slip.items))
 
-    # 其他支出
+    # 其他支出（含该月首次查询时生成的周期性支出）
+    materialize_month(db, owner, month)
     total_expenses = (
         db.query(func.coalesce(func.sum(models.Expense.amount), 0.0))
         .filter(
@@ -177,6 +329,162 @@ def get_finance_dashboard(
         total_salary=total_salary,
         total_expenses=float(total_expenses or 0.0),
         net_profit=net_profit,
+        revenue_by_payment=revenue_by_payment,
+        closed_days=len(rollups),
+    )
+
+
+# 组合视图每页列出的店铺数；投资人关联的店铺总数上限决定查询预算，超出时拒绝
+PORTFOLIO_PAGE_SIZE = 16
+PORTFOLIO_MAX_SHOPS = 64
+PORTFOLIO_CACHE_SIZE = 1024
+
+# 单店月度汇总：每个分库只有一个 owner，已完成订单、在职员工底薪与支出合并后
+# 一条语句得出；提成只计在职员工，与工资条口径一致
+_SHOP_TOTALS_SQL = text(
+    """
+    SELECT COALESCE(sum(orders), 0) AS order_count,
+           COALESCE(sum(revenue), 0) AS revenue,
+           COALESCE(sum(commission), 0) AS commission,
+           COALESCE(sum(base_salary), 0) AS base_salary,
+           COALESCE(sum(expenses), 0) AS expenses
+    FROM (
+        SELECT 1 AS orders, o.total_amount AS revenue,
+               CASE WHEN s.status = 'active' THEN o.commission_amount ELSE 0 END
+                   AS commission,
+               0 AS base_salary, 0 AS expenses
+        FROM orders o
+        LEFT JOIN staff s ON s.id = o.staff_id AND s.owner = o.owner
+        WHERE o.owner = :owner AND o.status = 'completed'
+          AND o.order_date LIKE :pattern
+        UNION ALL
+        SELECT 0, 0, 0, base_salary, 0 FROM staff
+        WHERE owner = :owner AND status = 'active'
+        UNION ALL
+        SELECT 0, 0, 0, 0, amount FROM expenses
+        WHERE owner = :owner AND expense_date LIKE :pattern
+    )
+    """
+)
+
+# (owner, 月份) -> (分库 change_log 最大 id, 单店汇总)；只缓存已结束的月份
+_shop_cache: LRUCache[Tuple[str, str], Tuple[int, schemas.PortfolioShopItem]] = LRUCache(
+    PORTFOLIO_CACHE_SIZE
+)
+# (投资人, 月份) -> (各店版本, 组合合计)
+_portfolio_cache: LRUCache[
+    Tuple[str, str], Tuple[Tuple[Tuple[str, int], ...], schemas.PortfolioTotals]
+] = LRUCache(PORTFOLIO_CACHE_SIZE)
+
+
+def _shop_item(owner: str, row) -> schemas.PortfolioShopItem:
+    revenue = float(row.revenue) if row else 0.0
+    commission = float(row.commission) if row else 0.0
+    base_salary = float(row.base_salary) if row else 0.0
+    expenses = float(row.expenses) if row else 0.0
+    total_salary = base_salary + commission
+    return schemas.PortfolioShopItem(
+        owner=owner,
+        order_count=int(row.order_count) if row else 0,
+        total_revenue=revenue,
+        total_commission=commission,
+        total_base_salary=base_salary,
+        total_salary=total_salary,
+        total_expenses=expenses,
+        net_profit=revenue - total_salary - expenses,
+    )
+
+
+def _shop_totals(
+    db: Session, owner: str, month: str, closed: bool
+) -> Tuple[int, schemas.PortfolioShopItem]:
+    """在店铺分库上计算单店月度汇总；已结束月份先按 change_log 版本查缓存。"""
+    # 先生成周期性支出，生成带来的 change_log 变化不会使缓存多失效一次
+    materialize_month(db, owner, month)
+    version = 0
+    if closed:
+        version = db.execute(
+            text("SELECT COALESCE(max(id), 0) FROM change_log WHERE owner = :owner"),
+            {"owner": owner},
+        ).scalar()
+        cached = _shop_cache.get((owner, month))
+        if cached is not None and cached[0] == version:
+            return cached
+    row = db.execute(
+        _SHOP_TOTALS_SQL, {"owner": owner, "pattern": f"{month}-%"}
+    ).first()
+    result = (version, _shop_item(owner, row))
+    if closed:
+        _shop_cache.put((owner, month), result)
+    return result
+
+
+def _sum_shops(shops: List[schemas.PortfolioShopItem]) -> schemas.PortfolioTotals:
+    fields = schemas.PortfolioTotals.__fields__
+    return schemas.PortfolioTotals(
+        **{name: sum(getattr(shop, name) for shop in shops) for name in fields}
+    )
+
+
+@router.get(
+    "/portfolio",
+    response_model=schemas.PortfolioResponse,
+    summary="投资人店铺组合总览",
+)
+@coalesced_report("portfolio")
+@query_budget(1 + 4 * PORTFOLIO_MAX_SHOPS)
+def get_portfolio(
+    month: str = Query(..., description="月份 YYYY-MM"),
+    offset: int = Query(0, ge=0, description="跳过的店铺数（按店铺账号排序）"),
+    db: Session = Depends(get_main_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.PortfolioResponse:
+    """投资人查看所出资各店的营收、工资、支出与净利润，以及组合合计。
+
+    合计始终覆盖投资人关联的全部店铺，与 offset 无关；shops 每页最多
+    PORTFOLIO_PAGE_SIZE 家，还有后续店铺时 truncated 为 true，客户端以 offset
+    继续获取。关联店铺超过 PORTFOLIO_MAX_SHOPS 家时拒绝请求。
+    各店在自己的分库上并行计算；已结束的月份按店缓存，
+    以分库 change_log 最大 id 校验，店内有任何改动即重新计算。
+    """
+    month = _validate_month(month)
+    if current_account["role"] != "investor":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="仅投资人账号可查看店铺组合"
+        )
+    investor = current_account["username"]
+    owners = [
+        row.owner
+        for row in db.query(models.InvestorOwner.owner)
+        .filter(models.InvestorOwner.investor == investor)
+        .order_by(models.InvestorOwner.owner)
+        .limit(PORTFOLIO_MAX_SHOPS + 1)
+    ]
+    if len(owners) > PORTFOLIO_MAX_SHOPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"关联店铺超过 {PORTFOLIO_MAX_SHOPS} 家，无法汇总组合",
+        )
+    closed = month < date.today().strftime("%Y-%m")
+    results = fan_out(owners, lambda shard, owner: _shop_totals(shard, owner, month, closed))
+    page = owners[offset : offset + PORTFOLIO_PAGE_SIZE]
+
+    versions = tuple((owner, results[owner][0]) for owner in owners)
+    cached = _portfolio_cache.get((investor, month)) if closed else None
+    if cached is not None and cached[0] == versions:
+        totals = cached[1]
+    else:
+        totals = _sum_shops([results[owner][1] for owner in owners])
+        if closed:
+            _portfolio_cache.put((investor, month), (versions, totals))
+    return schemas.PortfolioResponse(
+        month=month,
+        closed=closed,
+        shops=[results[owner][1] for owner in page],
+        totals=totals,
+        shop_count=len(owners),
+        offset=offset,
+        truncated=offset + len(page) < len(owners),
     )
 
 
@@ -185,6 +493,8 @@ def get_finance_dashboard(
     response_model=schemas.AttendanceResponse,
     summary="员工出勤统计（排班 + 已完成订单）",
 )
+@coalesced_report("attendance")
+@query_budget(3)
 def get_attendance(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
@@ -197,17 +507,12 @@ def get_attendance(
         )
     like_pattern = f"{month}-%"
 
-    # 排班汇总
-    shift_duration_hours = (
-        (func.julianday(models.WorkShift.work_date + " " + models.WorkShift.end_time)
-         - func.julianday(models.WorkShift.work_date + " " + models.WorkShift.start_time))
-        * 24
-    )
+    # 排班汇总（duration_min 为写入时预计算的整数分钟）
     shift_rows = (
         db.query(
             models.WorkShift.staff_id.label("staff_id"),
             func.count(func.distinct(models.WorkShift.work_date)).label("shift_days"),
-            func.coalesce(func.sum(shift_duration_hours), 0).label("shift_hours"),
+            func.coalesce(func.sum(models.WorkShift.duration_min), 0).label("shift_minutes"),
         )
         .filter(
             models.WorkShift.owner == current_account["username"],
@@ -219,7 +524,7 @@ def get_attendance(
     shift_map = {
         row.staff_id: {
             "shift_days": row.shift_days,
-            "shift_hours": float(row.shift_hours or 0),
+            "shift_hours": float(row.shift_minutes or 0) / 60.0,
         }
         for row in shift_rows
     }
@@ -282,6 +587,8 @@ def get_attendance(
     response_model=schemas.RosterOverviewResponse,
     summary="排班概览（按月）",
 )
+@coalesced_report("roster_overview")
+@query_budget(2)
 def get_roster_overview(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
@@ -296,17 +603,12 @@ def get_roster_overview(
     active_status = ("pending", "in_progress", "finished", "completed")
 
     # 总时长、天数、最早/最晚
-    shift_duration_hours = (
-        (func.julianday(models.WorkShift.work_date + " " + models.WorkShift.end_time)
-         - func.julianday(models.WorkShift.work_date + " " + models.WorkShift.start_time))
-        * 24
-    )
     rows = (
         db.query(
-            func.coalesce(func.sum(shift_duration_hours), 0).label("total_hours"),
+            func.coalesce(func.sum(models.WorkShift.duration_min), 0).label("total_minutes"),
             func.count(func.distinct(models.WorkShift.work_date)).label("shift_days"),
-            func.min(models.WorkShift.start_time).label("earliest"),
-            func.max(models.WorkShift.end_time).label("latest"),
+            func.min(models.WorkShift.start_min).label("earliest"),
+            func.max(models.WorkShift.end_min).label("latest"),
         )
         .filter(
             models.WorkShift.owner == current_account["username"],
@@ -314,11 +616,11 @@ def get_roster_overview(
         )
         .first()
     )
-    total_hours = float(rows.total_hours or 0) if rows else 0.0
+    total_hours = float(rows.total_minutes or 0) / 60.0 if rows else 0.0
     shift_days = int(rows.shift_days or 0) if rows else 0
     avg_daily = total_hours / shift_days if shift_days else 0.0
-    earliest = rows.earliest if rows and rows.earliest else None
-    latest = rows.latest if rows and rows.latest else None
+    earliest = _format_minute(rows.earliest) if rows and shift_days else None
+    latest = _format_minute(rows.latest) if rows and shift_days else None
 
     pkg_minutes_sum = (
         db.query(
@@ -342,3 +644,464 @@ def get_roster_overview(
         earliest_start=earliest,
         latest_end=latest,
     )
+
+
+UTILIZATION_BUCKET_MINUTES = 15
+UTILIZATION_MAX_DAYS = 31
+
+
+def _parse_day(raw: str, name: str) -> datetime:
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d")
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{name} 必须为 YYYY-MM-DD 格式",
+        ) from exc
+
+
+def _ratio(part: np.ndarray, whole: np.ndarray) -> np.ndarray:
+    return np.divide(
+        part, whole, out=np.zeros(part.shape, dtype=float), where=whole > 0
+    )
+
+
+@router.get(
+    "/utilization",
+    response_model=schemas.UtilizationResponse,
+    summary="员工利用率热力图（15 分钟粒度）",
+)
+@coalesced_report("utilization")
+@query_budget(3)
+def get_utilization(
+    from_date: str = Query(..., alias="from", description="起始日期 YYYY-MM-DD"),
+    to_date: str = Query(..., alias="to", description="结束日期 YYYY-MM-DD（含）"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.UtilizationResponse:
+    """按员工 × 分钟绘制排班与预约占用矩阵，汇总为 15 分钟时段热力图与每小时利用率。
+
+    预约统计未取消的订单；跨越区间末尾的订单与排班按区间裁剪。
+    """
+    start_day = _parse_day(from_date, "from")
+    end_day = _parse_day(to_date, "to")
+    days = (end_day - start_day).days + 1
+    if days <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="from 不能晚于 to"
+        )
+    if days > UTILIZATION_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"查询区间最多 {UTILIZATION_MAX_DAYS} 天",
+        )
+    owner = current_account["username"]
+    origin = start_day.strftime("%Y-%m-%d")
+    range_end = f"{to_date} 24:00:00"
+
+    staff_rows = (
+        db.query(models.Staff.id, models.Staff.name)
+        .filter(models.Staff.owner == owner)
+        .order_by(models.Staff.id)
+        .all()
+    )
+    row_of = {row.id: i for i, row in enumerate(staff_rows)}
+
+    # 区间起止统一换算为相对 from 零点的分钟偏移，由 SQLite 计算
+    def minute_offset(column):
+        return func.round((func.julianday(column) - func.julianday(origin)) * 1440)
+
+    day_offset = minute_offset(models.WorkShift.work_date)
+    shifts = (
+        db.query(
+            models.WorkShift.staff_id,
+            day_offset + models.WorkShift.start_min,
+            day_offset + models.WorkShift.end_min,
+        )
+        .filter(
+            models.WorkShift.owner == owner,
+            models.WorkShift.work_date >= from_date,
+            models.WorkShift.work_date <= to_date,
+        )
+        .all()
+    )
+    orders = (
+        db.query(
+            models.Order.staff_id,
+            minute_offset(models.Order.start_datetime),
+            minute_offset(models.Order.end_datetime),
+        )
+        .filter(
+            models.Order.owner == owner,
+            models.Order.status != "cancelled",
+            models.Order.start_datetime < range_end,
+            models.Order.end_datetime > origin,
+        )
+        .all()
+    )
+
+    n_staff = len(staff_rows)
+    n_minutes = days * 1440
+
+    def paint(rows) -> np.ndarray:
+        rows = [row for row in rows if row[0] in row_of]
+        return (
+            paint_intervals(
+                [row_of[row[0]] for row in rows],
+                [int(row[1]) for row in rows],
+                [int(row[2]) for row in rows],
+                n_staff,
+                n_minutes,
+            )
+            > 0
+        )
+
+    rostered = paint(shifts)
+    booked = paint(orders)
+    booked_in = rostered & booked
+    idle = rostered & ~booked
+    off_roster = booked & ~rostered
+
+    buckets_per_day = 1440 // UTILIZATION_BUCKET_MINUTES
+
+    def by_bucket(matrix: np.ndarray) -> np.ndarray:
+        # (员工, 天, 时段, 分钟) -> (员工, 时段)
+        return matrix.reshape(
+            n_staff, days, buckets_per_day, UTILIZATION_BUCKET_MINUTES
+        ).sum(axis=(1, 3))
+
+    def by_hour(matrix: np.ndarray) -> np.ndarray:
+        # (员工, 天, 小时, 分钟) -> (小时,)
+        return matrix.reshape(n_staff, days, 24, 60).sum(axis=(0, 1, 3))
+
+    rostered_b = by_bucket(rostered)
+    booked_b = by_bucket(booked)
+    off_b = by_bucket(off_roster)
+    rostered_min = rostered_b.sum(axis=1)
+    booked_min = booked_b.sum(axis=1)
+    booked_in_min = booked_in.sum(axis=1)
+    idle_min = idle.sum(axis=1)
+    off_min = off_b.sum(axis=1)
+    staff_ratio = _ratio(booked_in_min, rostered_min)
+
+    items: list[schemas.UtilizationStaffItem] = []
+    for i, row in enumerate(staff_rows):
+        items.append(
+            schemas.UtilizationStaffItem(
+                staff_id=row.id,
+                staff_name=row.name,
+                rostered_hours=float(rostered_min[i]) / 60.0,
+                booked_hours=float(booked_min[i]) / 60.0,
+                idle_rostered_hours=float(idle_min[i]) / 60.0,
+                off_roster_booked_hours=float(off_min[i]) / 60.0,
+                utilization=round(float(staff_ratio[i]), 4),
+                bucket_rostered_minutes=rostered_b[i].tolist(),
+                bucket_booked_minutes=booked_b[i].tolist(),
+                bucket_off_roster_minutes=off_b[i].tolist(),
+            )
+        )
+
+    hour_rostered = by_hour(rostered)
+    hour_booked = by_hour(booked)
+    hour_booked_in = by_hour(booked_in)
+    hour_idle = by_hour(idle)
+    hour_off = by_hour(off_roster)
+    hour_ratio = _ratio(hour_booked_in, hour_rostered)
+    hours = [
+        schemas.UtilizationHourItem(
+            hour=h,
+            rostered_hours=float(hour_rostered[h]) / 60.0,
+            booked_hours=float(hour_booked[h]) / 60.0,
+            idle_rostered_hours=float(hour_idle[h]) / 60.0,
+            off_roster_booked_hours=float(hour_off[h]) / 60.0,
+            utilization=round(float(hour_ratio[h]), 4),
+        )
+        for h in range(24)
+    ]
+
+    return schemas.UtilizationResponse(
+        from_date=from_date,
+        to_date=to_date,
+        bucket_minutes=UTILIZATION_BUCKET_MINUTES,
+        items=items,
+        hours=hours,
+    )
+
+
+@router.get(
+    "/demand_forecast",
+    response_model=schemas.DemandForecastResponse,
+    summary="按周内小时的需求预测与建议排班人数",
+)
+@coalesced_report("demand_forecast")
+@query_budget(4)
+def get_demand_forecast(
+    week: str = Query(..., description="目标周内任意日期 YYYY-MM-DD"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.DemandForecastResponse:
+    """基于历史已完成订单预测目标周每小时的服务需求，并与目标周已排班人数对比。
+
+    历史聚合按账号缓存，只重算订单改动涉及的已结束日期并补算新结束的日期；
+    排班人数按目标周的排班实时计算。
+    """
+    week_start = _parse_day(week, "week").date()
+    week_start -= timedelta(days=week_start.weekday())
+    week_end = week_start + timedelta(days=6)
+    owner = current_account["username"]
+
+    history = demand_history.get(db, owner, date.today())
+    forecast, history_weeks = forecast_week(history, week_start)
+
+    shifts = (
+        db.query(
+            models.WorkShift.work_date,
+            models.WorkShift.start_min,
+            models.WorkShift.end_min,
+        )
+        .filter(
+            models.WorkShift.owner == owner,
+            models.WorkShift.work_date >= week_start.isoformat(),
+            models.WorkShift.work_date <= week_end.isoformat(),
+        )
+        .all()
+    )
+    offsets = [
+        (datetime.strptime(row.work_date, "%Y-%m-%d").date() - week_start).days * 1440
+        for row in shifts
+    ]
+    rostered = (
+        paint_intervals(
+            [0] * len(shifts),
+            [offset + row.start_min for offset, row in zip(offsets, shifts)],
+            [offset + row.end_min for offset, row in zip(offsets, shifts)],
+            1,
+            7 * 1440,
+        )
+        .reshape(7 * 24, 60)
+        .sum(axis=1)
+        / 60.0
+    )
+
+    items = [
+        schemas.DemandForecastItem(
+            weekday=slot // 24,
+            hour=slot % 24,
+            forecast_staff=round(float(forecast[slot]), 2),
+            rostered_staff=round(float(rostered[slot]), 2),
+            suggested_headcount=math.ceil(
+                round(float(forecast[slot]) / TARGET_UTILIZATION, 6)
+            ),
+        )
+        for slot in range(7 * 24)
+    ]
+    return schemas.DemandForecastResponse(
+        week_start=week_start.isoformat(),
+        history_weeks=history_weeks,
+        items=items,
+    )
+
+
+def _to_rollup_read(row: models.DailyRollup) -> schemas.DailyRollupRead:
+    by_staff: dict[str, float] = {}
+    merge_amounts(by_staff, row.commission_by_staff)
+    by_payment: dict[str, float] = {}
+    merge_amounts(by_payment, row.revenue_by_payment)
+    return schemas.DailyRollupRead(
+        business_date=row.business_date,
+        order_count=row.order_count,
+        booked_minutes=row.booked_minutes,
+        total_revenue=row.total_revenue,
+        total_commission=row.total_commission,
+        revenue_by_payment=by_payment,
+        commission_by_staff=by_staff,
+        stale=bool(row.stale),
+    )
+
+
+@router.post(
+    "/close_day",
+    response_model=schemas.DailyRollupRead,
+    summary="日结（批量完成待结算订单并生成当日汇总）",
+)
+@query_budget(12)
+def close_day(
+    payload: schemas.DailyCloseRequest,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.DailyRollupRead:
+    """将当日全部待结算（finished）订单置为已完成，并按支付方式/员工汇总当日营收与提成。
+
+    可重复执行：再次日结会完成新的待结算订单并覆盖当日汇总。
+    """
+    if payload.date > date.today().isoformat():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="不能日结未来的日期"
+        )
+    owner = current_account["username"]
+    result = close_business_day(db, owner, payload.date)
+    return schemas.DailyRollupRead(
+        business_date=result.business_date,
+        order_count=result.order_count,
+        booked_minutes=result.booked_minutes,
+        total_revenue=result.total_revenue,
+        total_commission=result.total_commission,
+        revenue_by_payment=result.revenue_by_payment,
+        commission_by_staff=result.commission_by_staff,
+        closed_orders=result.closed_orders,
+        open_orders=result.open_orders,
+    )
+
+
+@router.post(
+    "/recompute_commissions",
+    response_model=schemas.CommissionRecomputeResponse,
+    summary="按当时有效的提成配置重算某月订单提成",
+)
+@query_budget(8)
+def recompute_commissions(
+    month: str = Query(..., description="月份 YYYY-MM"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.CommissionRecomputeResponse:
+    """补录了生效日期在过去的提成配置后，用各订单日期当时有效的版本重算该月提成快照。
+
+    整月订单一次读取、整列计算，只回写有变化的订单并重建分档累计；涉及的日结汇总随之失效。
+    """
+    month = _validate_month(month)
+    result = recompute_month(db, current_account["username"], month)
+    mark_rollups_stale(db, current_account["username"], result.changed_dates)
+    db.commit()
+    return schemas.CommissionRecomputeResponse(
+        month=month,
+        order_count=result.order_count,
+        changed_orders=result.changed_orders,
+        changed_extensions=result.changed_extensions,
+        commission_before=result.commission_before,
+        commission_after=result.commission_after,
+    )
+
+
+@router.post(
+    "/simulate",
+    response_model=schemas.PayrollSimulationResponse,
+    summary="工资试算（按假设的提成配置重算某月，不保存）",
+)
+@query_budget(5)
+def simulate_payroll(
+    payload: schemas.PayrollSimulationRequest,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.PayrollSimulationResponse:
+    """调整员工提成或套餐价格/默认提成前，预览对该月工资的影响。
+
+    假设配置视为整月生效；commission_before 为订单当前的提成快照（与工资条一致），
+    补录过去生效的配置后应先重算提成再试算。
+    """
+    owner = current_account["username"]
+    month = _validate_month(payload.month)
+    staff_rows = {
+        row.id: row
+        for row in db.query(
+            models.Staff.id, models.Staff.name, models.Staff.status, models.Staff.base_salary
+        ).filter(models.Staff.owner == owner)
+    }
+    package_ids = {
+        row.id
+        for row in db.query(models.ServicePackage.id).filter(
+            models.ServicePackage.owner == owner
+        )
+    }
+
+    overrides: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for rule in payload.staff:
+        changes = rule.dict(exclude_none=True, exclude={"staff_id"})
+        if "commission_type" in changes:
+            check_commission_type(changes["commission_type"])
+        if "commission_tiers" in changes:
+            changes["commission_tiers"] = tiers_json(changes["commission_tiers"])
+        overrides[(rule.staff_id, 0)] = changes
+    for rule in payload.packages:
+        overrides[(0, rule.package_id)] = rule.dict(
+            exclude_none=True, exclude={"package_id"}
+        )
+    for rule in payload.fixed_commissions:
+        overrides[(rule.staff_id, rule.package_id)] = {
+            "commission_value": rule.commission_amount
+        }
+    for staff_id, package_id in overrides:
+        if staff_id and staff_id not in staff_rows:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="指定的 staff_id 不存在"
+            )
+        if package_id and package_id not in package_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="指定的套餐不存在"
+            )
+    if any(
+        isinstance(value, (int, float)) and value < 0
+        for changes in overrides.values()
+        for value in changes.values()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="价格与提成不能为负数"
+        )
+
+    # 在职员工与本月有已完成订单的员工都列出
+    payroll = {item.staff_id: item for item in simulate_month(db, owner, month, overrides)}
+    items: List[schemas.PayrollSimulationItem] = []
+    for staff in staff_rows.values():
+        item = payroll.get(staff.id)
+        if item is None and staff.status != "active":
+            continue
+        before = item.commission_before if item else 0.0
+        after = item.commission_after if item else 0.0
+        base_salary = staff.base_salary or 0.0
+        items.append(
+            schemas.PayrollSimulationItem(
+                staff_id=staff.id,
+                staff_name=staff.name,
+                base_salary=base_salary,
+                order_count=item.order_count if item else 0,
+                commission_before=round(before, 2),
+                commission_after=round(after, 2),
+                difference=round(after - before, 2),
+                total_salary_before=round(base_salary + before, 2),
+                total_salary_after=round(base_salary + after, 2),
+            )
+        )
+    before = sum(item.commission_before for item in payroll.values())
+    after = sum(item.commission_after for item in payroll.values())
+    return schemas.PayrollSimulationResponse(
+        month=month,
+        order_count=sum(item.order_count for item in payroll.values()),
+        commission_before=round(before, 2),
+        commission_after=round(after, 2),
+        difference=round(after - before, 2),
+        items=sorted(items, key=lambda item: item.staff_id),
+    )
+
+
+@router.get(
+    "/daily_rollups",
+    response_model=List[schemas.DailyRollupRead],
+    summary="日结汇总列表（按月）",
+)
+@query_budget(1)
+def list_daily_rollups(
+    month: str = Query(..., description="月份 YYYY-MM"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[schemas.DailyRollupRead]:
+    """返回指定月份每个已日结营业日的汇总，用于按支付方式对账。"""
+    month = _validate_month(month)
+    rows = (
+        db.query(models.DailyRollup)
+        .filter(
+            models.DailyRollup.owner == current_account["username"],
+            models.DailyRollup.business_date.like(f"{month}-%"),
+        )
+        .order_by(models.DailyRollup.business_date)
+        .all()
+    )
+    return [_to_rollup_read(row) for row in rows]
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import ORDER_OVERLAP_ERROR, get_db
+from ..query_budget import query_budget
+from ..security import get_current_account
+
+router = APIRouter(prefix="/api/holds", tags=["预留"])
+
+# 预留存放在账号分库中（多个 worker 共享），到期判断全部在 SQL 中完成；
+# 到期清理按 (owner, expires_at) 索引做范围删除，代价与到期条数成正比
+_EXPIRES_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _now_utc() -> str:
+    return datetime.utcnow().strftime(_EXPIRES_FORMAT)
+
+
+def purge_expired_holds(db: Session, owner: str) -> None:
+    db.execute(
+        text("DELETE FROM order_holds WHERE owner = :owner AND expires_at <= :now"),
+        {"owner": owner, "now": _now_utc()},
+    )
+
+
+def held_staff_ids(
+    db: Session, owner: str, start: str, end: str, exclude_hold_id: Optional[int] = None
+) -> Set[int]:
+    """与 [start, end) 有重叠的有效预留所锁定的员工。"""
+    rows = db.execute(
+        text(
+            "SELECT DISTINCT staff_id FROM order_holds "
+            "WHERE owner = :owner AND expires_at > :now "
+            "AND start_datetime < :end AND end_datetime > :start "
+            "AND id != :exclude"
+        ),
+        {
+            "owner": owner,
+            "now": _now_utc(),
+            "start": start,
+            "end": end,
+            "exclude": exclude_hold_id or 0,
+        },
+    )
+    return {row.staff_id for row in rows}
+
+
+def consume_hold(
+    db: Session, owner: str, hold_id: int, staff_id: int, start: str, end: str
+) -> None:
+    """在当前事务内删除预留并校验订单落在预留范围内（不提交）。
+
+    预留创建时已由触发器保证与其他订单、预留不重叠，转订单时无需再做撞单查询；
+    校验失败时抛出 400，调用方不提交事务即可恢复预留。
+    """
+    hold = db.execute(
+        text(
+            "DELETE FROM order_holds "
+            "WHERE id = :id AND owner = :owner AND expires_at > :now "
+            "RETURNING staff_id, start_datetime, end_datetime"
+        ),
+        {"id": hold_id, "owner": owner, "now": _now_utc()},
+    ).first()
+    if hold is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="预留不存在或已过期"
+        )
+    if (
+        hold.staff_id != staff_id
+        or start < hold.start_datetime
+        or end > hold.end_datetime
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="订单的员工或时间段与预留不一致",
+        )
+
+
+@router.post(
+    "",
+    response_model=schemas.HoldRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="预留员工时间段（限时）",
+)
+@query_budget(4)
+def create_hold(
+    hold_in: schemas.HoldCreate,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> models.OrderHold:
+    """在 ttl_minutes 内锁定员工的时间段，其他订单与预留不能占用；到期自动失效。"""
+    owner = current_account["username"]
+    if hold_in.start_datetime >= hold_in.end_datetime:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="开始时间必须早于结束时间",
+        )
+    staff = (
+        db.query(models.Staff.id)
+        .filter(models.Staff.id == hold_in.staff_id, models.Staff.owner == owner)
+        .first()
+    )
+    if not staff:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="指定的 staff_id 不存在",
+        )
+
+    purge_expired_holds(db, owner)
+    expires_at = datetime.utcnow() + timedelta(minutes=hold_in.ttl_minutes)
+    hold = models.OrderHold(
+        staff_id=hold_in.staff_id,
+        start_datetime=hold_in.start_datetime,
+        end_datetime=hold_in.end_datetime,
+        expires_at=expires_at.strftime(_EXPIRES_FORMAT),
+        note=hold_in.note,
+        owner=owner,
+    )
+    db.add(hold)
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        if ORDER_OVERLAP_ERROR not in str(exc.orig):
+            raise
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="该时间段员工已有订单或预留",
+        ) from exc
+    return hold
+
+
+@router.get("", response_model=List[schemas.HoldRead], summary="有效预留列表")
+@query_budget(1)
+def list_holds(
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[models.OrderHold]:
+    return (
+        db.query(models.OrderHold)
+        .filter(
+            models.OrderHold.owner == current_account["username"],
+            models.OrderHold.expires_at > _now_utc(),
+        )
+        .order_by(models.OrderHold.start_datetime, models.OrderHold.id)
+        .all()
+    )
+
+
+@router.delete(
+    "/{hold_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="释放预留",
+)
+@query_budget(1)
+def delete_hold(
+    hold_id: int,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> None:
+    deleted = db.execute(
+        text("DELETE FROM order_holds WHERE id = :id AND owner = :owner"),
+        {"id": hold_id, "owner": current_account["username"]},
+    ).rowcount
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="预留不存在")
+    db.commit()
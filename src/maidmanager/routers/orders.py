@@ -1,17 +1,99 @@
 import json
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import and_, or_
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import and_, func, insert, or_, select, text
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
-from ..database import get_db
+from .. import database
+from ..commission import (
+    CommissionHistory,
+    apply_tier_changes,
+    day_number,
+    load_commission_history,
+    tier_snapshots,
+)
+from ..database import ORDER_HELD_ERROR, ORDER_OVERLAP_ERROR, VersionedCache, get_db
+from ..idempotency import run_idempotent
+from ..query_budget import query_budget
+from ..rollups import mark_rollups_stale
 from ..security import get_current_account
+from .customers import apply_visit_delta, link_customer, visit_snapshot
+from .holds import consume_hold, held_staff_ids
 
 router = APIRouter(prefix="/api", tags=["订单"])
 
+# 列表类读接口只查询 OrderRead 需要的列，返回命名行，不构造 ORM 实例
+_ORDER_READ_COLUMNS = (
+    models.Order.id,
+    models.Order.staff_id,
+    models.Order.customer_name,
+    models.Order.customer_id,
+    models.Order.order_date,
+    models.Order.start_datetime,
+    models.Order.end_datetime,
+    models.Order.duration_minutes,
+    models.Order.booked_minutes,
+    models.Order.total_amount,
+    models.Order.package_id,
+    models.Order.package_name,
+    models.Order.extension_package_ids,
+    models.Order.extra_amount,
+    models.Order.payment_method,
+    models.Order.commission_amount,
+    models.Order.status,
+    models.Order.note,
+    models.Order.created_at,
+)
+
+
+@dataclass(frozen=True)
+class PricingRules:
+    """开单/改单所需的员工、套餐信息与提成配置版本索引。"""
+
+    staff: Dict[int, Row]
+    packages: Dict[int, Row]
+    history: CommissionHistory
+
+
+def _load_pricing(db: Session, owner: str) -> PricingRules:
+    staff = {
+        row.id: row
+        for row in db.execute(
+            select(
+                models.Staff.id,
+                models.Staff.name,
+                models.Staff.status,
+            ).where(models.Staff.owner == owner)
+        )
+    }
+    packages = {
+        row.id: row
+        for row in db.execute(
+            select(
+                models.ServicePackage.id,
+                models.ServicePackage.name,
+                models.ServicePackage.duration_minutes,
+            ).where(models.ServicePackage.owner == owner)
+        )
+    }
+    return PricingRules(
+        staff=staff, packages=packages, history=load_commission_history(db, owner)
+    )
+
+
+# 提成配置按账号缓存在进程内，以数据版本校验：其他 worker 改了员工/套餐/提成后，
+# 本进程下一次开单即重新加载，不会用旧价格计算
+_pricing: VersionedCache[PricingRules] = VersionedCache(
+    ("staff", "service_packages", "commission_versions"), _load_pricing
+)
+
 
 def _parse_dt(raw: str) -> datetime:
     try:
@@ -23,89 +105,175 @@ def _parse_dt(raw: str) -> datetime:
         ) from exc
 
 
+@contextmanager
+def _overlap_guard(db: Session, detail: str) -> Iterator[None]:
+    """将撞单/预留触发器抛出的 IntegrityError 转换为 400。
+
+    前置的重叠查询只用于给出友好提示；并发写入时以触发器为准。
+    """
+    try:
+        yield
+    except IntegrityError as exc:
+        message = str(exc.orig)
+        if ORDER_HELD_ERROR in message:
+            detail = "该时间段已被预留，请选择其他时间或员工"
+        elif ORDER_OVERLAP_ERROR not in message:
+            raise
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=detail
+        ) from exc
+
+
 def _calc_commission_for_package(
-    pkg: Optional[models.ServicePackage],
-    staff: models.Staff,
-    owner: str,
-    db: Session,
+    pkg: Optional[Row], staff: Row, rules: PricingRules, order_date: str
 ) -> float:
+    """按订单日期当时有效的提成配置计算单个套餐的提成。"""
     if pkg is None:
         return 0.0
+    return rules.history.commission(staff.id, pkg.id, order_date)
 
-    if staff.commission_type == "percentage":
-        base_amount = pkg.price or 0.0
-        return base_amount * (staff.commission_value or 0.0)
 
-    if staff.commission_type == "fixed":
-        mapping = (
-            db.query(models.StaffPackageCommission)
-            .filter(
-                models.StaffPackageCommission.staff_id == staff.id,
-                models.StaffPackageCommission.package_id == pkg.id,
-                models.StaffPackageCommission.owner == owner,
-            )
-            .first()
+def _commission_basis(
+    pkg: Optional[Row], ext_ids: List[int], rules: PricingRules, order_date: str
+) -> float:
+    """提成基数：基础套餐与续钟套餐在订单日期的价格之和，无基础套餐时为 0。"""
+    if not pkg:
+        return 0.0
+    package_ids = [pkg.id, *ext_ids]
+    days = [day_number(order_date)] * len(package_ids)
+    return float(rules.history.prices(package_ids, days).sum())
+
+
+def _replace_extensions(
+    db: Session,
+    db_order: models.Order,
+    ext_ids: List[int],
+    staff: Row,
+    owner: str,
+    rules: PricingRules,
+    existing: Sequence[Row] = (),
+) -> List[int]:
+    """按顺序重写订单的续钟明细，返回实际写入的套餐 ID 列表。
+
+    提成按订单日期取当时有效的配置版本批量计算，一次写入提成/时长快照；
+    已删除的套餐沿用 existing（订单原有明细）中的快照，
+    其余不属于当前账号的套餐 ID 会被忽略。
+    """
+    db.query(models.OrderExtension).filter(
+        models.OrderExtension.order_id == db_order.id
+    ).delete(synchronize_session=False)
+    if not ext_ids:
+        return []
+
+    # 已删除套餐的原有快照，同一套餐续钟多次时按顺序逐条沿用
+    orphaned: Dict[int, List[Row]] = {}
+    for row in existing:
+        if row.package_id not in rules.packages:
+            orphaned.setdefault(row.package_id, []).append(row)
+    kept: List[int] = []
+    snapshots: List[Optional[Row]] = []
+    for ext_id in ext_ids:
+        if ext_id in rules.packages:
+            kept.append(ext_id)
+            snapshots.append(None)
+        elif orphaned.get(ext_id):
+            kept.append(ext_id)
+            snapshots.append(orphaned[ext_id].pop(0))
+
+    priced = [ext_id for ext_id, old in zip(kept, snapshots) if old is None]
+    commissions = iter(
+        rules.history.commissions(
+            [staff.id] * len(priced),
+            priced,
+            [day_number(db_order.order_date)] * len(priced),
         )
-        if mapping:
-            return mapping.commission_amount or 0.0
-        return pkg.default_commission or 0.0
+    )
+    rows = [
+        {
+            "order_id": db_order.id,
+            "package_id": package_id,
+            "seq": seq,
+            "commission_snapshot": (
+                float(next(commissions)) if old is None else old.commission_snapshot
+            ),
+            "minutes_snapshot": (
+                rules.packages[package_id].duration_minutes or 0
+                if old is None
+                else old.minutes_snapshot
+            ),
+            "owner": owner,
+        }
+        for seq, (package_id, old) in enumerate(zip(kept, snapshots))
+    ]
+    if rows:
+        # executemany 一次写入，语句数与续钟次数无关
+        db.execute(insert(models.OrderExtension), rows)
+    return kept
+
+
+def _extension_totals(db: Session, order_id: int) -> Tuple[int, float]:
+    """汇总订单续钟明细的时长与提成快照。"""
+    minutes, commission = (
+        db.query(
+            func.coalesce(func.sum(models.OrderExtension.minutes_snapshot), 0),
+            func.coalesce(func.sum(models.OrderExtension.commission_snapshot), 0.0),
+        )
+        .filter(models.OrderExtension.order_id == order_id)
+        .one()
+    )
+    return int(minutes or 0), float(commission or 0.0)
 
-    return 0.0
 
+def _to_order_read(
+    order: Union[models.Order, Row], staff_name: Optional[str]
+) -> schemas.OrderRead:
+    return schemas.OrderRead(
+        id=order.id,
+        staff_id=order.staff_id,
+        staff_name=staff_name,
+        customer_name=order.customer_name,
+        customer_id=order.customer_id,
+        order_date=order.order_date,
+        start_datetime=order.start_datetime,
+        end_datetime=order.end_datetime,
+        duration_minutes=order.duration_minutes,
+        booked_minutes=order.booked_minutes,
+        total_amount=order.total_amount,
+        package_id=order.package_id,
+        package_name=order.package_name,
+        extension_package_ids=order.extension_package_ids,
+        extra_amount=order.extra_amount,
+        payment_method=order.payment_method,
+        commission_amount=order.commission_amount,
+        status=order.status,
+        note=order.note,
+        created_at=order.created_at,
+    )
 
-@router.get(
-    "/orders/day_view",
-    response_model=List[schemas.StaffDaySchedule],
-    summary="某日排班与订单总览",
-)
-def get_day_view(
-    date: str = Query(..., description="日期 YYYY-MM-DD"),
-    db: Session = Depends(get_db),
-    current_account: dict = Depends(get_current_account),
+
+def _build_day_view(
+    staff_list: Sequence[Union[models.Staff, Row]],
+    shift_rows: Sequence[Union[models.WorkShift, Row]],
+    order_rows: Sequence[Union[models.Order, Row]],
 ) -> List[schemas.StaffDaySchedule]:
-    """按员工维度返回某日排班 + 订单，用于日历视图。"""
-    try:
-        datetime.strptime(date, "%Y-%m-%d")
-    except ValueError as exc:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="date 必须为 YYYY-MM-DD 格式",
-        ) from exc
+    """将当日预加载的员工/排班/订单按员工分组组装为日历视图。
 
-    staff_list = (
-        db.query(models.Staff)
-        .filter(
-            models.Staff.status == "active",
-            models.Staff.owner == current_account["username"],
-        )
-        .order_by(models.Staff.id)
-        .all()
-    )
+    各参数可以是 ORM 实例，也可以是只含所需列的命名行（day_view 接口按列查询）；
+    shift_rows、order_rows 需已按开始时间排序且不含已取消订单。
+    """
+    shifts_by_staff: Dict[int, list] = {}
+    for row in shift_rows:
+        shifts_by_staff.setdefault(row.staff_id, []).append(row)
+    orders_by_staff: Dict[int, list] = {}
+    for row in order_rows:
+        orders_by_staff.setdefault(row.staff_id, []).append(row)
 
     result: list[schemas.StaffDaySchedule] = []
     for staff in staff_list:
-        shift_rows = (
-            db.query(models.WorkShift)
-            .filter(
-                models.WorkShift.staff_id == staff.id,
-                models.WorkShift.work_date == date,
-                models.WorkShift.owner == current_account["username"],
-            )
-            .order_by(models.WorkShift.start_time)
-            .all()
-        )
-        order_rows = (
-            db.query(models.Order)
-            .filter(
-                models.Order.staff_id == staff.id,
-                models.Order.order_date == date,
-                models.Order.status != "cancelled",
-                models.Order.owner == current_account["username"],
-            )
-            .order_by(models.Order.start_datetime)
-            .all()
-        )
-        if not shift_rows and not order_rows:
+        staff_shifts = shifts_by_staff.get(staff.id, [])
+        staff_orders = orders_by_staff.get(staff.id, [])
+        if not staff_shifts and not staff_orders:
             # 当日完全没有排班和订单的员工不返回，避免界面过于冗长
             continue
 
@@ -118,57 +286,17 @@ def get_day_view(
                 end_time=row.end_time,
                 staff=None,
             )
-            for row in shift_rows
-        ]
-
-        pending_rows = [row for row in order_rows if row.status == "pending"]
-        actual_rows = [
-            row for row in order_rows if row.status in {"in_progress", "finished", "completed"}
+            for row in staff_shifts
         ]
-
         pending_schemas = [
-            schemas.OrderRead(
-                id=row.id,
-                staff_id=row.staff_id,
-                staff_name=staff.name,
-                customer_name=row.customer_name,
-                order_date=row.order_date,
-                start_datetime=row.start_datetime,
-                end_datetime=row.end_datetime,
-                duration_minutes=row.duration_minutes,
-                total_amount=row.total_amount,
-                package_id=getattr(row, "package_id", None),
-                package_name=getattr(row, "package_name", None),
-                extra_amount=getattr(row, "extra_amount", 0.0),
-                payment_method=row.payment_method,
-                commission_amount=row.commission_amount,
-                status=row.status,
-                note=row.note,
-                created_at=row.created_at,
-            )
-            for row in pending_rows
+            _to_order_read(row, staff.name)
+            for row in staff_orders
+            if row.status == "pending"
         ]
         order_schemas = [
-            schemas.OrderRead(
-                id=row.id,
-                staff_id=row.staff_id,
-                staff_name=staff.name,
-                customer_name=row.customer_name,
-                order_date=row.order_date,
-                start_datetime=row.start_datetime,
-                end_datetime=row.end_datetime,
-                duration_minutes=row.duration_minutes,
-                total_amount=row.total_amount,
-                package_id=getattr(row, "package_id", None),
-                package_name=getattr(row, "package_name", None),
-                extra_amount=getattr(row, "extra_amount", 0.0),
-                payment_method=row.payment_method,
-                commission_amount=row.commission_amount,
-                status=row.status,
-                note=row.note,
-                created_at=row.created_at,
-            )
-            for row in actual_rows
+            _to_order_read(row, staff.name)
+            for row in staff_orders
+            if row.status in {"in_progress", "finished", "completed"}
         ]
 
         result.append(
@@ -183,11 +311,67 @@ def get_day_view(
     return result
 
 
+@router.get(
+    "/orders/day_view",
+    response_model=List[schemas.StaffDaySchedule],
+    summary="某日排班与订单总览",
+)
+@query_budget(3)
+def get_day_view(
+    date: str = Query(..., description="日期 YYYY-MM-DD"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[schemas.StaffDaySchedule]:
+    """按员工维度返回某日排班 + 订单，用于日历视图。"""
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date 必须为 YYYY-MM-DD 格式",
+        ) from exc
+
+    owner = current_account["username"]
+    staff_list = db.execute(
+        select(models.Staff.id, models.Staff.name)
+        .where(
+            models.Staff.status == "active",
+            models.Staff.owner == owner,
+        )
+        .order_by(models.Staff.id)
+    ).all()
+    shift_rows = db.execute(
+        select(
+            models.WorkShift.id,
+            models.WorkShift.staff_id,
+            models.WorkShift.work_date,
+            models.WorkShift.start_time,
+            models.WorkShift.end_time,
+        )
+        .where(
+            models.WorkShift.work_date == date,
+            models.WorkShift.owner == owner,
+        )
+        .order_by(models.WorkShift.start_time)
+    ).all()
+    order_rows = db.execute(
+        select(*_ORDER_READ_COLUMNS)
+        .where(
+            models.Order.order_date == date,
+            models.Order.status != "cancelled",
+            models.Order.owner == owner,
+        )
+        .order_by(models.Order.start_datetime)
+    ).all()
+    return _build_day_view(staff_list, shift_rows, order_rows)
+
+
 @router.get(
     "/orders/marks",
     response_model=List[str],
     summary="订单日历标记（含进行中/待结算/已完成）",
 )
+@query_budget(1)
 def get_order_marks(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
@@ -222,6 +406,7 @@ def get_order_marks(
     response_model=List[schemas.OrderRead],
     summary="某日待处理订单列表",
 )
+@query_budget(1)
 def list_active_orders(
     date: str = Query(..., description="日期 YYYY-MM-DD"),
     db: Session = Depends(get_db),
@@ -237,45 +422,113 @@ def list_active_orders(
         ) from exc
 
     active_status = ("pending", "in_progress", "finished", "completed")
-    rows = (
-        db.query(models.Order, models.Staff.name.label("staff_name"))
+    return db.execute(
+        select(*_ORDER_READ_COLUMNS, models.Staff.name.label("staff_name"))
         .join(models.Staff, models.Staff.id == models.Order.staff_id)
-        .filter(
+        .where(
             models.Order.order_date == date,
             models.Order.status.in_(active_status),
             models.Order.owner == current_account["username"],
             models.Staff.owner == current_account["username"],
         )
         .order_by(models.Order.start_datetime)
-        .all()
-    )
+    ).all()
 
-    result: list[schemas.OrderRead] = []
-    for order, staff_name in rows:
-        result.append(
-            schemas.OrderRead(
-                id=order.id,
-                staff_id=order.staff_id,
-                staff_name=staff_name,
-                customer_name=order.customer_name,
-                order_date=order.order_date,
-                start_datetime=order.start_datetime,
-                end_datetime=order.end_datetime,
-                duration_minutes=order.duration_minutes,
-                booked_minutes=order.booked_minutes,
-                total_amount=order.total_amount,
-                package_id=order.package_id,
-                package_name=order.package_name,
-                extension_package_ids=order.extension_package_ids,
-                extra_amount=order.extra_amount,
-                payment_method=order.payment_method,
-                commission_amount=order.commission_amount,
-                status=order.status,
-                note=order.note,
-                created_at=order.created_at,
-            )
+
+# trigram 分词器按 3 字符切分，更短的词无法走全文索引，改用 LIKE 子串匹配
+_TRIGRAM = 3
+
+
+def _fts_query(terms: List[str]) -> str:
+    """将关键词转换为 trigram 全文查询：每个词加引号转义（子串匹配），多词为 AND。"""
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+@router.get(
+    "/orders/search",
+    response_model=schemas.OrderSearchResponse,
+    summary="按客户名/备注/套餐名搜索订单",
+)
+@query_budget(3)
+def search_orders(
+    q: str = Query(..., min_length=1, description="关键词，按子串匹配，多个词以空格分隔"),
+    from_date: Optional[str] = Query(None, description="起始日期 YYYY-MM-DD（可选）"),
+    to_date: Optional[str] = Query(None, description="结束日期 YYYY-MM-DD（可选）"),
+    limit: int = Query(50, ge=1, le=200, description="每页条数"),
+    offset: int = Query(0, ge=0, description="偏移量"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> schemas.OrderSearchResponse:
+    """全文检索订单（含所有状态），按订单日期倒序分页返回。"""
+    for value in (from_date, to_date):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError as exc:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="日期必须为 YYYY-MM-DD 格式",
+                ) from exc
+    terms = q.split()
+    if not terms:
+        return schemas.OrderSearchResponse(total=0, items=[])
+
+    params = {
+        "owner": current_account["username"],
+        "limit": limit,
+        "offset": offset,
+    }
+    filters = ["o.owner = :owner"]
+    if from_date:
+        filters.append("o.order_date >= :from_date")
+        params["from_date"] = from_date
+    if to_date:
+        filters.append("o.order_date <= :to_date")
+        params["to_date"] = to_date
+
+    indexed = [term for term in terms if len(term) >= _TRIGRAM]
+    if database.fts_enabled and indexed:
+        # CROSS JOIN 固定以全文索引为驱动表，避免按 owner 扫描 orders 后逐行 MATCH
+        source = "orders_fts f CROSS JOIN orders o ON o.id = f.rowid"
+        filters.append("orders_fts MATCH :match")
+        params["match"] = _fts_query(indexed)
+        like_terms = [term for term in terms if len(term) < _TRIGRAM]
+    else:
+        source = "orders o"
+        like_terms = terms
+    for i, term in enumerate(like_terms):
+        params[f"term{i}"] = f"%{database.escape_like(term)}%"
+        filters.append(
+            f"(o.customer_name LIKE :term{i} ESCAPE '\\' "
+            f"OR o.note LIKE :term{i} ESCAPE '\\' "
+            f"OR o.package_name LIKE :term{i} ESCAPE '\\')"
         )
-    return result
+
+    where = f"FROM {source} WHERE {' AND '.join(filters)}"
+    id_rows = db.execute(
+        text(
+            f"SELECT o.id, count(*) OVER () AS total {where} "
+            "ORDER BY o.order_date DESC, o.id DESC "
+            "LIMIT :limit OFFSET :offset"
+        ),
+        params,
+    ).fetchall()
+    if not id_rows:
+        # 偏移超出最后一页时窗口计数不可用，单独统计总数
+        total = db.execute(text(f"SELECT count(*) {where}"), params).scalar() if offset else 0
+        return schemas.OrderSearchResponse(total=total, items=[])
+
+    rows = (
+        db.query(models.Order, models.Staff.name.label("staff_name"))
+        .outerjoin(models.Staff, models.Staff.id == models.Order.staff_id)
+        .filter(models.Order.id.in_([row.id for row in id_rows]))
+        .all()
+    )
+    by_id = {order.id: (order, staff_name) for order, staff_name in rows}
+    items = [
+        _to_order_read(*by_id[row.id]) for row in id_rows if row.id in by_id
+    ]
+    return schemas.OrderSearchResponse(total=id_rows[0].total, items=items)
 
 
 @router.get(
@@ -283,17 +536,21 @@ def list_active_orders(
     response_model=List[schemas.StaffRead],
     summary="查询指定时间段的可用员工",
 )
+@query_budget(4)
 def get_available_staff(
     target_time: str = Query(
         ..., description="目标开始时间 YYYY-MM-DD HH:MM:ss"
     ),
     duration: int = Query(..., description="时长（分钟）"),
+    hold_id: Optional[int] = Query(
+        None, description="本接待持有的预留 ID（不把该预留视为占用）"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> List[schemas.StaffRead]:
-    """根据现有订单计算指定时间段内可接单的员工列表。
+    """根据现有订单与有效预留计算指定时间段内可接单的员工列表。
 
-    规则：只要该时间段内没有与其它订单重叠，即视为可用。
+    规则：只要该时间段内没有与其它订单或他人的预留重叠，即视为可用。
     排班仅用于前端展示，不做硬性限制。
     """
     start_dt = _parse_dt(target_time)
@@ -336,7 +593,10 @@ def get_available_staff(
         .all()
     ]
 
-    available_ids = set(active_staff_ids) - set(busy_staff_ids)
+    held_ids = held_staff_ids(
+        db, current_account["username"], start_dt_str, end_dt_str, hold_id
+    )
+    available_ids = set(active_staff_ids) - set(busy_staff_ids) - held_ids
     if not available_ids:
         return []
 
@@ -349,14 +609,207 @@ def get_available_staff(
     return staff_list
 
 
+# 派单评分权重：排班内优先，其次避免留下接不了单的碎片空档，最后均衡工作量
+SUGGEST_SHIFT_FIT = 40.0
+SUGGEST_SHIFT_PARTIAL = 10.0
+SUGGEST_ADJACENT = 10.0
+SUGGEST_DEAD_GAP = -15.0
+SUGGEST_DAY_LOAD = -20.0
+SUGGEST_MONTH_LOAD = -20.0
+
+
+def _minute_of(dt_str: str, day: datetime) -> int:
+    """YYYY-MM-DD HH:MM:ss 转为相对 day 零点的分钟数（可跨日）。"""
+    minutes = int(dt_str[11:13]) * 60 + int(dt_str[14:16])
+    if dt_str[:10] != day.strftime("%Y-%m-%d"):
+        minutes += (datetime.strptime(dt_str[:10], "%Y-%m-%d") - day).days * 1440
+    return minutes
+
+
+def _gap_side(gap: Optional[int], min_gap: int) -> float:
+    if gap is None:
+        return 0.0
+    if gap == 0:
+        return SUGGEST_ADJACENT
+    if gap < min_gap:
+        return SUGGEST_DEAD_GAP
+    return 0.0
+
+
+@router.get(
+    "/orders/suggest",
+    response_model=List[schemas.StaffSuggestion],
+    summary="新预约派单建议（按排班/空档/工作量打分）",
+)
+@query_budget(6)
+def suggest_staff(
+    target_time: str = Query(
+        ..., description="预约开始时间 YYYY-MM-DD HH:MM:ss"
+    ),
+    package_id: int = Query(..., description="预约套餐ID"),
+    limit: int = Query(10, ge=1, le=100, description="最多返回的候选数"),
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[schemas.StaffSuggestion]:
+    """为指定开始时间与套餐的新预约给空闲员工打分排序。
+
+    当日排班与订单一次性预加载为按员工分组的区间视图，候选评分全部在内存中完成。
+    有时间冲突（订单或有效预留）的员工不参与推荐；与 available_staff 一致，
+    排班只影响分数不做硬性限制。
+    """
+    owner = current_account["username"]
+    start_dt = _parse_dt(target_time)
+
+    packages = (
+        db.query(models.ServicePackage.id, models.ServicePackage.duration_minutes)
+        .filter(models.ServicePackage.owner == owner)
+        .all()
+    )
+    durations = {row.id: row.duration_minutes or 0 for row in packages}
+    duration = durations.get(package_id)
+    if not duration:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="指定的套餐不存在",
+        )
+    # 比最短套餐还短的空档无法再接单，视为碎片
+    min_gap = min(d for d in durations.values() if d > 0)
+
+    day = start_dt.replace(hour=0, minute=0, second=0)
+    day_str = day.strftime("%Y-%m-%d")
+    end_dt = start_dt + timedelta(minutes=duration)
+    window_end = max(day + timedelta(days=1), end_dt)
+    start_min = _minute_of(start_dt.strftime("%Y-%m-%d %H:%M:%S"), day)
+    end_min = start_min + duration
+
+    staff_rows = (
+        db.query(models.Staff.id, models.Staff.name)
+        .filter(models.Staff.status == "active", models.Staff.owner == owner)
+        .order_by(models.Staff.id)
+        .all()
+    )
+    if not staff_rows:
+        return []
+
+    shifts: Dict[int, Tuple[int, int]] = {
+        row.staff_id: (row.start_min, row.end_min)
+        for row in db.query(
+            models.WorkShift.staff_id,
+            models.WorkShift.start_min,
+            models.WorkShift.end_min,
+        ).filter(
+            models.WorkShift.owner == owner,
+            models.WorkShift.work_date == day_str,
+        )
+    }
+
+    # 当日区间视图：staff_id -> [(开始分钟, 结束分钟)]，含跨零点的前后日订单
+    intervals: Dict[int, List[Tuple[int, int]]] = {}
+    day_minutes: Dict[int, int] = {}
+    for row in db.query(
+        models.Order.staff_id,
+        models.Order.order_date,
+        models.Order.start_datetime,
+        models.Order.end_datetime,
+        models.Order.booked_minutes,
+    ).filter(
+        models.Order.owner == owner,
+        models.Order.status != "cancelled",
+        models.Order.start_datetime < window_end.strftime("%Y-%m-%d %H:%M:%S"),
+        models.Order.end_datetime > day.strftime("%Y-%m-%d %H:%M:%S"),
+    ):
+        intervals.setdefault(row.staff_id, []).append(
+            (_minute_of(row.start_datetime, day), _minute_of(row.end_datetime, day))
+        )
+        if row.order_date == day_str:
+            day_minutes[row.staff_id] = (
+                day_minutes.get(row.staff_id, 0) + (row.booked_minutes or 0)
+            )
+
+    month_minutes: Dict[int, int] = {
+        row.staff_id: int(row.minutes or 0)
+        for row in db.query(
+            models.Order.staff_id,
+            func.sum(models.Order.booked_minutes).label("minutes"),
+        )
+        .filter(
+            models.Order.owner == owner,
+            models.Order.status != "cancelled",
+            models.Order.order_date.like(f"{day_str[:7]}-%"),
+        )
+        .group_by(models.Order.staff_id)
+    }
+
+    held_ids = held_staff_ids(
+        db,
+        owner,
+        start_dt.strftime("%Y-%m-%d %H:%M:%S"),
+        end_dt.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+    max_day = max(day_minutes.values(), default=0)
+    max_month = max(month_minutes.values(), default=0)
+    result: List[schemas.StaffSuggestion] = []
+    for staff_id, staff_name in staff_rows:
+        busy = intervals.get(staff_id, [])
+        if staff_id in held_ids or any(s < end_min and e > start_min for s, e in busy):
+            continue
+
+        shift = shifts.get(staff_id)
+        in_shift = bool(shift) and shift[0] <= start_min and end_min <= shift[1]
+        score = 0.0
+        if in_shift:
+            score += SUGGEST_SHIFT_FIT
+        elif shift and shift[0] < end_min and start_min < shift[1]:
+            score += SUGGEST_SHIFT_PARTIAL
+
+        # 空档以相邻订单为界；在排班内时排班起止也算边界
+        prev_edges = [e for _, e in busy if e <= start_min]
+        next_edges = [s for s, _ in busy if s >= end_min]
+        if in_shift:
+            prev_edges.append(shift[0])
+            next_edges.append(shift[1])
+        gap_before = start_min - max(prev_edges) if prev_edges else None
+        gap_after = min(next_edges) - end_min if next_edges else None
+        score += _gap_side(gap_before, min_gap) + _gap_side(gap_after, min_gap)
+
+        booked_day = day_minutes.get(staff_id, 0)
+        booked_month = month_minutes.get(staff_id, 0)
+        if max_day:
+            score += SUGGEST_DAY_LOAD * booked_day / max_day
+        if max_month:
+            score += SUGGEST_MONTH_LOAD * booked_month / max_month
+
+        result.append(
+            schemas.StaffSuggestion(
+                staff_id=staff_id,
+                staff_name=staff_name,
+                score=round(score, 2),
+                in_shift=in_shift,
+                has_shift=shift is not None,
+                gap_before_minutes=gap_before,
+                gap_after_minutes=gap_after,
+                day_booked_minutes=booked_day,
+                month_booked_minutes=booked_month,
+            )
+        )
+
+    result.sort(key=lambda item: (-item.score, item.month_booked_minutes, item.staff_id))
+    return result[:limit]
+
+
 @router.post(
     "/orders",
     response_model=schemas.OrderRead,
     status_code=status.HTTP_201_CREATED,
     summary="创建订单（含提成快照）",
 )
+@query_budget(18)
 def create_order(
     order_in: schemas.OrderCreate,
+    idempotency_key: Optional[str] = Header(
+        None, description="幂等键：重试时携带相同值将直接返回首次结果"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.OrderRead:
@@ -364,14 +817,22 @@ def create_order(
 
     同时做基础的撞单校验（同一员工同一时间段只允许一单）。
     """
-    staff = (
-        db.query(models.Staff)
-        .filter(
-            models.Staff.id == order_in.staff_id,
-            models.Staff.owner == current_account["username"],
-        )
-        .first()
+    return run_idempotent(
+        db,
+        current_account["username"],
+        "create_order",
+        idempotency_key,
+        order_in,
+        lambda: _create_order(order_in, db, current_account),
+        status.HTTP_201_CREATED,
     )
+
+
+def _create_order(
+    order_in: schemas.OrderCreate, db: Session, current_account: dict
+) -> schemas.OrderRead:
+    rules = _pricing.get(db, current_account["username"])
+    staff = rules.staff.get(order_in.staff_id)
     if not staff:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -380,14 +841,7 @@ def create_order(
 
     pkg = None
     if order_in.package_id is not None:
-        pkg = (
-            db.query(models.ServicePackage)
-            .filter(
-                models.ServicePackage.id == order_in.package_id,
-                models.ServicePackage.owner == current_account["username"],
-            )
-            .first()
-        )
+        pkg = rules.packages.get(order_in.package_id)
     if pkg is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -408,34 +862,46 @@ def create_order(
     start_dt_str = start_dt.strftime("%Y-%m-%d %H:%M:%S")
     end_dt_str = end_dt.strftime("%Y-%m-%d %H:%M:%S")
 
-    # 撞单校验：同一员工同一时间段不允许有重叠订单
-    conflict = (
-        db.query(models.Order)
-        .filter(
-            models.Order.staff_id == order_in.staff_id,
-            models.Order.status != "cancelled",
-            and_(
-                models.Order.start_datetime < end_dt_str,
-                models.Order.end_datetime > start_dt_str,
-            ),
-            models.Order.owner == current_account["username"],
+    if order_in.hold_id is not None:
+        # 由预留转订单：预留已保证时间段无冲突，删除预留后直接写入（触发器兜底）
+        consume_hold(
+            db,
+            current_account["username"],
+            order_in.hold_id,
+            order_in.staff_id,
+            start_dt_str,
+            end_dt_str,
         )
-        .first()
-    )
-    if conflict:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="该时间段已存在订单，无法创建新订单",
+    else:
+        # 撞单校验：同一员工同一时间段不允许有重叠订单
+        conflict = (
+            db.query(models.Order)
+            .filter(
+                models.Order.staff_id == order_in.staff_id,
+                models.Order.status != "cancelled",
+                and_(
+                    models.Order.start_datetime < end_dt_str,
+                    models.Order.end_datetime > start_dt_str,
+                ),
+                models.Order.owner == current_account["username"],
+            )
+            .first()
         )
+        if conflict:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="该时间段已存在订单，无法创建新订单",
+            )
 
-    # 计算提成快照
-    commission_amount = _calc_commission_for_package(
-        pkg, staff, current_account["username"], db
-    )
+    # 计算提成快照（按订单日期取当时有效的提成配置）
+    commission_amount = _calc_commission_for_package(pkg, staff, rules, order_date)
 
     db_order = models.Order(
         staff_id=order_in.staff_id,
         customer_name=order_in.customer_name,
+        customer_id=link_customer(
+            db, current_account["username"], order_in.customer_name
+        ),
         order_date=order_date,
         start_datetime=start_dt_str,
         end_datetime=end_dt_str,
@@ -447,15 +913,36 @@ def create_order(
         extra_amount=order_in.extra_amount or 0.0,
         payment_method=order_in.payment_method,
         commission_amount=commission_amount,
+        commission_basis=_commission_basis(pkg, [], rules, order_date),
         status="pending",
         note=order_in.note,
         owner=current_account["username"],
         extension_package_ids=json.dumps([]),
     )
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    return db_order
+    with _overlap_guard(db, "该时间段已存在订单，无法创建新订单"):
+        db.flush()
+
+    # 续钟明细：写入后用聚合结果累加时长与提成
+    if order_in.extension_package_ids:
+        ext_ids = _replace_extensions(
+            db,
+            db_order,
+            order_in.extension_package_ids,
+            staff,
+            current_account["username"],
+            rules,
+        )
+        db.flush()
+        ext_minutes, ext_commission = _extension_totals(db, db_order.id)
+        db_order.extension_package_ids = json.dumps(ext_ids)
+        db_order.booked_minutes = (db_order.booked_minutes or 0) + ext_minutes
+        db_order.commission_amount = commission_amount + ext_commission
+        db_order.commission_basis = _commission_basis(pkg, ext_ids, rules, order_date)
+        db.flush()
+
+    # 由 run_idempotent 提交，以便与保存的幂等响应处于同一事务
+    return _to_order_read(db_order, staff.name)
 
 
 @router.get(
@@ -463,6 +950,7 @@ def create_order(
     response_model=List[schemas.OrderRead],
     summary="历史订单列表",
 )
+@query_budget(1)
 def list_orders(
     from_date: Optional[str] = Query(
         None, description="起始日期 YYYY-MM-DD（可选）"
@@ -490,10 +978,10 @@ def list_orders(
     if to_date:
         to_date = _parse_date(to_date)
 
-    query = (
-        db.query(models.Order, models.Staff.name.label("staff_name"))
+    stmt = (
+        select(*_ORDER_READ_COLUMNS, models.Staff.name.label("staff_name"))
         .join(models.Staff, models.Staff.id == models.Order.staff_id)
-        .filter(
+        .where(
             or_(models.Order.status == "completed", models.Order.status == "cancelled"),
             models.Order.owner == current_account["username"],
             models.Staff.owner == current_account["username"],
@@ -501,37 +989,11 @@ def list_orders(
     )
 
     if from_date:
-        query = query.filter(models.Order.order_date >= from_date)
+        stmt = stmt.where(models.Order.order_date >= from_date)
     if to_date:
-        query = query.filter(models.Order.order_date <= to_date)
+        stmt = stmt.where(models.Order.order_date <= to_date)
 
-    orders = query.order_by(models.Order.created_at.desc()).all()
-
-    result: list[schemas.OrderRead] = []
-    for order, staff_name in orders:
-        result.append(
-            schemas.OrderRead(
-                id=order.id,
-                staff_id=order.staff_id,
-                staff_name=staff_name,
-                customer_name=order.customer_name,
-                order_date=order.order_date,
-                start_datetime=order.start_datetime,
-                end_datetime=order.end_datetime,
-                duration_minutes=order.duration_minutes,
-                total_amount=order.total_amount,
-                package_id=order.package_id,
-                package_name=order.package_name,
-                extension_package_ids=order.extension_package_ids,
-                extra_amount=order.extra_amount,
-                payment_method=order.payment_method,
-                commission_amount=order.commission_amount,
-                status=order.status,
-                note=order.note,
-                created_at=order.created_at,
-            )
-        )
-    return result
+    return db.execute(stmt.order_by(models.Order.created_at.desc())).all()
 
 
 @router.put(
@@ -539,13 +1001,17 @@ def list_orders(
     response_model=schemas.OrderRead,
     summary="修改订单（重新计算提成）",
 )
+@query_budget(25)
 def update_order(
     order_id: int,
     order_in: schemas.OrderUpdate,
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.OrderRead:
-    """修改订单信息，并基于当前提成配置重新计算提成快照。
+    """修改订单信息，并按订单日期当时有效的提成配置重新计算提成快照。
+
+    续钟明细只在续钟套餐或订单日期变化时重写并重新计价，其余编辑保留原有快照；
+    重写时已删除套餐的续钟沿用原快照。
 
     注意：staff_id 不允许在此接口中修改，如需变更服务员工，应取消原订单后重新开单。
     """
@@ -561,15 +1027,13 @@ def update_order(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="订单不存在"
         )
+    old_visit = visit_snapshot(db_order)
+    old_order_date = db_order.order_date
+    old_package_id = db_order.package_id
 
-    staff = (
-        db.query(models.Staff)
-        .filter(
-            models.Staff.id == db_order.staff_id,
-            models.Staff.owner == current_account["username"],
-        )
-        .first()
-    )
+    rules = _pricing.get(db, current_account["username"])
+    old_tier = tier_snapshots(rules.history, [db_order])
+    staff = rules.staff.get(db_order.staff_id)
     if not staff:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -632,40 +1096,24 @@ def update_order(
 
     pkg = None
     if package_id is not None:
-        pkg = (
-            db.query(models.ServicePackage)
-            .filter(
-                models.ServicePackage.id == package_id,
-                models.ServicePackage.owner == current_account["username"],
-            )
-            .first()
-        )
+        pkg = rules.packages.get(package_id)
         if not pkg:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="指定的套餐不存在",
             )
     elif db_order.package_id:
-        pkg = (
-            db.query(models.ServicePackage)
-            .filter(
-                models.ServicePackage.id == db_order.package_id,
-                models.ServicePackage.owner == current_account["username"],
-            )
-            .first()
-        )
+        pkg = rules.packages.get(db_order.package_id)
 
-    # 重新计算提成快照（使用当前配置，基础套餐 + 续钟套餐叠加）
-    commission_amount = _calc_commission_for_package(
-        pkg, staff, current_account["username"], db
-    )
+    # 重新计算提成快照（按订单日期取当时有效的配置，基础套餐 + 续钟套餐叠加）
+    commission_amount = _calc_commission_for_package(pkg, staff, rules, order_date)
 
     # 应用变更
-    db_order.customer_name = (
-        order_in.customer_name
-        if order_in.customer_name is not None
-        else db_order.customer_name
-    )
+    if order_in.customer_name is not None:
+        db_order.customer_name = order_in.customer_name
+        db_order.customer_id = link_customer(
+            db, current_account["username"], order_in.customer_name
+        )
     db_order.order_date = order_date
     db_order.start_datetime = start_dt_str
     db_order.end_datetime = end_dt_str
@@ -690,50 +1138,70 @@ def update_order(
         # 如果指定了新的套餐，则以新套餐时长作为 booked_minutes；无套餐则保持现值
         db_order.booked_minutes = pkg.duration_minutes or db_order.booked_minutes or 0
 
-    # 续钟套餐 ID 列表：extend_package_id 追加；extension_package_ids 可直接覆盖
-    ext_ids: list[int] = []
-    if db_order.extension_package_ids:
-        try:
-            ext_ids = json.loads(db_order.extension_package_ids)
-        except Exception:
-            ext_ids = []
+    # 续钟套餐 ID 列表：extend_package_id 追加；extension_package_ids 可直接覆盖。
+    # 只有续钟变化或订单日期变化时才重写明细并重新计价，其余编辑保留原有快照
+    existing = db.execute(
+        select(
+            models.OrderExtension.package_id,
+            models.OrderExtension.commission_snapshot,
+            models.OrderExtension.minutes_snapshot,
+        )
+        .where(models.OrderExtension.order_id == db_order.id)
+        .order_by(models.OrderExtension.seq)
+    ).all()
+    ext_ids: list[int] = [row.package_id for row in existing]
+    rewrite = order_date != old_order_date
     if order_in.extension_package_ids is not None:
         ext_ids = order_in.extension_package_ids
+        rewrite = True
     elif order_in.extend_package_id:
         ext_ids = ext_ids + [order_in.extend_package_id]
-    db_order.extension_package_ids = json.dumps(ext_ids)
+        rewrite = True
+    if rewrite:
+        ext_ids = _replace_extensions(
+            db, db_order, ext_ids, staff, current_account["username"], rules, existing
+        )
+        db_order.extension_package_ids = json.dumps(ext_ids)
+    with _overlap_guard(db, "该时间段已存在其他订单，无法修改为新的时间范围"):
+        db.flush()
+    ext_minutes, ext_commission = _extension_totals(db, db_order.id)
 
-    # 若提供完整扩展包列表，则重算 booked_minutes = 基础套餐 + 续钟套餐总时长
+    # booked_minutes = 基础套餐 + 续钟套餐总时长
     if pkg:
-        total_minutes = pkg.duration_minutes or 0
-        if ext_ids:
-            ext_pkgs = (
-                db.query(models.ServicePackage)
-                .filter(models.ServicePackage.id.in_(ext_ids))
-                .all()
-            )
-            ext_map = {p.id: p for p in ext_pkgs}
-            for ext_id in ext_ids:
-                if ext_id in ext_map:
-                    total_minutes += ext_map[ext_id].duration_minutes or 0
-        db_order.booked_minutes = total_minutes
+        db_order.booked_minutes = (pkg.duration_minutes or 0) + ext_minutes
 
     # 续钟套餐提成：在基础套餐提成基础上累加续钟套餐提成
-    if pkg and ext_ids:
-        ext_pkgs = (
-            db.query(models.ServicePackage)
-            .filter(models.ServicePackage.id.in_(ext_ids))
-            .all()
-        )
-        for ext in ext_pkgs:
-            commission_amount += _calc_commission_for_package(
-                ext, staff, current_account["username"], db
-            )
+    if pkg:
+        commission_amount += ext_commission
+    db_order.commission_amount = commission_amount
+    if rewrite or package_id != old_package_id:
+        db_order.commission_basis = _commission_basis(pkg, ext_ids, rules, order_date)
 
     if order_in.status is not None:
         db_order.status = order_in.status
 
-    db.commit()
+    # 客户到店统计与订单同一事务增量更新
+    with _overlap_guard(db, "该时间段已存在其他订单，无法修改为新的时间范围"):
+        db.flush()
+    apply_visit_delta(
+        db, current_account["username"], old_visit, visit_snapshot(db_order)
+    )
+    # 分档提成：已完成订单按当月排位计提，改写后的提成由下方 refresh 读回
+    tiers = apply_tier_changes(
+        db,
+        current_account["username"],
+        rules.history,
+        old_tier,
+        tier_snapshots(rules.history, [db_order]),
+    )
+    mark_rollups_stale(
+        db,
+        current_account["username"],
+        [old_order_date, db_order.order_date, *tiers.dates],
+    )
+
+    with _overlap_guard(db, "该时间段已存在其他订单，无法修改为新的时间范围"):
+        db.commit()
     db.refresh(db_order)
 
     return schemas.OrderRead(
@@ -741,13 +1209,16 @@ def update_order(
         staff_id=db_order.staff_id,
         staff_name=staff.name,
         customer_name=db_order.customer_name,
+        customer_id=db_order.customer_id,
         order_date=db_order.order_date,
         start_datetime=db_order.start_datetime,
         end_datetime=db_order.end_datetime,
         duration_minutes=db_order.duration_minutes,
+        booked_minutes=db_order.booked_minutes,
         total_amount=db_order.total_amount,
         package_id=db_order.package_id,
         package_name=db_order.package_name,
+        extension_package_ids=db_order.extension_package_ids,
         extra_amount=db_order.extra_amount,
         payment_method=db_order.payment_method,
         commission_amount=db_order.commission_amount,
@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
+from ..commission import BEGINNING, effective_date, record_package_rule
 from ..database import get_db
+from ..query_budget import query_budget
 from ..security import get_current_account
 
 router = APIRouter(prefix="/api/packages", tags=["套餐"])
@@ -15,6 +17,7 @@ router = APIRouter(prefix="/api/packages", tags=["套餐"])
     response_model=List[schemas.ServicePackageRead],
     summary="套餐列表",
 )
+@query_budget(1)
 def list_packages(
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
@@ -34,6 +37,7 @@ def list_packages(
     status_code=status.HTTP_201_CREATED,
     summary="新增套餐",
 )
+@query_budget(3)
 def create_package(
     payload: schemas.ServicePackageCreate,
     db: Session = Depends(get_db),
@@ -59,6 +63,15 @@ def create_package(
         owner=current_account["username"],
     )
     db.add(db_pkg)
+    db.flush()
+    record_package_rule(
+        db,
+        current_account["username"],
+        db_pkg.id,
+        db_pkg.price,
+        db_pkg.default_commission,
+        BEGINNING,
+    )
     db.commit()
     db.refresh(db_pkg)
     return db_pkg
@@ -69,12 +82,17 @@ def create_package(
     response_model=schemas.ServicePackageRead,
     summary="更新套餐",
 )
+@query_budget(4)
 def update_package(
     package_id: int,
     payload: schemas.ServicePackageUpdate,
+    effective_from: Optional[str] = Query(
+        None, description="价格/默认提成生效日期 YYYY-MM-DD（默认今天）"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.ServicePackageRead:
+    """更新套餐；价格或默认提成的修改自 effective_from 起生效，之前日期的订单仍按旧配置计算。"""
     db_pkg = (
         db.query(models.ServicePackage)
         .filter(
@@ -105,6 +123,16 @@ def update_package(
     for field, value in data.items():
         setattr(db_pkg, field, value)
 
+    if "price" in data or "default_commission" in data:
+        record_package_rule(
+            db,
+            current_account["username"],
+            db_pkg.id,
+            db_pkg.price,
+            db_pkg.default_commission,
+            effective_date(effective_from),
+        )
+
     db.commit()
     db.refresh(db_pkg)
     return db_pkg
@@ -115,6 +143,7 @@ def update_package(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="删除套餐",
 )
+@query_budget(2)
 def delete_package(
     package_id: int,
     db: Session = Depends(get_db),
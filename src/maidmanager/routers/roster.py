@@ -2,15 +2,18 @@ from datetime import datetime, time
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session, joinedload
 
 from .. import models, schemas
 from ..database import get_db
+from ..query_budget import query_budget
 from ..security import get_current_account
 
 router = APIRouter(prefix="/api/roster", tags=["排班"])
 
+ROSTER_BULK_MAX_DAYS = 31
+
 
 def _normalize_time_str(raw: str) -> str:
     """将 HH:MM 或 HH:MM:ss 标准化为 HH:MM:ss 字符串。"""
@@ -28,11 +31,17 @@ def _parse_time(raw: str) -> time:
     return datetime.strptime(normalized, "%H:%M:%S").time()
 
 
+def _minute_of_day(value: time) -> int:
+    """时间转换为当日分钟数，写入 start_min/end_min 供报表直接聚合。"""
+    return value.hour * 60 + value.minute
+
+
 @router.get(
     "",
     response_model=List[schemas.WorkShiftRead],
     summary="获取指定日期排班",
 )
+@query_budget(1)
 def get_roster_by_date(
     date: str = Query(..., description="日期 YYYY-MM-DD"),
     db: Session = Depends(get_db),
@@ -49,6 +58,7 @@ def get_roster_by_date(
 
     shifts = (
         db.query(models.WorkShift)
+        .options(joinedload(models.WorkShift.staff))
         .filter(
             models.WorkShift.work_date == date,
             models.WorkShift.owner == current_account["username"],
@@ -64,6 +74,7 @@ def get_roster_by_date(
     response_model=List[str],
     summary="排班日历标记（按月返回有排班的日期）",
 )
+@query_budget(1)
 def get_roster_marks(
     month: str = Query(..., description="月份 YYYY-MM"),
     db: Session = Depends(get_db),
@@ -96,6 +107,7 @@ def get_roster_marks(
     status_code=status.HTTP_201_CREATED,
     summary="新增排班",
 )
+@query_budget(5)
 def create_work_shift(
     shift_in: schemas.WorkShiftCreate,
     db: Session = Depends(get_db),
@@ -156,11 +168,16 @@ def create_work_shift(
             detail="该员工当天已存在排班，不能重复添加",
         )
 
+    start_min = _minute_of_day(start_time_obj)
+    end_min = _minute_of_day(end_time_obj)
     db_shift = models.WorkShift(
         staff_id=shift_in.staff_id,
         work_date=shift_in.date,
         start_time=start_str,
         end_time=end_str,
+        start_min=start_min,
+        end_min=end_min,
+        duration_min=end_min - start_min,
         owner=current_account["username"],
     )
     db.add(db_shift)
@@ -174,6 +191,7 @@ def create_work_shift(
     response_model=List[schemas.WorkShiftRead],
     summary="复制排班到指定日期",
 )
+@query_budget(4)
 def copy_work_shifts(
     payload: schemas.RosterCopyRequest,
     db: Session = Depends(get_db),
@@ -212,22 +230,194 @@ def copy_work_shifts(
     if target_count > 0 and payload.override:
         target_q.delete(synchronize_session=False)
 
-    new_shifts: list[models.WorkShift] = []
-    for shift in source_shifts:
-        cloned = models.WorkShift(
-            staff_id=shift.staff_id,
-            work_date=payload.to_date,
-            start_time=shift.start_time,
-            end_time=shift.end_time,
-            owner=current_account["username"],
+    # 批量写入后统一重新读取（含员工信息），避免逐条 INSERT/refresh
+    db.execute(
+        insert(models.WorkShift),
+        [
+            {
+                "staff_id": shift.staff_id,
+                "work_date": payload.to_date,
+                "start_time": shift.start_time,
+                "end_time": shift.end_time,
+                "start_min": shift.start_min,
+                "end_min": shift.end_min,
+                "duration_min": shift.duration_min,
+                "created_at": datetime.utcnow(),
+                "owner": current_account["username"],
+            }
+            for shift in source_shifts
+        ],
+    )
+    db.commit()
+    return (
+        db.query(models.WorkShift)
+        .options(joinedload(models.WorkShift.staff))
+        .filter(
+            models.WorkShift.work_date == payload.to_date,
+            models.WorkShift.owner == current_account["username"],
+        )
+        .order_by(models.WorkShift.id)
+        .all()
+    )
+
+
+@router.put(
+    "/bulk",
+    response_model=List[schemas.WorkShiftRead],
+    summary="批量编辑排班（按区间整体提交）",
+)
+@query_budget(7)
+def bulk_update_work_shifts(
+    payload: schemas.RosterBulkRequest,
+    db: Session = Depends(get_db),
+    current_account: dict = Depends(get_current_account),
+) -> List[schemas.WorkShiftRead]:
+    """提交区间内期望的排班，与现有排班比对后在同一事务内新增/修改/删除。
+
+    规则与单条接口一致：同员工同日仅一条排班；删除的排班当日不能有未取消的订单。
+    返回区间内最终的排班列表。
+    """
+    owner = current_account["username"]
+    start_day = datetime.strptime(payload.from_date, "%Y-%m-%d")
+    end_day = datetime.strptime(payload.to_date, "%Y-%m-%d")
+    if start_day > end_day:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="起始日期不能晚于结束日期",
+        )
+    if (end_day - start_day).days + 1 > ROSTER_BULK_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"批量编辑区间最多 {ROSTER_BULK_MAX_DAYS} 天",
         )
-        db.add(cloned)
-        new_shifts.append(cloned)
 
+    desired: dict[tuple[int, str], dict] = {}
+    for shift_in in payload.shifts:
+        if not payload.from_date <= shift_in.date <= payload.to_date:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"排班日期 {shift_in.date} 不在提交区间内",
+            )
+        key = (shift_in.staff_id, shift_in.date)
+        if key in desired:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="同一员工同一天仅允许一条排班",
+            )
+        try:
+            start_time_obj = _parse_time(shift_in.start)
+            end_time_obj = _parse_time(shift_in.end)
+        except ValueError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)
+            ) from exc
+        if start_time_obj >= end_time_obj:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="开始时间必须早于结束时间",
+            )
+        start_min = _minute_of_day(start_time_obj)
+        end_min = _minute_of_day(end_time_obj)
+        desired[key] = {
+            "start_time": start_time_obj.strftime("%H:%M:%S"),
+            "end_time": end_time_obj.strftime("%H:%M:%S"),
+            "start_min": start_min,
+            "end_min": end_min,
+            "duration_min": end_min - start_min,
+        }
+
+    staff_ids = {staff_id for staff_id, _ in desired}
+    if staff_ids:
+        known = {
+            row.id
+            for row in db.query(models.Staff.id).filter(
+                models.Staff.id.in_(staff_ids),
+                models.Staff.owner == owner,
+            )
+        }
+        if staff_ids - known:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="指定的 staff_id 不存在",
+            )
+
+    existing = {
+        (row.staff_id, row.work_date): row
+        for row in db.query(
+            models.WorkShift.id,
+            models.WorkShift.staff_id,
+            models.WorkShift.work_date,
+            models.WorkShift.start_time,
+            models.WorkShift.end_time,
+        ).filter(
+            models.WorkShift.owner == owner,
+            models.WorkShift.work_date >= payload.from_date,
+            models.WorkShift.work_date <= payload.to_date,
+        )
+    }
+
+    inserts = [
+        {
+            "staff_id": staff_id,
+            "work_date": work_date,
+            **values,
+            "created_at": datetime.utcnow(),
+            "owner": owner,
+        }
+        for (staff_id, work_date), values in desired.items()
+        if (staff_id, work_date) not in existing
+    ]
+    updates = [
+        {"id": existing[key].id, **values}
+        for key, values in desired.items()
+        if key in existing
+        and (existing[key].start_time, existing[key].end_time)
+        != (values["start_time"], values["end_time"])
+    ]
+    deletes = {key: row.id for key, row in existing.items() if key not in desired}
+
+    if deletes:
+        # 一次分组查询校验所有待删除排班当日是否有未取消的订单
+        busy = {
+            (row.staff_id, row.order_date)
+            for row in db.query(models.Order.staff_id, models.Order.order_date)
+            .filter(
+                models.Order.owner == owner,
+                models.Order.status != "cancelled",
+                models.Order.order_date >= payload.from_date,
+                models.Order.order_date <= payload.to_date,
+            )
+            .group_by(models.Order.staff_id, models.Order.order_date)
+        }
+        blocked = sorted(key for key in deletes if key in busy)
+        if blocked:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="以下排班当日存在预约/订单，需先取消后再删除："
+                + "、".join(f"员工{staff_id} {work_date}" for staff_id, work_date in blocked),
+            )
+
+    if inserts:
+        db.execute(insert(models.WorkShift), inserts)
+    if updates:
+        db.execute(update(models.WorkShift), updates)
+    if deletes:
+        db.query(models.WorkShift).filter(
+            models.WorkShift.id.in_(list(deletes.values()))
+        ).delete(synchronize_session=False)
     db.commit()
-    for s in new_shifts:
-        db.refresh(s)
-    return new_shifts
+
+    return (
+        db.query(models.WorkShift)
+        .options(joinedload(models.WorkShift.staff))
+        .filter(
+            models.WorkShift.owner == owner,
+            models.WorkShift.work_date >= payload.from_date,
+            models.WorkShift.work_date <= payload.to_date,
+        )
+        .order_by(models.WorkShift.work_date, models.WorkShift.start_time)
+        .all()
+    )
 
 
 @router.delete(
@@ -235,6 +425,7 @@ def copy_work_shifts(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="删除排班（需无预约/订单）",
 )
+@query_budget(3)
 def delete_work_shift(
     shift_id: int,
     db: Session = Depends(get_db),
@@ -280,6 +471,7 @@ def delete_work_shift(
     response_model=schemas.WorkShiftRead,
     summary="编辑排班（修改开始/结束时间）",
 )
+@query_budget(4)
 def update_work_shift(
     shift_id: int,
     payload: schemas.WorkShiftUpdate,
@@ -321,6 +513,9 @@ def update_work_shift(
     # 员工与日期保持不变，仅更新时间
     db_shift.start_time = start_time_obj.strftime("%H:%M:%S")
     db_shift.end_time = end_time_obj.strftime("%H:%M:%S")
+    db_shift.start_min = _minute_of_day(start_time_obj)
+    db_shift.end_min = _minute_of_day(end_time_obj)
+    db_shift.duration_min = db_shift.end_min - db_shift.start_min
     db.commit()
     db.refresh(db_shift)
     return db_shift
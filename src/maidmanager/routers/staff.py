@@ -1,14 +1,44 @@
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
+from ..commission import (
+    BEGINNING,
+    check_commission_type,
+    effective_date,
+    record_staff_rule,
+    tiers_json,
+)
 from ..database import get_db
+from ..query_budget import query_budget
 from ..security import get_current_account
 
 router = APIRouter(prefix="/api/staff", tags=["员工"])
 
+# 列表只读取 StaffRead 需要的列，直接返回命名行，不构造 ORM 实例
+_STAFF_READ_COLUMNS = (
+    models.Staff.id,
+    models.Staff.name,
+    models.Staff.nickname,
+    models.Staff.phone,
+    models.Staff.status,
+    models.Staff.base_salary,
+    models.Staff.commission_type,
+    models.Staff.commission_value,
+    models.Staff.commission_tiers,
+)
+
+
+def _check_tiered(db_staff: models.Staff) -> None:
+    if db_staff.commission_type == "tiered" and not db_staff.commission_tiers:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="分档提成需要填写 commission_tiers",
+        )
+
 
 @router.post(
     "",
@@ -16,6 +46,7 @@ router = APIRouter(prefix="/api/staff", tags=["员工"])
     status_code=status.HTTP_201_CREATED,
     summary="新增员工",
 )
+@query_budget(3)
 def create_staff(
     staff_in: schemas.StaffCreate,
     db: Session = Depends(get_db),
@@ -26,11 +57,7 @@ def create_staff(
     同名员工暂不做强校验，由业务自行约束。
     """
     commission_type = staff_in.commission_type or "percentage"
-    if commission_type not in {"percentage", "fixed"}:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="commission_type 仅支持 percentage 或 fixed",
-        )
+    check_commission_type(commission_type)
 
     db_staff = models.Staff(
         name=staff_in.name,
@@ -40,9 +67,23 @@ def create_staff(
         base_salary=staff_in.base_salary or 0.0,
         commission_type=commission_type,
         commission_value=staff_in.commission_value or 0.0,
+        commission_tiers=tiers_json(
+            [tier.dict() for tier in staff_in.commission_tiers or []]
+        ),
         owner=current_account["username"],
     )
+    _check_tiered(db_staff)
     db.add(db_staff)
+    db.flush()
+    record_staff_rule(
+        db,
+        current_account["username"],
+        db_staff.id,
+        db_staff.commission_type,
+        db_staff.commission_value,
+        db_staff.commission_tiers,
+        BEGINNING,
+    )
     db.commit()
     db.refresh(db_staff)
     return db_staff
@@ -53,6 +94,7 @@ def create_staff(
     response_model=List[schemas.StaffRead],
     summary="员工列表",
 )
+@query_budget(1)
 def list_staff(
     status_filter: Optional[str] = Query(
         None, alias="status", description="按状态过滤：在职/离职"
@@ -61,12 +103,12 @@ def list_staff(
     current_account: dict = Depends(get_current_account),
 ) -> List[schemas.StaffRead]:
     """员工列表，可按状态过滤。"""
-    query = db.query(models.Staff).filter(
+    stmt = select(*_STAFF_READ_COLUMNS).where(
         models.Staff.owner == current_account["username"]
     )
     if status_filter:
-        query = query.filter(models.Staff.status == status_filter)
-    return query.order_by(models.Staff.id.desc()).all()
+        stmt = stmt.where(models.Staff.status == status_filter)
+    return db.execute(stmt.order_by(models.Staff.id.desc())).all()
 
 
 @router.put(
@@ -74,13 +116,20 @@ def list_staff(
     response_model=schemas.StaffRead,
     summary="更新员工信息",
 )
+@query_budget(4)
 def update_staff(
     staff_id: int,
     staff_in: schemas.StaffUpdate,
+    effective_from: Optional[str] = Query(
+        None, description="提成配置生效日期 YYYY-MM-DD（默认今天）"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> schemas.StaffRead:
-    """更新员工信息（部分字段可选）。"""
+    """更新员工信息（部分字段可选）。
+
+    修改提成方式、数值或分档时记录自 effective_from 起生效的新版本，之前日期的订单仍按旧配置计算。
+    """
     db_staff = (
         db.query(models.Staff)
         .filter(
@@ -98,15 +147,25 @@ def update_staff(
 
     if "commission_type" in update_data:
         commission_type = update_data["commission_type"] or "percentage"
-        if commission_type not in {"percentage", "fixed"}:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="commission_type 仅支持 percentage 或 fixed",
-            )
+        check_commission_type(commission_type)
         update_data["commission_type"] = commission_type
+    if "commission_tiers" in update_data:
+        update_data["commission_tiers"] = tiers_json(update_data["commission_tiers"])
 
     for field, value in update_data.items():
         setattr(db_staff, field, value)
+    _check_tiered(db_staff)
+
+    if update_data.keys() & {"commission_type", "commission_value", "commission_tiers"}:
+        record_staff_rule(
+            db,
+            current_account["username"],
+            db_staff.id,
+            db_staff.commission_type,
+            db_staff.commission_value,
+            db_staff.commission_tiers,
+            effective_date(effective_from),
+        )
 
     db.commit()
     db.refresh(db_staff)
@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
+from ..commission import effective_date, record_fixed_rules
 from ..database import get_db
+from ..query_budget import query_budget
 from ..security import get_current_account
 
 router = APIRouter(prefix="/api/staff", tags=["员工"])
@@ -15,6 +17,7 @@ router = APIRouter(prefix="/api/staff", tags=["员工"])
     response_model=List[schemas.StaffPackageCommissionItem],
     summary="查询员工的套餐提成配置",
 )
+@query_budget(3)
 def list_staff_package_commissions(
     staff_id: int,
     db: Session = Depends(get_db),
@@ -71,12 +74,17 @@ def list_staff_package_commissions(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="更新员工的套餐提成配置",
 )
+@query_budget(6)
 def update_staff_package_commissions(
     staff_id: int,
     items: List[schemas.StaffPackageCommissionUpdateItem],
+    effective_from: Optional[str] = Query(
+        None, description="固定提成生效日期 YYYY-MM-DD（默认今天）"
+    ),
     db: Session = Depends(get_db),
     current_account: dict = Depends(get_current_account),
 ) -> None:
+    """更新固定提成配置，自 effective_from 起生效；之前日期的订单仍按旧配置计算。"""
     staff = (
         db.query(models.Staff)
         .filter(
@@ -97,18 +105,18 @@ def update_staff_package_commissions(
                 detail="提成金额不能为负数",
             )
 
-    # 逐条 upsert
-    for item in items:
-        row = (
-            db.query(models.StaffPackageCommission)
-            .filter(
-                models.StaffPackageCommission.staff_id == staff_id,
-                models.StaffPackageCommission.package_id == item.package_id,
-                models.StaffPackageCommission.owner
-                == current_account["username"],
-            )
-            .first()
+    # 一次读取已有配置后逐条 upsert
+    existing = {
+        row.package_id: row
+        for row in db.query(models.StaffPackageCommission)
+        .filter(
+            models.StaffPackageCommission.staff_id == staff_id,
+            models.StaffPackageCommission.owner == current_account["username"],
         )
+        .all()
+    }
+    for item in items:
+        row = existing.get(item.package_id)
         if row:
             row.commission_amount = item.commission_amount
         else:
@@ -119,5 +127,13 @@ def update_staff_package_commissions(
                 owner=current_account["username"],
             )
             db.add(row)
+            existing[item.package_id] = row
 
+    record_fixed_rules(
+        db,
+        current_account["username"],
+        staff_id,
+        {item.package_id: item.commission_amount for item in items},
+        effective_date(effective_from),
+    )
     db.commit()
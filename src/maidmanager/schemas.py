@@ -1,9 +1,17 @@
+import json
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field, validator
 
 
+class CommissionTier(BaseModel):
+    up_to: Optional[int] = Field(
+        None, description="本档截至当月第几单（含），最后一档留空表示不封顶"
+    )
+    rate: float = Field(..., description="本档提成比例（小数）")
+
+
 class StaffBase(BaseModel):
     name: str = Field(..., description="员工姓名")
     nickname: Optional[str] = Field(None, description="昵称")
@@ -11,11 +19,14 @@ class StaffBase(BaseModel):
     status: Optional[str] = Field("active", description="状态：在职 / 离职")
     base_salary: Optional[float] = Field(0.0, description="底薪（元）")
     commission_type: Optional[str] = Field(
-        "percentage", description="提成类型：比例 / 固定金额"
+        "percentage", description="提成类型：比例 / 固定金额 / 分档"
     )
     commission_value: Optional[float] = Field(
         0.0, description="提成数值：比例时填小数（如 0.5），固定金额时填元"
     )
+    commission_tiers: Optional[List[CommissionTier]] = Field(
+        None, description="分档提成：按当月已完成单数分档，各档比例作用于套餐价格"
+    )
 
 
 class StaffCreate(StaffBase):
@@ -31,11 +42,14 @@ class StaffUpdate(BaseModel):
     status: Optional[str] = Field(None, description="状态：在职 / 离职")
     base_salary: Optional[float] = Field(None, description="底薪（元）")
     commission_type: Optional[str] = Field(
-        None, description="提成类型：比例 / 固定金额"
+        None, description="提成类型：比例 / 固定金额 / 分档"
     )
     commission_value: Optional[float] = Field(
         None, description="提成数值：比例时填小数，固定金额时填元"
     )
+    commission_tiers: Optional[List[CommissionTier]] = Field(
+        None, description="分档提成：按当月已完成单数分档"
+    )
 
 
 class StaffRead(StaffBase):
@@ -44,6 +58,11 @@ class StaffRead(StaffBase):
     class Config:
         orm_mode = True
 
+    @validator("commission_tiers", pre=True)
+    def parse_commission_tiers(cls, v: Any) -> Any:
+        # 数据库中以 JSON 文本保存
+        return json.loads(v) if isinstance(v, str) else v
+
 
 class StaffSummary(BaseModel):
     id: int
@@ -108,6 +127,24 @@ class RosterCopyRequest(BaseModel):
         return v
 
 
+class RosterBulkRequest(BaseModel):
+    """批量编辑排班：shifts 为区间内期望的完整排班，未列出的已有排班将被删除。"""
+
+    from_date: str = Field(..., description="起始日期 YYYY-MM-DD")
+    to_date: str = Field(..., description="结束日期 YYYY-MM-DD（含）")
+    shifts: List[WorkShiftCreate] = Field(
+        default_factory=list, description="区间内期望的排班列表"
+    )
+
+    @validator("from_date", "to_date")
+    def validate_dates(cls, v: str) -> str:
+        try:
+            datetime.strptime(v, "%Y-%m-%d")
+        except ValueError as exc:
+            raise ValueError("日期必须是 YYYY-MM-DD 格式") from exc
+        return v
+
+
 class OrderCreate(BaseModel):
     staff_id: int = Field(..., description="员工ID")
     customer_name: Optional[str] = Field(None, description="客户名称")
@@ -127,7 +164,13 @@ class OrderCreate(BaseModel):
     payment_method: Optional[str] = Field(
         None, description="支付方式：微信 / 支付宝 / 现金"
     )
+    extension_package_ids: Optional[List[int]] = Field(
+        None, description="续钟套餐 ID 列表（可选）"
+    )
     note: Optional[str] = Field(None, description="备注")
+    hold_id: Optional[int] = Field(
+        None, description="预留 ID：将该预留直接转为订单（时间段须在预留范围内）"
+    )
 
     @validator("start_datetime", "end_datetime")
     def validate_dt(cls, v: str) -> str:
@@ -184,6 +227,7 @@ class OrderRead(BaseModel):
     staff_id: int
     staff_name: Optional[str] = None
     customer_name: Optional[str]
+    customer_id: Optional[int] = None
     order_date: str
     start_datetime: str
     end_datetime: str
@@ -204,6 +248,23 @@ class OrderRead(BaseModel):
         orm_mode = True
 
 
+class CustomerRead(BaseModel):
+    id: int
+    name: str
+    visit_count: int = 0
+    lifetime_spend: float = 0.0
+    last_visit_date: Optional[str] = None
+    favorite_staff_id: Optional[int] = None
+    favorite_staff_name: Optional[str] = None
+    favorite_package_id: Optional[int] = None
+    favorite_package_name: Optional[str] = None
+
+
+class OrderSearchResponse(BaseModel):
+    total: int
+    items: List[OrderRead]
+
+
 class AvailableStaffQuery(BaseModel):
     target_time: str = Field(
         ..., description="目标开始时间 YYYY-MM-DD HH:MM:ss"
@@ -226,6 +287,9 @@ class SalaryItem(BaseModel):
     commission_total: float
     total_salary: float
     packages: List["SalaryPackageStat"] = []
+    tiers: List["SalaryTierStat"] = Field(
+        default_factory=list, description="分档提成员工的当月各档明细"
+    )
 
 
 class SalarySlipResponse(BaseModel):
@@ -241,6 +305,125 @@ class FinanceDashboardResponse(BaseModel):
     total_salary: float
     total_expenses: float
     net_profit: float
+    revenue_by_payment: Dict[str, float] = Field(
+        default_factory=dict, description="按支付方式的营收（用于对账）"
+    )
+    closed_days: int = Field(0, description="本月已日结且汇总有效的天数")
+
+
+class PortfolioTotals(BaseModel):
+    order_count: int
+    total_revenue: float
+    total_commission: float
+    total_base_salary: float
+    total_salary: float
+    total_expenses: float
+    net_profit: float
+
+
+class PortfolioShopItem(PortfolioTotals):
+    owner: str = Field(..., description="店铺（店长账号）")
+
+
+class PortfolioResponse(BaseModel):
+    month: str
+    closed: bool = Field(..., description="月份已结束（各店数据按月缓存）")
+    shops: List[PortfolioShopItem]
+    totals: PortfolioTotals = Field(..., description="全部关联店铺的合计，与分页无关")
+    shop_count: int = Field(0, description="关联店铺总数")
+    offset: int = Field(0, description="本页第一家店铺的偏移")
+    truncated: bool = Field(
+        False, description="还有后续店铺未返回，以 offset + len(shops) 继续获取"
+    )
+
+
+class DailyCloseRequest(BaseModel):
+    date: str = Field(..., description="营业日 YYYY-MM-DD")
+
+    @validator("date")
+    def validate_date(cls, v: str) -> str:
+        try:
+            datetime.strptime(v, "%Y-%m-%d")
+        except ValueError as exc:
+            raise ValueError("date 必须是 YYYY-MM-DD 格式") from exc
+        return v
+
+
+class CommissionRecomputeResponse(BaseModel):
+    month: str
+    order_count: int = Field(..., description="参与重算的订单数")
+    changed_orders: int = Field(..., description="提成快照有变化的订单数")
+    changed_extensions: int = Field(..., description="提成快照有变化的续钟明细数")
+    commission_before: float
+    commission_after: float
+
+
+class SimulatedStaffRule(BaseModel):
+    """假设的员工提成配置，未填写的字段沿用现有配置。"""
+
+    staff_id: int
+    commission_type: Optional[str] = None
+    commission_value: Optional[float] = None
+    commission_tiers: Optional[List[CommissionTier]] = None
+
+
+class SimulatedPackageRule(BaseModel):
+    package_id: int
+    price: Optional[float] = None
+    default_commission: Optional[float] = None
+
+
+class SimulatedFixedRule(BaseModel):
+    staff_id: int
+    package_id: int
+    commission_amount: float
+
+
+class PayrollSimulationRequest(BaseModel):
+    month: str = Field(..., description="月份 YYYY-MM")
+    staff: List[SimulatedStaffRule] = Field(default_factory=list)
+    packages: List[SimulatedPackageRule] = Field(default_factory=list)
+    fixed_commissions: List[SimulatedFixedRule] = Field(
+        default_factory=list, description="员工套餐固定提成"
+    )
+
+
+class PayrollSimulationItem(BaseModel):
+    staff_id: int
+    staff_name: str
+    base_salary: float
+    order_count: int
+    commission_before: float = Field(..., description="当前提成（与工资条一致）")
+    commission_after: float = Field(..., description="按假设配置试算的提成")
+    difference: float
+    total_salary_before: float
+    total_salary_after: float
+
+
+class PayrollSimulationResponse(BaseModel):
+    month: str
+    order_count: int
+    commission_before: float
+    commission_after: float
+    difference: float
+    items: List[PayrollSimulationItem]
+
+
+class DailyRollupRead(BaseModel):
+    business_date: str
+    order_count: int
+    booked_minutes: int
+    total_revenue: float
+    total_commission: float
+    revenue_by_payment: Dict[str, float]
+    commission_by_staff: Dict[int, float]
+    stale: bool = False
+    closed_orders: Optional[int] = Field(
+        None, description="本次日结由待结算转为已完成的订单数"
+    )
+    open_orders: Optional[int] = Field(
+        None, description="当日仍未结束（待开始/进行中）的订单数"
+    )
 
 
 class SalaryPackageStat(BaseModel):
@@ -249,6 +432,19 @@ class SalaryPackageStat(BaseModel):
     order_count: int
     total_amount: float
     total_commission: float
+    extension_count: int = 0
+    extension_minutes: int = 0
+    extension_commission: float = 0.0
+
+
+class SalaryTierStat(BaseModel):
+    tier: int = Field(..., description="档位（从 1 起）")
+    from_order: int = Field(..., description="本档起始单数")
+    up_to: Optional[int] = Field(None, description="本档截至单数，空为不封顶")
+    rate: float
+    order_count: int
+    basis_amount: float = Field(..., description="本档订单的提成基数（套餐价格）合计")
+    commission: float
 
 
 class StaffAttendanceItem(BaseModel):
@@ -265,6 +461,56 @@ class AttendanceResponse(BaseModel):
     items: List[StaffAttendanceItem]
 
 
+class UtilizationStaffItem(BaseModel):
+    staff_id: int
+    staff_name: str
+    rostered_hours: float
+    booked_hours: float
+    idle_rostered_hours: float = Field(..., description="排班内未被预约占用的时长")
+    off_roster_booked_hours: float = Field(..., description="排班外被预约占用的时长")
+    utilization: float = Field(..., description="排班内被预约占用的比例 0~1")
+    bucket_rostered_minutes: List[int] = Field(
+        ..., description="按 15 分钟时段（一天 96 格）累计的排班分钟数"
+    )
+    bucket_booked_minutes: List[int] = Field(
+        ..., description="按 15 分钟时段累计的预约占用分钟数"
+    )
+    bucket_off_roster_minutes: List[int] = Field(
+        ..., description="按 15 分钟时段累计的排班外预约分钟数"
+    )
+
+
+class UtilizationHourItem(BaseModel):
+    hour: int
+    rostered_hours: float
+    booked_hours: float
+    idle_rostered_hours: float
+    off_roster_booked_hours: float
+    utilization: float
+
+
+class UtilizationResponse(BaseModel):
+    from_date: str
+    to_date: str
+    bucket_minutes: int
+    items: List[UtilizationStaffItem]
+    hours: List[UtilizationHourItem]
+
+
+class DemandForecastItem(BaseModel):
+    weekday: int = Field(..., description="星期几，0 表示周一")
+    hour: int
+    forecast_staff: float = Field(..., description="预测同时在服务的员工数")
+    rostered_staff: float = Field(..., description="目标周该小时的排班人数")
+    suggested_headcount: int = Field(..., description="建议排班人数")
+
+
+class DemandForecastResponse(BaseModel):
+    week_start: str
+    history_weeks: int
+    items: List[DemandForecastItem]
+
+
 class RosterOverviewResponse(BaseModel):
     month: str
     total_shift_hours: float
@@ -326,11 +572,90 @@ class ExpenseUpdate(BaseModel):
 
 class ExpenseRead(ExpenseBase):
     id: int
+    recurring_id: Optional[int] = Field(None, description="生成该支出的周期性支出ID")
 
     class Config:
         orm_mode = True
 
 
+def _validate_month(v: Optional[str]) -> Optional[str]:
+    if v is None:
+        return v
+    try:
+        datetime.strptime(v, "%Y-%m")
+    except ValueError as exc:
+        raise ValueError("月份必须是 YYYY-MM 格式") from exc
+    return v
+
+
+class RecurringExpenseBase(BaseModel):
+    title: str = Field(..., description="支出项名称")
+    amount: float = Field(..., description="每期金额")
+    category: Optional[str] = Field(None, description="类别（选填）")
+    note: Optional[str] = Field(None, description="备注（选填）")
+    cadence: str = Field("monthly", description="周期：monthly / quarterly / yearly")
+    day_of_month: int = Field(1, ge=1, le=28, description="每期支出日期（1-28）")
+    start_month: str = Field(..., description="起始月份 YYYY-MM")
+    end_month: Optional[str] = Field(None, description="结束月份 YYYY-MM（含，选填）")
+
+    @validator("start_month", "end_month")
+    def validate_month(cls, v: Optional[str]) -> Optional[str]:
+        return _validate_month(v)
+
+    @validator("cadence")
+    def validate_cadence(cls, v: str) -> str:
+        if v not in ("monthly", "quarterly", "yearly"):
+            raise ValueError("cadence 必须是 monthly / quarterly / yearly")
+        return v
+
+
+class RecurringExpenseCreate(RecurringExpenseBase):
+    pass
+
+
+class RecurringExpenseUpdate(BaseModel):
+    title: Optional[str] = Field(None, description="支出项名称")
+    amount: Optional[float] = Field(None, description="每期金额")
+    category: Optional[str] = Field(None, description="类别")
+    note: Optional[str] = Field(None, description="备注")
+    cadence: Optional[str] = Field(None, description="周期：monthly / quarterly / yearly")
+    day_of_month: Optional[int] = Field(None, ge=1, le=28, description="每期支出日期（1-28）")
+    start_month: Optional[str] = Field(None, description="起始月份 YYYY-MM")
+    end_month: Optional[str] = Field(None, description="结束月份 YYYY-MM（含）")
+
+    @validator("start_month", "end_month")
+    def validate_month(cls, v: Optional[str]) -> Optional[str]:
+        return _validate_month(v)
+
+    @validator("cadence")
+    def validate_cadence(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None and v not in ("monthly", "quarterly", "yearly"):
+            raise ValueError("cadence 必须是 monthly / quarterly / yearly")
+        return v
+
+
+class RecurringExpenseRead(RecurringExpenseBase):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+
+class RecurringBackfillRequest(BaseModel):
+    from_month: str = Field(..., description="起始月份 YYYY-MM")
+    to_month: str = Field(..., description="结束月份 YYYY-MM（含，不晚于本月）")
+
+    @validator("from_month", "to_month")
+    def validate_month(cls, v: str) -> str:
+        return _validate_month(v)
+
+
+class RecurringBackfillResponse(BaseModel):
+    from_month: str
+    to_month: str
+    created: int = Field(..., description="新生成的支出条数")
+
+
 class ServicePackageBase(BaseModel):
     name: str = Field(..., description="套餐名称")
     duration_minutes: int = Field(..., description="套餐时长（分钟）")
@@ -362,6 +687,52 @@ class ServicePackageRead(ServicePackageBase):
         orm_mode = True
 
 
+class HoldCreate(BaseModel):
+    staff_id: int = Field(..., description="员工ID")
+    start_datetime: str = Field(..., description="开始时间 YYYY-MM-DD HH:MM:ss")
+    end_datetime: str = Field(..., description="结束时间 YYYY-MM-DD HH:MM:ss")
+    ttl_minutes: int = Field(5, ge=1, le=30, description="预留保持的分钟数")
+    note: Optional[str] = Field(None, description="备注（如客户称呼）")
+
+    @validator("start_datetime", "end_datetime")
+    def validate_dt(cls, v: str) -> str:
+        try:
+            datetime.strptime(v, "%Y-%m-%d %H:%M:%S")
+        except ValueError as exc:
+            raise ValueError("时间格式必须为 YYYY-MM-DD HH:MM:ss") from exc
+        return v
+
+
+class HoldRead(BaseModel):
+    id: int
+    staff_id: int
+    start_datetime: str
+    end_datetime: str
+    expires_at: str = Field(..., description="到期时间（UTC）")
+    note: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+
+class StaffSuggestion(BaseModel):
+    """派单建议：分数越高越推荐，各分项便于前台解释推荐理由。"""
+
+    staff_id: int
+    staff_name: str
+    score: float
+    in_shift: bool = Field(..., description="预约是否完整落在当日排班内")
+    has_shift: bool = Field(..., description="当日是否有排班")
+    gap_before_minutes: Optional[int] = Field(
+        None, description="与前一订单（或排班开始）之间的空档分钟数"
+    )
+    gap_after_minutes: Optional[int] = Field(
+        None, description="与后一订单（或排班结束）之间的空档分钟数"
+    )
+    day_booked_minutes: int = 0
+    month_booked_minutes: int = 0
+
+
 class StaffDaySchedule(BaseModel):
     staff_id: int
     staff_name: str
@@ -370,6 +741,19 @@ class StaffDaySchedule(BaseModel):
     orders: List[OrderRead]
 
 
+class DayBundleResponse(BaseModel):
+    """前台日视图聚合数据；未请求的区块为 null。"""
+
+    date: str
+    day_view: Optional[List[StaffDaySchedule]] = None
+    active_orders: Optional[List[OrderRead]] = None
+    roster: Optional[List[WorkShiftRead]] = None
+    packages: Optional[List[ServicePackageRead]] = None
+    staff: Optional[List[StaffRead]] = None
+    order_marks: Optional[List[str]] = None
+    roster_marks: Optional[List[str]] = None
+
+
 class StaffPackageCommissionItem(BaseModel):
     package_id: int
     package_name: str
@@ -380,3 +764,20 @@ class StaffPackageCommissionItem(BaseModel):
 class StaffPackageCommissionUpdateItem(BaseModel):
     package_id: int
     commission_amount: float
+
+
+class ChangeItem(BaseModel):
+    cursor: int
+    entity: str = Field(..., description="表名，如 orders / staff / work_shifts")
+    id: int
+    op: str = Field(..., description="upsert / delete")
+    data: Optional[Dict[str, Any]] = Field(None, description="记录最新内容，删除时为 null")
+
+
+class ChangeFeedResponse(BaseModel):
+    cursor: int = Field(..., description="下次同步使用的游标")
+    has_more: bool
+    resync_required: bool = Field(
+        False, description="为 true 时需先全量拉取，再从 cursor 开始增量同步"
+    )
+    changes: List[ChangeItem]
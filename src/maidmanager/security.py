@@ -1,41 +1,222 @@
-"""极简鉴权与账号隔离工具。"""
+"""鉴权与账号隔离工具。
 
-from typing import Dict, Optional
+账号保存在 users 表，密码以 PBKDF2-SHA256 加盐哈希存储；登录签发带过期时间的
+HMAC-SHA256 令牌 ``<username>.<过期时间戳>.<签名>``。每个请求都要鉴权，
+因此已验证的令牌与账号查询结果分别放在进程内 LRU 缓存中，命中时只需几微秒。
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
 
 from fastapi import Header, HTTPException, status
+from sqlalchemy import text
+
+from .query_budget import uncounted
+
+logger = logging.getLogger(__name__)
 
-# 允许多个账号用于数据隔离；可根据需要扩展。
-ACCOUNTS: Dict[str, Dict[str, str]] = {
+# 首次建库时写入 users 表的示例账号（之后以 users 表为准）
+DEFAULT_ACCOUNTS: Dict[str, Dict[str, str]] = {
     "manager": {"password": "manager123", "role": "manager"},
     "manager1": {"password": "manager123", "role": "manager"},
     "investor": {"password": "investor123", "role": "investor"},
 }
+# 首次建库时写入的投资人 -> 店长账号对应关系
+DEFAULT_INVESTOR_OWNERS: Dict[str, Tuple[str, ...]] = {
+    "investor": ("manager", "manager1"),
+}
+
+PASSWORD_HASH_ITERATIONS = 200_000
+TOKEN_TTL_SECONDS = 7 * 24 * 3600
+# 账号缓存有效期：删除账号或修改角色后最迟这么久生效
+ACCOUNT_CACHE_TTL_SECONDS = 60
+TOKEN_CACHE_SIZE = 4096
+ACCOUNT_CACHE_SIZE = 256
+SECRET_KEY_FILE = "maidmanager_secret.key"
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """线程安全的定长 LRU 缓存。"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def _load_secret_key() -> bytes:
+    """签名密钥：优先取环境变量，否则读取（必要时生成）工作目录下的密钥文件。
+
+    与 SQLite 库文件放在同一目录，重启后已签发的令牌仍然有效。
+    """
+    configured = os.environ.get("MAIDMANAGER_SECRET_KEY")
+    if configured:
+        return configured.encode()
+    try:
+        with open(SECRET_KEY_FILE, "rb") as fh:
+            key = fh.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    key = secrets.token_hex(32).encode()
+    fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(key)
+    logger.info("generated token signing key at %s", os.path.abspath(SECRET_KEY_FILE))
+    return key
+
+
+_secret_key: Optional[bytes] = None
+_secret_lock = threading.Lock()
+
+
+def _secret() -> bytes:
+    global _secret_key
+    if _secret_key is None:
+        with _secret_lock:
+            if _secret_key is None:
+                _secret_key = _load_secret_key()
+    return _secret_key
+
+
+def hash_password(password: str) -> str:
+    """生成 ``pbkdf2_sha256$<迭代次数>$<盐>$<哈希>`` 格式的密码哈希。"""
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS
+    )
+    return f"pbkdf2_sha256${PASSWORD_HASH_ITERATIONS}${salt}${digest.hex()}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        algorithm, iterations, salt, expected = password_hash.split("$", 3)
+    except ValueError:
+        return False
+    if algorithm != "pbkdf2_sha256":
+        return False
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", password.encode(), salt.encode(), int(iterations)
+    )
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def _sign(message: str) -> str:
+    digest = hmac.new(_secret(), message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def issue_token(username: str, now: Optional[float] = None) -> str:
+    expires = int((now if now is not None else time.time()) + TOKEN_TTL_SECONDS)
+    message = f"{username}.{expires}"
+    return f"{message}.{_sign(message)}"
+
+
+def _verify_token(token: str) -> Optional[Tuple[str, int]]:
+    """校验签名，返回 (用户名, 过期时间戳)；不检查是否过期。"""
+    parts = token.rsplit(".", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    username, expires, signature = parts
+    if not hmac.compare_digest(_sign(f"{username}.{expires}"), signature):
+        return None
+    return username, int(expires)
+
+
+# 令牌 -> (用户名, 过期时间戳)；只缓存签名校验通过的令牌
+_token_cache: LRUCache[str, Tuple[str, int]] = LRUCache(TOKEN_CACHE_SIZE)
+# 用户名 -> (账号信息或 None, 查询时刻)；None 表示账号不存在，同样缓存以挡住重复查询
+_account_cache: LRUCache[str, Tuple[Optional[Dict[str, str]], float]] = LRUCache(
+    ACCOUNT_CACHE_SIZE
+)
+
+
+def load_account(username: str) -> Optional[Dict[str, str]]:
+    """按用户名读取账号（带缓存），不存在时返回 None。"""
+    now = time.monotonic()
+    cached = _account_cache.get(username)
+    if cached is not None and now - cached[1] < ACCOUNT_CACHE_TTL_SECONDS:
+        return cached[0]
+    # database 依赖本模块提供的 get_current_account，这里延迟导入以避免循环导入
+    from .database import SessionLocal
+
+    # 鉴权查询被缓存且与业务数据量无关，不计入路由的查询预算
+    with uncounted(), SessionLocal() as db:
+        row = db.execute(
+            text("SELECT username, role FROM users WHERE username = :username"),
+            {"username": username},
+        ).first()
+    account = {"username": row.username, "role": row.role or "manager"} if row else None
+    _account_cache.put(username, (account, now))
+    return account
+
+
+def invalidate_account(username: str) -> None:
+    """账号被修改或删除后调用，使缓存立即失效。"""
+    _account_cache.pop(username)
+
+
+def clear_auth_caches() -> None:
+    _token_cache.clear()
+    _account_cache.clear()
 
 
-def _parse_token(token: str) -> Optional[str]:
-    prefix = "fake-token-"
-    if token.startswith(prefix):
-        username = token[len(prefix) :]
-        if username in ACCOUNTS:
-            return username
-    return None
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
 
 
 def get_current_account(
     authorization: Optional[str] = Header(None),
 ) -> Dict[str, str]:
-    """从 Authorization 头中提取账号信息，格式：Bearer fake-token-<username>。"""
+    """从 Authorization 头中提取账号信息，格式：Bearer <token>。"""
     if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="缺少或无效的身份凭证",
-        )
+        raise _unauthorized("缺少或无效的身份凭证")
     token = authorization.split(" ", 1)[1].strip()
-    username = _parse_token(token)
-    if not username:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的身份凭证",
-        )
-    account = ACCOUNTS[username]
-    return {"username": username, "role": account["role"]}
+    verified = _token_cache.get(token)
+    if verified is None:
+        verified = _verify_token(token)
+        if verified is None:
+            raise _unauthorized("无效的身份凭证")
+        _token_cache.put(token, verified)
+    username, expires = verified
+    if expires <= time.time():
+        _token_cache.pop(token)
+        raise _unauthorized("登录已过期，请重新登录")
+    account = load_account(username)
+    if account is None:
+        raise _unauthorized("无效的身份凭证")
+    return dict(account)
@@ -0,0 +1,87 @@
+"""工资试算：用假设的提成配置在内存中重算某月提成，不写库。
+
+假设配置视为自该月 1 日起生效，并覆盖该月内同一 (员工, 套餐) 原有的版本；
+未填写的字段沿用该月末有效的配置。整月已完成订单按列读取一次，
+与 recompute_commissions 共用同一套向量化计算。
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from .commission import (
+    VersionRow,
+    build_commission_history,
+    compute_month,
+    day_number,
+    load_month_orders,
+    load_versions,
+)
+
+# (员工 id, 套餐 id) -> 要覆盖的版本字段；员工配置的套餐为 0，套餐配置的员工为 0
+Overrides = Dict[Tuple[int, int], Dict[str, Any]]
+
+
+@dataclass
+class StaffPayroll:
+    staff_id: int
+    order_count: int
+    commission_before: float
+    commission_after: float
+
+
+def overlay_versions(
+    rows: Sequence[VersionRow], month: str, overrides: Overrides
+) -> List[VersionRow]:
+    """在原有版本上叠加自该月 1 日起生效的假设版本，返回重新排序后的版本。"""
+    start = day_number(f"{month}-01")
+    end = start + 30
+    current: Dict[Tuple[int, int], VersionRow] = {}
+    kept: List[VersionRow] = []
+    for row in rows:
+        key = (row.staff_id, row.package_id)
+        if key in overrides and row.day <= end:
+            current[key] = row  # 行已按生效日期升序，最后一条即月末有效的版本
+        if key not in overrides or not start <= row.day <= end:
+            kept.append(row)
+
+    for (staff_id, package_id), changes in overrides.items():
+        base = current.get((staff_id, package_id)) or VersionRow(
+            staff_id, package_id, start, None, None, None, None, None
+        )
+        version = base._replace(day=start, **changes)
+        if version.commission_type == "tiered" and not version.commission_tiers:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="分档提成需要填写 commission_tiers",
+            )
+        kept.append(version)
+    return sorted(kept, key=lambda row: (row.staff_id, row.package_id, row.day))
+
+
+def simulate_month(
+    db: Session, owner: str, month: str, overrides: Overrides
+) -> List[StaffPayroll]:
+    """按员工汇总该月已完成订单的当前提成与试算提成（两条订单查询 + 一条版本查询）。"""
+    orders = load_month_orders(db, owner, month, completed_only=True)
+    history = build_commission_history(
+        overlay_versions(load_versions(db, owner), month, overrides)
+    )
+    after = compute_month(history, orders).commission
+
+    staff_ids, slot = np.unique(orders.staff_ids, return_inverse=True)
+    counts = np.bincount(slot, minlength=len(staff_ids))
+    before_sum = np.bincount(slot, weights=orders.commission, minlength=len(staff_ids))
+    after_sum = np.bincount(slot, weights=after, minlength=len(staff_ids))
+    return [
+        StaffPayroll(
+            staff_id=int(staff_id),
+            order_count=int(counts[i]),
+            commission_before=float(before_sum[i]),
+            commission_after=float(after_sum[i]),
+        )
+        for i, staff_id in enumerate(staff_ids)
+    ]
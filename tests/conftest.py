@@ -0,0 +1,204 @@
+"""测试公共夹具：在临时目录中启动应用，并通过接口灌入两种规模的数据。
+
+主库与分库路径都是相对当前目录的，因此整个会话切换到临时目录运行。
+小数据集写入 manager 店铺，大数据集写入 manager1 店铺，两者互不干扰。
+"""
+
+import os
+import sys
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from itertools import count
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# 规模 -> (店铺账号, 员工数, 每名员工每天的订单数)
+SIZES: Dict[str, Tuple[str, int, int]] = {
+    "small": ("manager", 3, 2),
+    "large": ("manager1", 30, 6),
+}
+
+_last_month_end = date.today().replace(day=1) - timedelta(days=1)
+MONTH = _last_month_end.strftime("%Y-%m")
+DAYS = [f"{MONTH}-{day:02d}" for day in (10, 11, 12)]
+
+
+def login(client: TestClient, username: str, password: str) -> Dict[str, str]:
+    response = client.post(
+        "/api/login", json={"username": username, "password": password}
+    )
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer " + response.json()["token"]}
+
+
+@dataclass
+class Dataset:
+    """一个已灌入数据的店铺：记录创建出的 id，供各路由用例引用。"""
+
+    size: str
+    client: TestClient
+    headers: Dict[str, str]
+    staff_ids: List[int] = field(default_factory=list)
+    package_ids: List[int] = field(default_factory=list)
+    shift_ids: List[int] = field(default_factory=list)
+    order_ids: List[int] = field(default_factory=list)
+    customer_ids: List[int] = field(default_factory=list)
+    expense_ids: List[int] = field(default_factory=list)
+    recurring_ids: List[int] = field(default_factory=list)
+    _slots: "count[int]" = field(default_factory=lambda: count(0))
+    _days: "count[int]" = field(default_factory=lambda: count(60))
+
+    def call(self, method: str, url: str, expected: int = 200, **kwargs):
+        """不计入预算的辅助请求（用例的前置数据）。"""
+        kwargs.setdefault("headers", self.headers)
+        response = self.client.request(method, url, **kwargs)
+        assert response.status_code == expected, (url, response.text)
+        return response.json() if response.content else None
+
+    def free_slot(self) -> Tuple[str, str]:
+        """返回第一名员工尚未被占用的一小时时段，供写入类用例创建订单/预留。"""
+        slot = next(self._slots)
+        day = date.fromisoformat(DAYS[0]) + timedelta(days=10 + slot // 10)
+        hour = 9 + slot % 10
+        return (
+            f"{day} {hour:02d}:00:00",
+            f"{day} {hour:02d}:59:00",
+        )
+
+    def free_day(self) -> str:
+        """返回尚无排班的日期，供排班类用例写入。"""
+        return str(date.fromisoformat(DAYS[0]) + timedelta(days=next(self._days)))
+
+    def new_order(self, **extra) -> dict:
+        start, end = self.free_slot()
+        body = {
+            "staff_id": self.staff_ids[0],
+            "package_id": self.package_ids[0],
+            "customer_name": "预算用例",
+            "start_datetime": start,
+            "end_datetime": end,
+            "total_amount": 200,
+        }
+        body.update(extra)
+        return self.call("POST", "/api/orders", 201, json=body)
+
+
+def seed(client: TestClient, size: str) -> Dataset:
+    username, staff_count, orders_per_day = SIZES[size]
+    data = Dataset(size, client, login(client, username, "manager123"))
+
+    for minutes, price in ((60, 200), (90, 280), (30, 100)):
+        package = data.call(
+            "POST",
+            "/api/packages",
+            201,
+            json={
+                "name": f"{minutes}分钟",
+                "duration_minutes": minutes,
+                "price": price,
+                "default_commission": price * 0.4,
+            },
+        )
+        data.package_ids.append(package["id"])
+
+    for i in range(staff_count):
+        rule = (
+            {"commission_type": "percentage", "commission_value": 0.5}
+            if i % 3 == 0
+            else {"commission_type": "fixed"}
+            if i % 3 == 1
+            else {
+                "commission_type": "tiered",
+                "commission_tiers": [
+                    {"up_to": 1000, "rate": 0.3},
+                    {"up_to": None, "rate": 0.5},
+                ],
+            }
+        )
+        staff = data.call("POST", "/api/staff", 201, json={"name": f"员工{i}", **rule})
+        data.staff_ids.append(staff["id"])
+        if i % 3 == 1:
+            data.call(
+                "PUT",
+                f"/api/staff/{staff['id']}/package_commissions",
+                204,
+                json=[{"package_id": data.package_ids[0], "commission_amount": 90}],
+            )
+
+    for day in DAYS:
+        for staff_id in data.staff_ids:
+            shift = data.call(
+                "POST",
+                "/api/roster",
+                201,
+                json={"staff_id": staff_id, "date": day, "start": "10:00", "end": "22:00"},
+            )
+            data.shift_ids.append(shift["id"])
+            for n in range(orders_per_day):
+                order = data.call(
+                    "POST",
+                    "/api/orders",
+                    201,
+                    json={
+                        "staff_id": staff_id,
+                        "package_id": data.package_ids[n % 2],
+                        "customer_name": f"客户{(staff_id + n) % 20}",
+                        "start_datetime": f"{day} {10 + 2 * n:02d}:00:00",
+                        "end_datetime": f"{day} {11 + 2 * n:02d}:00:00",
+                        "total_amount": 200,
+                        "note": "要求加钟" if n % 2 else None,
+                    },
+                )
+                data.order_ids.append(order["id"])
+                if n % 3 != 2:
+                    data.call(
+                        "PUT",
+                        f"/api/orders/{order['id']}",
+                        json={
+                            "status": "completed",
+                            "extension_package_ids": [data.package_ids[2]] if n % 2 else [],
+                            "payment_method": "cash",
+                        },
+                    )
+
+    data.customer_ids = [c["id"] for c in data.call("GET", "/api/customers")]
+    for i in range(staff_count):
+        expense = data.call(
+            "POST",
+            "/api/expenses",
+            201,
+            json={"title": f"耗材{i}", "amount": 50 + i, "expense_date": DAYS[i % 3]},
+        )
+        data.expense_ids.append(expense["id"])
+    recurring = data.call(
+        "POST",
+        "/api/expenses/recurring",
+        201,
+        json={"title": "房租", "amount": 3000, "category": "rent", "start_month": MONTH},
+    )
+    data.recurring_ids.append(recurring["id"])
+    return data
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("maidmanager")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from maidmanager.main import app
+
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session", params=sorted(SIZES))
+def dataset(request, client) -> Dataset:
+    return seed(client, request.param)
@@ -0,0 +1,98 @@
+"""撞单与预留的行为用例：数据库触发器拒绝重叠订单和占用有效预留的订单，预留可转为订单。
+
+用例在 manager 店铺新建自己的员工，时段放在远期日期，不与预算用例的数据集相互影响。
+"""
+
+import pytest
+
+from conftest import login
+
+DAY = "2031-09-01"
+HELD_DETAIL = "该时间段已被预留，请选择其他时间或员工"
+
+
+@pytest.fixture
+def booking(client):
+    headers = login(client, "manager", "manager123")
+
+    def call(method: str, url: str, expected: int, **kwargs):
+        response = client.request(method, url, headers=headers, **kwargs)
+        assert response.status_code == expected, (url, response.text)
+        return response.json() if response.content else None
+
+    package_id = call(
+        "POST",
+        "/api/packages",
+        201,
+        json={"name": "预留用例套餐", "duration_minutes": 60, "price": 200},
+    )["id"]
+    staff_id = call(
+        "POST",
+        "/api/staff",
+        201,
+        json={"name": "预留用例", "commission_type": "percentage", "commission_value": 0.5},
+    )["id"]
+
+    def order_body(start: str, end: str, **extra) -> dict:
+        return {
+            "staff_id": staff_id,
+            "package_id": package_id,
+            "start_datetime": f"{DAY} {start}:00",
+            "end_datetime": f"{DAY} {end}:00",
+            "total_amount": 200,
+            **extra,
+        }
+
+    def hold_body(start: str, end: str) -> dict:
+        return {
+            "staff_id": staff_id,
+            "start_datetime": f"{DAY} {start}:00",
+            "end_datetime": f"{DAY} {end}:00",
+        }
+
+    return call, order_body, hold_body
+
+
+def test_overlapping_order_is_rejected(booking):
+    call, order_body, _ = booking
+    call("POST", "/api/orders", 201, json=order_body("10:00", "11:00"))
+
+    call("POST", "/api/orders", 400, json=order_body("10:30", "11:30"))
+    # 首尾相接不算重叠
+    call("POST", "/api/orders", 201, json=order_body("11:00", "12:00"))
+
+
+def test_order_into_active_hold_is_rejected(booking):
+    call, order_body, hold_body = booking
+    call("POST", "/api/holds", 201, json=hold_body("13:00", "14:00"))
+
+    rejected = call("POST", "/api/orders", 400, json=order_body("13:30", "14:30"))
+    assert rejected["detail"] == HELD_DETAIL
+
+    # 改单挪进预留的时段同样被拒绝，原订单保持不变
+    order = call("POST", "/api/orders", 201, json=order_body("15:00", "16:00"))
+    rejected = call(
+        "PUT",
+        f"/api/orders/{order['id']}",
+        400,
+        json={"start_datetime": f"{DAY} 13:00:00", "end_datetime": f"{DAY} 14:00:00"},
+    )
+    assert rejected["detail"] == HELD_DETAIL
+
+    # 预留不能覆盖已有订单
+    call("POST", "/api/holds", 400, json=hold_body("15:30", "16:30"))
+
+
+def test_hold_converts_to_order(booking):
+    call, order_body, hold_body = booking
+    hold = call("POST", "/api/holds", 201, json=hold_body("17:00", "18:00"))
+
+    # 时段与预留不一致时不能转单
+    call("POST", "/api/orders", 400, json=order_body("17:00", "18:30", hold_id=hold["id"]))
+
+    order = call("POST", "/api/orders", 201, json=order_body("17:00", "18:00", hold_id=hold["id"]))
+    assert order["start_datetime"] == f"{DAY} 17:00:00"
+    assert hold["id"] not in [item["id"] for item in call("GET", "/api/holds", 200)]
+
+    # 预留已被消耗，不能再次转单
+    call("POST", "/api/orders", 400, json=order_body("17:00", "18:00", hold_id=hold["id"]))
@@ -0,0 +1,53 @@
+"""幂等键的行为用例：重放返回首次结果且不重复写库，同一键用于不同请求体返回 422。"""
+
+from conftest import login
+
+DAY = "2031-10-01"
+
+
+def _order_body(staff_id: int, package_id: int, hour: int) -> dict:
+    return {
+        "staff_id": staff_id,
+        "package_id": package_id,
+        "start_datetime": f"{DAY} {hour:02d}:00:00",
+        "end_datetime": f"{DAY} {hour:02d}:59:00",
+        "total_amount": 200,
+    }
+
+
+def test_create_order_replays_and_rejects_reused_key(client):
+    headers = login(client, "manager", "manager123")
+    package_id = client.post(
+        "/api/packages",
+        headers=headers,
+        json={"name": "幂等用例套餐", "duration_minutes": 60, "price": 200},
+    ).json()["id"]
+    staff_id = client.post(
+        "/api/staff",
+        headers=headers,
+        json={"name": "幂等用例", "commission_type": "percentage", "commission_value": 0.5},
+    ).json()["id"]
+    keyed = {**headers, "Idempotency-Key": "test-idempotency-order"}
+    body = _order_body(staff_id, package_id, 10)
+
+    first = client.post("/api/orders", headers=keyed, json=body)
+    assert first.status_code == 201, first.text
+    assert "Idempotent-Replayed" not in first.headers
+
+    # 重试：同一键同一请求体返回首次的响应，而不是撞单的 400
+    replay = client.post("/api/orders", headers=keyed, json=body)
+    assert replay.status_code == 201, replay.text
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == first.json()
+
+    # 同一键换了请求体：拒绝，且不会写入新订单
+    other = client.post(
+        "/api/orders", headers=keyed, json=_order_body(staff_id, package_id, 12)
+    )
+    assert other.status_code == 422, other.text
+    assert other.json()["detail"] == "Idempotency-Key 已用于其他请求"
+
+    day_view = client.get(f"/api/orders/day_view?date={DAY}", headers=headers).json()
+    (schedule,) = [item for item in day_view if item["staff_id"] == staff_id]
+    booked = schedule["pending_orders"] + schedule["orders"]
+    assert [order["id"] for order in booked] == [first.json()["id"]]
@@ -0,0 +1,335 @@
+"""每个接口在两种数据规模下执行的 SQL 条数都不超过其 @query_budget 声明。
+
+中间件在响应头中给出 X-Query-Count 与 X-Query-Budget；运行时超预算只记警告，
+在这里失败。用例中的前置请求（如删除前先创建）不计入被测请求。
+"""
+
+from typing import Callable, Dict, Tuple
+
+import pytest
+from fastapi.routing import APIRoute
+
+from conftest import DAYS, MONTH, Dataset, login
+
+# (方法, 路径) -> 根据数据集构造 (url, 请求参数, 期望状态码)
+Spec = Callable[[Dataset], Tuple[str, dict, int]]
+SPECS: Dict[Tuple[str, str], Spec] = {}
+
+
+def spec(method: str, path: str):
+    def register(fn: Spec) -> Spec:
+        SPECS[(method, path)] = fn
+        return fn
+
+    return register
+
+
+def _get(url: str, expected: int = 200) -> Spec:
+    return lambda data: (url, {}, expected)
+
+
+# ---- 登录 / 员工 / 排班 ----
+
+
+@spec("POST", "/api/login")
+def _(data):
+    return "/api/login", {"json": {"username": "manager", "password": "manager123"}, "headers": {}}, 200
+
+
+@spec("POST", "/api/staff")
+def _(data):
+    return "/api/staff", {"json": {"name": "新员工", "commission_type": "percentage", "commission_value": 0.4}}, 201
+
+
+SPECS[("GET", "/api/staff")] = _get("/api/staff")
+
+
+@spec("PUT", "/api/staff/{staff_id}")
+def _(data):
+    return f"/api/staff/{data.staff_ids[-1]}", {"json": {"commission_value": 0.45}}, 200
+
+
+@spec("GET", "/api/staff/{staff_id}/package_commissions")
+def _(data):
+    return f"/api/staff/{data.staff_ids[1]}/package_commissions", {}, 200
+
+
+@spec("PUT", "/api/staff/{staff_id}/package_commissions")
+def _(data):
+    body = [{"package_id": pid, "commission_amount": 70} for pid in data.package_ids]
+    return f"/api/staff/{data.staff_ids[1]}/package_commissions", {"json": body}, 204
+
+
+SPECS[("GET", "/api/roster")] = _get(f"/api/roster?date={DAYS[0]}")
+SPECS[("GET", "/api/roster/marks")] = _get(f"/api/roster/marks?month={MONTH}")
+
+
+@spec("POST", "/api/roster")
+def _(data):
+    day = data.free_day()
+    body = {"staff_id": data.staff_ids[-1], "date": day, "start": "10:00", "end": "18:00"}
+    return "/api/roster", {"json": body}, 201
+
+
+@spec("POST", "/api/roster/copy")
+def _(data):
+    target = data.free_day()
+    return "/api/roster/copy", {"json": {"from_date": DAYS[0], "to_date": target}}, 200
+
+
+@spec("PUT", "/api/roster/bulk")
+def _(data):
+    day = data.free_day()
+    shifts = [
+        {"staff_id": staff_id, "date": day, "start": "11:00", "end": "19:00"}
+        for staff_id in data.staff_ids
+    ]
+    return "/api/roster/bulk", {"json": {"from_date": day, "to_date": day, "shifts": shifts}}, 200
+
+
+@spec("PUT", "/api/roster/{shift_id}")
+def _(data):
+    return f"/api/roster/{data.shift_ids[0]}", {"json": {"end": "22:30"}}, 200
+
+
+@spec("DELETE", "/api/roster/{shift_id}")
+def _(data):
+    day = data.free_day()
+    shift = data.call(
+        "POST",
+        "/api/roster",
+        201,
+        json={"staff_id": data.staff_ids[-1], "date": day, "start": "10:00", "end": "12:00"},
+    )
+    return f"/api/roster/{shift['id']}", {}, 204
+
+
+# ---- 订单 / 预留 / 客户 ----
+
+
+SPECS[("GET", "/api/orders/day_view")] = _get(f"/api/orders/day_view?date={DAYS[0]}")
+SPECS[("GET", "/api/orders/marks")] = _get(f"/api/orders/marks?month={MONTH}")
+SPECS[("GET", "/api/orders/active")] = _get(f"/api/orders/active?date={DAYS[0]}")
+SPECS[("GET", "/api/orders/search")] = _get("/api/orders/search?q=客户1 加钟")
+SPECS[("GET", "/api/orders")] = _get("/api/orders")
+SPECS[("GET", "/api/available_staff")] = _get(
+    f"/api/available_staff?target_time={DAYS[1]} 13:30:00&duration=60"
+)
+
+
+@spec("GET", "/api/orders/suggest")
+def _(data):
+    return f"/api/orders/suggest?target_time={DAYS[1]} 13:30:00&package_id={data.package_ids[0]}", {}, 200
+
+
+@spec("POST", "/api/orders")
+def _(data):
+    start, end = data.free_slot()
+    body = {
+        "staff_id": data.staff_ids[0],
+        "package_id": data.package_ids[0],
+        "customer_name": "客户1",
+        "start_datetime": start,
+        "end_datetime": end,
+        "total_amount": 200,
+        "extension_package_ids": [data.package_ids[2]],
+        "payment_method": "wechat",
+    }
+    return "/api/orders", {"json": body}, 201
+
+
+@spec("PUT", "/api/orders/{order_id}")
+def _(data):
+    order = data.new_order()
+    body = {
+        "status": "completed",
+        "extension_package_ids": [data.package_ids[2]],
+        "payment_method": "cash",
+        "note": "续钟",
+    }
+    return f"/api/orders/{order['id']}", {"json": body}, 200
+
+
+@spec("POST", "/api/holds")
+def _(data):
+    start, end = data.free_slot()
+    body = {"staff_id": data.staff_ids[0], "start_datetime": start, "end_datetime": end}
+    return "/api/holds", {"json": body}, 201
+
+
+SPECS[("GET", "/api/holds")] = _get("/api/holds")
+
+
+@spec("DELETE", "/api/holds/{hold_id}")
+def _(data):
+    start, end = data.free_slot()
+    hold = data.call(
+        "POST",
+        "/api/holds",
+        201,
+        json={"staff_id": data.staff_ids[0], "start_datetime": start, "end_datetime": end},
+    )
+    return f"/api/holds/{hold['id']}", {}, 204
+
+
+SPECS[("GET", "/api/customers")] = _get("/api/customers?q=客户")
+
+
+@spec("GET", "/api/customers/{customer_id}")
+def _(data):
+    return f"/api/customers/{data.customer_ids[0]}", {}, 200
+
+
+SPECS[("GET", "/api/day_bundle")] = _get(f"/api/day_bundle?date={DAYS[0]}")
+
+# ---- 财务 ----
+
+SPECS[("GET", "/api/finance/salary_slip")] = _get(f"/api/finance/salary_slip?month={MONTH}")
+SPECS[("GET", "/api/finance/dashboard")] = _get(f"/api/finance/dashboard?month={MONTH}")
+SPECS[("GET", "/api/finance/attendance")] = _get(f"/api/finance/attendance?month={MONTH}")
+SPECS[("GET", "/api/finance/roster_overview")] = _get(
+    f"/api/finance/roster_overview?month={MONTH}"
+)
+SPECS[("GET", "/api/finance/utilization")] = _get(
+    f"/api/finance/utilization?from={DAYS[0]}&to={DAYS[-1]}"
+)
+SPECS[("GET", "/api/finance/demand_forecast")] = _get(
+    f"/api/finance/demand_forecast?week={DAYS[-1]}"
+)
+SPECS[("GET", "/api/finance/daily_rollups")] = _get(f"/api/finance/daily_rollups?month={MONTH}")
+
+
+@spec("GET", "/api/finance/portfolio")
+def _(data):
+    headers = login(data.client, "investor", "investor123")
+    return f"/api/finance/portfolio?month={MONTH}", {"headers": headers}, 200
+
+
+@spec("POST", "/api/finance/close_day")
+def _(data):
+    return "/api/finance/close_day", {"json": {"date": DAYS[0]}}, 200
+
+
+@spec("POST", "/api/finance/recompute_commissions")
+def _(data):
+    return f"/api/finance/recompute_commissions?month={MONTH}", {}, 200
+
+
+@spec("POST", "/api/finance/simulate")
+def _(data):
+    body = {
+        "month": MONTH,
+        "staff": [{"staff_id": data.staff_ids[0], "commission_value": 0.6}],
+        "packages": [{"package_id": data.package_ids[0], "default_commission": 100}],
+        "fixed_commissions": [
+            {"staff_id": data.staff_ids[1], "package_id": data.package_ids[1], "commission_amount": 120}
+        ],
+    }
+    return "/api/finance/simulate", {"json": body}, 200
+
+
+# ---- 支出 / 套餐 / 变更同步 ----
+
+
+@spec("POST", "/api/expenses")
+def _(data):
+    return "/api/expenses", {"json": {"title": "水电", "amount": 300, "expense_date": DAYS[1]}}, 201
+
+
+SPECS[("GET", "/api/expenses")] = _get(f"/api/expenses?month={MONTH}")
+
+
+@spec("PUT", "/api/expenses/{expense_id}")
+def _(data):
+    return f"/api/expenses/{data.expense_ids[0]}", {"json": {"amount": 88}}, 200
+
+
+@spec("DELETE", "/api/expenses/{expense_id}")
+def _(data):
+    expense = data.call(
+        "POST", "/api/expenses", 201, json={"title": "临时", "amount": 1, "expense_date": DAYS[0]}
+    )
+    return f"/api/expenses/{expense['id']}", {}, 204
+
+
+@spec("POST", "/api/expenses/recurring")
+def _(data):
+    body = {"title": "网费", "amount": 200, "category": "utilities", "start_month": MONTH}
+    return "/api/expenses/recurring", {"json": body}, 201
+
+
+SPECS[("GET", "/api/expenses/recurring")] = _get("/api/expenses/recurring")
+
+
+@spec("POST", "/api/expenses/recurring/backfill")
+def _(data):
+    return "/api/expenses/recurring/backfill", {"json": {"from_month": MONTH, "to_month": MONTH}}, 200
+
+
+@spec("PUT", "/api/expenses/recurring/{recurring_id}")
+def _(data):
+    return f"/api/expenses/recurring/{data.recurring_ids[0]}", {"json": {"amount": 3200}}, 200
+
+
+@spec("DELETE", "/api/expenses/recurring/{recurring_id}")
+def _(data):
+    recurring = data.call(
+        "POST",
+        "/api/expenses/recurring",
+        201,
+        json={"title": "临时", "amount": 1, "start_month": MONTH},
+    )
+    return f"/api/expenses/recurring/{recurring['id']}", {}, 204
+
+
+SPECS[("GET", "/api/packages")] = _get("/api/packages")
+
+
+@spec("POST", "/api/packages")
+def _(data):
+    body = {"name": "120分钟", "duration_minutes": 120, "price": 360, "default_commission": 150}
+    return "/api/packages", {"json": body}, 201
+
+
+@spec("PUT", "/api/packages/{package_id}")
+def _(data):
+    return f"/api/packages/{data.package_ids[1]}", {"json": {"price": 300}}, 200
+
+
+@spec("DELETE", "/api/packages/{package_id}")
+def _(data):
+    package = data.call(
+        "POST",
+        "/api/packages",
+        201,
+        json={"name": "临时", "duration_minutes": 15, "price": 50, "default_commission": 10},
+    )
+    return f"/api/packages/{package['id']}", {}, 204
+
+
+SPECS[("GET", "/api/changes")] = _get("/api/changes?since=0")
+
+
+def _budgeted_routes(app):
+    for included in app.routes:
+        routes = getattr(included, "original_router", None)
+        for route in routes.routes if routes else [included]:
+            if isinstance(route, APIRoute) and hasattr(route.endpoint, "__query_budget__"):
+                for method in route.methods:
+                    yield method, route.path
+
+
+def test_every_budgeted_route_has_a_case(client):
+    assert set(_budgeted_routes(client.app)) == set(SPECS)
+
+
+@pytest.mark.parametrize("route", sorted(SPECS), ids=" ".join)
+def test_route_within_budget(dataset, route):
+    url, kwargs, expected = SPECS[route](dataset)
+    kwargs.setdefault("headers", dataset.headers)
+    response = dataset.client.request(route[0], url, **kwargs)
+
+    assert response.status_code == expected, response.text
+    used = int(response.headers["X-Query-Count"])
+    budget = int(response.headers["X-Query-Budget"])
+    assert used <= budget, f"{dataset.size}: {route[0]} {url} 执行 {used} 条 SQL，预算 {budget}"
@@ -0,0 +1,159 @@
+"""分档提成的行为用例：排位、跨档与改单后的重排，工资条与逐单提成一致。
+
+每个用例新建自己的分档员工，订单放在远期月份，不与预算用例的数据集相互影响。
+前 2 单按 10% 计提，之后按 50%；套餐价 200，因此逐单提成为 20 或 100。
+"""
+
+from calendar import monthrange
+from typing import Dict
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import login
+
+TIERS = [{"up_to": 2, "rate": 0.1}, {"up_to": None, "rate": 0.5}]
+LOW, HIGH = 20.0, 100.0
+
+
+class Shop:
+    """manager 店铺中的一名分档员工及其下单、改单与对账辅助方法。"""
+
+    def __init__(self, client: TestClient, name: str) -> None:
+        self.client = client
+        self.headers = login(client, "manager", "manager123")
+        self.package_id = self.call(
+            "POST",
+            "/api/packages",
+            201,
+            json={"name": f"{name}套餐", "duration_minutes": 60, "price": 200},
+        )["id"]
+        self.staff_id = self.call(
+            "POST",
+            "/api/staff",
+            201,
+            json={"name": name, "commission_type": "tiered", "commission_tiers": TIERS},
+        )["id"]
+
+    def call(self, method: str, url: str, expected: int = 200, **kwargs):
+        response = self.client.request(method, url, headers=self.headers, **kwargs)
+        assert response.status_code == expected, (url, response.text)
+        return response.json() if response.content else None
+
+    def order(self, day: str, hour: int) -> int:
+        """在 day 的 hour 点下一单并完成，返回订单 id。"""
+        order = self.call(
+            "POST",
+            "/api/orders",
+            201,
+            json={
+                "staff_id": self.staff_id,
+                "package_id": self.package_id,
+                "start_datetime": f"{day} {hour:02d}:00:00",
+                "end_datetime": f"{day} {hour:02d}:59:00",
+                "total_amount": 200,
+            },
+        )
+        self.update(order["id"], status="completed")
+        return order["id"]
+
+    def update(self, order_id: int, **changes) -> dict:
+        return self.call("PUT", f"/api/orders/{order_id}", json=changes)
+
+    def commissions(self, month: str) -> Dict[int, float]:
+        """该员工当月已完成订单的提成：订单 id -> 提成。"""
+        last_day = monthrange(*map(int, month.split("-")))[1]
+        orders = self.call(
+            "GET",
+            "/api/orders",
+            params={"from_date": f"{month}-01", "to_date": f"{month}-{last_day}"},
+        )
+        return {
+            order["id"]: order["commission_amount"]
+            for order in orders
+            if order["staff_id"] == self.staff_id and order["status"] == "completed"
+        }
+
+    def slip(self, month: str) -> dict:
+        items = self.call("GET", "/api/finance/salary_slip", params={"month": month})["items"]
+        (item,) = [item for item in items if item["staff_id"] == self.staff_id]
+        return item
+
+    def assert_slip_matches(self, month: str) -> None:
+        """工资条的提成合计与各档明细都应与逐单提成一致。"""
+        commissions = self.commissions(month)
+        item = self.slip(month)
+        assert item["commission_total"] == pytest.approx(sum(commissions.values()))
+        assert sum(tier["order_count"] for tier in item["tiers"]) == len(commissions)
+        assert sum(tier["commission"] for tier in item["tiers"]) == pytest.approx(
+            sum(commissions.values())
+        )
+
+
+def test_orders_cross_tier_boundary_in_start_order(client):
+    shop = Shop(client, "分档跨档")
+    # 下单顺序与开始时间不同：排位按开始时间
+    late = shop.order("2031-03-05", 15)
+    early = shop.order("2031-03-05", 10)
+    middle = shop.order("2031-03-05", 12)
+    last = shop.order("2031-03-06", 10)
+
+    assert shop.commissions("2031-03") == {early: LOW, middle: LOW, late: HIGH, last: HIGH}
+    tiers = shop.slip("2031-03")["tiers"]
+    assert [(t["from_order"], t["up_to"], t["order_count"]) for t in tiers] == [
+        (1, 2, 2),
+        (3, None, 2),
+    ]
+    assert [t["commission"] for t in tiers] == [2 * LOW, 2 * HIGH]
+    shop.assert_slip_matches("2031-03")
+
+
+def test_cancel_and_recomplete_rerank_later_orders(client):
+    shop = Shop(client, "分档重排")
+    first = shop.order("2031-04-05", 10)
+    second = shop.order("2031-04-05", 12)
+    third = shop.order("2031-04-05", 14)
+    assert shop.commissions("2031-04") == {first: LOW, second: LOW, third: HIGH}
+
+    # 取消排在中间的订单，其后的订单前移一位、落回第一档
+    shop.update(second, status="cancelled")
+    assert shop.commissions("2031-04") == {first: LOW, third: LOW}
+    shop.assert_slip_matches("2031-04")
+
+    shop.update(second, status="completed")
+    assert shop.commissions("2031-04") == {first: LOW, second: LOW, third: HIGH}
+    shop.assert_slip_matches("2031-04")
+
+
+def test_backdated_order_pushes_later_orders_up_a_tier(client):
+    shop = Shop(client, "分档补录")
+    first = shop.order("2031-05-10", 10)
+    second = shop.order("2031-05-10", 12)
+    backdated = shop.order("2031-05-02", 10)
+
+    assert shop.commissions("2031-05") == {backdated: LOW, first: LOW, second: HIGH}
+    shop.assert_slip_matches("2031-05")
+
+
+def test_order_moved_to_another_month_reranks_both_months(client):
+    shop = Shop(client, "分档跨月")
+    first = shop.order("2031-06-05", 10)
+    moved = shop.order("2031-06-05", 12)
+    third = shop.order("2031-06-05", 14)
+    following = shop.order("2031-07-05", 10)
+    assert shop.commissions("2031-07") == {following: LOW}
+
+    # 改到下月第一单之前：原月份后移的订单落回第一档，下月两单都在第一档
+    shop.update(
+        moved,
+        start_datetime="2031-07-01 10:00:00",
+        end_datetime="2031-07-01 10:59:00",
+    )
+    assert shop.commissions("2031-06") == {first: LOW, third: LOW}
+    assert shop.commissions("2031-07") == {moved: LOW, following: LOW}
+    shop.assert_slip_matches("2031-06")
+    shop.assert_slip_matches("2031-07")
+
+    shop.order("2031-07-20", 10)
+    assert sorted(shop.commissions("2031-07").values()) == [LOW, LOW, HIGH]
+    shop.assert_slip_matches("2031-07")